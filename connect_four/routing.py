@@ -1,4 +1,6 @@
-from channels.routing import ProtocolTypeRouter, URLRouter
+from channels.routing import ChannelNameRouter, ProtocolTypeRouter, URLRouter
+from django.conf import settings
+from games.actors import GameActorConsumer
 import games.routing
 import presence.routing
 
@@ -9,6 +11,10 @@ url_patterns = (
 application = ProtocolTypeRouter(
     {
         # (http->django views is added by default)
-        "websocket": URLRouter(url_patterns)
+        "websocket": URLRouter(url_patterns),
+        # Workers owning the game actors, see games.actors
+        "channel": ChannelNameRouter(
+            {name: GameActorConsumer for name in settings.GAME_ACTOR_CHANNELS}
+        ),
     }
 )
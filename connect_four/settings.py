@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/3.0/ref/settings/
 """
 
 import os
+import sys
 from dotenv import load_dotenv
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
@@ -124,4 +125,72 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Shared by every process. "default" holds the game states and timelines, which
+# can be dropped at any time. "coordination" holds the matchmaking queues, the
+# lobby presence and their locks, which must not be culled to make room: it is
+# a separate Redis database (the compose Redis keeps the default noeviction
+# policy) or a memory cache without a size limit.
+# Without REDIS_HOST (local runs and tests) every process has its own memory
+# caches, which only works with a single process.
+if os.getenv("REDIS_HOST"):
+    CACHES = {
+        "default": {
+            "BACKEND": "django_redis.cache.RedisCache",
+            "LOCATION": "redis://{}:6379/1".format(os.getenv("REDIS_HOST")),
+        },
+        "coordination": {
+            "BACKEND": "django_redis.cache.RedisCache",
+            "LOCATION": "redis://{}:6379/2".format(os.getenv("REDIS_HOST")),
+        },
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            # Culls a third of the keys once full
+            "OPTIONS": {"MAX_ENTRIES": 10000},
+        },
+        "coordination": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "coordination",
+            # Keys expire, but are never culled
+            "OPTIONS": {"MAX_ENTRIES": sys.maxsize},
+        },
+    }
+
 INTERNAL_IPS = ("127.0.0.1",)
+
+# Queue of games waiting for a second player. CacheQueue is shared through the
+# cache, InMemoryQueue only works inside a single process
+MATCHMAKING_QUEUE = "games.matchmaking.CacheQueue"
+# Users connected to the lobby. CachePresence is shared through the cache,
+# InMemoryPresence only works inside a single process
+PRESENCE_STORE = "presence.store.CachePresence"
+# Lobby joins and leaves are broadcast in batches, sent once no event arrived
+# for LOBBY_BATCH_WINDOW seconds, and at most LOBBY_BATCH_MAX_DELAY seconds late
+LOBBY_BATCH_WINDOW = 0.25
+LOBBY_BATCH_MAX_DELAY = 1.0
+
+# Seconds the bot opponent can spend searching each move
+BOT_TIME_BUDGET = 1.0
+# Seconds a hint can spend searching
+HINT_TIME_BUDGET = 0.5
+# Processes used for bot and hint searches (None uses one per CPU)
+ANALYSIS_WORKERS = None
+# Built with `python manage.py build_opening_book`, ignored if it doesn't exist
+OPENING_BOOK_PATH = os.path.join(BASE_DIR, "opening_book.bin")
+# Write-behind mode: moves are broadcast right away and written in batches by a
+# background thread, every MOVE_LOG_FLUSH_INTERVAL seconds or as soon as
+# MOVE_LOG_MAX_PENDING moves are waiting. Needs every move of a game to go
+# through the same process (see games.move_log)
+MOVE_WRITE_BEHIND = False
+MOVE_LOG_FLUSH_INTERVAL = 0.5
+MOVE_LOG_MAX_PENDING = 500
+# Channels of the workers running the game actors (`runworker <channel>`).
+# Games are spread over them by consistent hashing. Empty runs the actors in
+# the process of the socket, which is only safe with a single process.
+GAME_ACTOR_CHANNELS = []
+# Actors without moves for this many seconds are stopped
+GAME_ACTOR_IDLE_TIMEOUT = 60
+# Records consumer metrics and serves them at /metrics/ (Prometheus text format)
+METRICS_ENABLED = bool(os.getenv("METRICS_ENABLED"))
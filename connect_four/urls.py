@@ -14,11 +14,13 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.urls import path
-from games.views import PickUser, GameView
+from games.views import PickUser, GameView, ReplayView, MetricsView
 from presence.views import LobbyView
 
 urlpatterns = [
     path("", PickUser.as_view(), name="home"),
     path("play/<int:game_id>/", GameView.as_view(), name="game"),
+    path("play/<int:game_id>/replay/", ReplayView.as_view(), name="replay"),
     path("lobby/", LobbyView.as_view(), name="lobby"),
+    path("metrics/", MetricsView.as_view(), name="metrics"),
 ]
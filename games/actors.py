@@ -0,0 +1,273 @@
+"""
+Single writer for every active game. The moves of a game go through the queue
+of its actor, an asyncio task that keeps the game in memory and applies them
+one at a time, so the game row is neither locked nor read again while the
+actor is alive.
+
+An actor lives in the process that owns its game. With GAME_ACTOR_CHANNELS
+set, games are spread over those channels by consistent hashing of their id
+(each channel served by `python manage.py runworker <channel>`), and sockets
+send their moves there over the channel layer. Otherwise every process runs
+the actors of its own sockets, which is only a single writer with a single
+process. Moves are still written on the version of the game they were played
+on (see Game.change_state_forward), so a second writer, or a player taking
+the empty seat, makes the actor reload the game and play the move again.
+"""
+
+import asyncio
+import bisect
+import hashlib
+import json
+import logging
+from functools import lru_cache
+from channels.consumer import AsyncConsumer
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import transaction
+from . import metrics
+from .analysis import analysis_service
+from .models import Game, GameConflict
+from .move_log import MoveLogFull, move_log, write_behind
+
+logger = logging.getLogger(__name__)
+
+
+def ring_hash(key):
+    return int(hashlib.md5(key.encode()).hexdigest()[:16], 16)
+
+
+class HashRing:
+    """
+    Consistent hashing of keys over nodes. Every node is placed at several
+    points of the ring, so adding or removing one only moves about 1/n of the keys.
+    """
+
+    def __init__(self, nodes, replicas=64):
+        self.ring = sorted(
+            (ring_hash("{}:{}".format(node, i)), node)
+            for node in nodes
+            for i in range(replicas)
+        )
+        self.points = [point for point, _ in self.ring]
+
+    def node_for(self, key):
+        index = bisect.bisect(self.points, ring_hash(str(key))) % len(self.points)
+        return self.ring[index][1]
+
+
+@lru_cache(maxsize=None)
+def _ring(channels):
+    return HashRing(channels)
+
+
+def actor_channel(game_id):
+    """
+    Channel of the worker that owns the game, None if actors are local
+    """
+    channels = tuple(getattr(settings, "GAME_ACTOR_CHANNELS", ()))
+    if not channels:
+        return None
+    return _ring(channels).node_for(game_id)
+
+
+@database_sync_to_async
+def load_game(game_id):
+    return move_log.get_game(game_id) or Game.objects.get(id=game_id)
+
+
+def play(game, player, move, persist):
+    if player is None:
+        game.play_bot_move(move, persist)
+    else:
+        game.change_state_forward(player, move, persist)
+
+
+@database_sync_to_async
+def apply_move(game, player, move):
+    """
+    Plays the move on the game in memory and writes it (logs it in write-behind mode)
+    player is None for the bot's reply
+    Returns the delta for the move, None if it was rejected
+    Raises GameConflict if the game changed since it was loaded, and MoveLogFull
+    if the move log has no room for it
+    """
+    if write_behind():
+        with move_log.slot(game):
+            play(game, player, move, persist=False)
+            if game.last_move is not None:
+                move_log.append(game)
+    else:
+        with transaction.atomic():
+            play(game, player, move, persist=True)
+    if game.last_move is None:
+        return None
+    return game.to_delta_json()
+
+
+class GameActor:
+    """
+    Owns one game. Commands are dicts with the kind ("move" or "bot"), the move,
+    and the player and reply channel for moves or the seq it was searched at for
+    the bot. The actor stops after GAME_ACTOR_IDLE_TIMEOUT seconds without commands.
+    """
+
+    def __init__(self, game_id, channel_layer, registry):
+        self.game_id = game_id
+        self.channel_layer = channel_layer
+        self.registry = registry
+        self.game = None
+        self.queue = asyncio.Queue()
+        self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def run(self):
+        timeout = getattr(settings, "GAME_ACTOR_IDLE_TIMEOUT", 60)
+        try:
+            while True:
+                try:
+                    command = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    if self.queue.empty():
+                        break
+                    continue
+                try:
+                    await self.handle(command)
+                except Exception:
+                    logger.exception(
+                        "Game %s: could not handle %s", self.game_id, command
+                    )
+                    self.game = None
+        finally:
+            # Nothing awaits from here on, so no command can be queued meanwhile
+            self.registry.forget(self)
+
+    async def handle(self, command):
+        if self.game is None:
+            self.game = await load_game(self.game_id)
+        if command["kind"] == "bot":
+            if command["seq"] != self.game.seq:
+                return
+            player = None
+        else:
+            player = command["player"]
+
+        reason = None
+        try:
+            delta = await apply_move(self.game, player, command["move"])
+        except GameConflict:
+            logger.warning("Game %s was changed by another writer", self.game_id)
+            reason = "conflict"
+            delta = await self.retry(player, command["move"])
+        except MoveLogFull:
+            logger.warning("Game %s: the move log is full", self.game_id)
+            reason, delta = "busy", None
+
+        if delta is None:
+            if command.get("reply_channel"):
+                rejected = {"type": "rejected", "seq": self.game.seq}
+                if reason:
+                    rejected["reason"] = reason
+                await self.channel_layer.send(
+                    command["reply_channel"],
+                    {"type": "game_message", "message": json.dumps(rejected)},
+                )
+            return
+        with metrics.GROUP_SEND_SECONDS.time("game"):
+            await self.channel_layer.group_send(
+                self.game_id, {"type": "game_message", "message": delta}
+            )
+        if self.game.bot_to_move():
+            asyncio.ensure_future(self.bot_reply(self.game))
+
+    async def retry(self, player, move):
+        """
+        Reloads the game and plays the move again, once
+        The bot's reply isn't, it was searched on the old position
+        """
+        self.game = await load_game(self.game_id)
+        if player is None:
+            return None
+        try:
+            return await apply_move(self.game, player, move)
+        except (GameConflict, MoveLogFull):
+            self.game = await load_game(self.game_id)
+            return None
+
+    async def bot_reply(self, game):
+        """
+        Searches in the analysis pool, without holding up the queue, and queues
+        the reply. It is dropped if the game moved on in the meantime.
+        """
+        seq = game.seq
+        try:
+            move, _score = await analysis_service.evaluate(
+                game.python_board,
+                False,
+                game.win_length,
+                getattr(settings, "BOT_TIME_BUDGET", 1.0),
+            )
+        except Exception:
+            logger.exception("Game %s: bot search failed", self.game_id)
+            return
+        if move is not None:
+            self.registry.submit(
+                self.channel_layer,
+                {"game_id": self.game_id, "kind": "bot", "move": move, "seq": seq},
+            )
+
+
+class ActorRegistry:
+    """
+    Actors of the games owned by this process, started by their first command
+    """
+
+    def __init__(self):
+        self.actors = {}
+
+    def submit(self, channel_layer, command):
+        """
+        Queues the command for the actor of its game. Must be called from the event loop.
+        """
+        game_id = str(command["game_id"])
+        actor = self.actors.get(game_id)
+        if actor is None:
+            actor = self.actors[game_id] = GameActor(game_id, channel_layer, self)
+        actor.queue.put_nowait(command)
+
+    def forget(self, actor):
+        if self.actors.get(actor.game_id) is actor:
+            del self.actors[actor.game_id]
+
+    def clear(self):
+        """
+        Stops and forgets every actor, without waiting for their queues
+        """
+        for actor in self.actors.values():
+            if not actor.task.get_loop().is_closed():
+                actor.task.cancel()
+        self.actors.clear()
+
+
+registry = ActorRegistry()
+
+
+async def submit(channel_layer, game_id, command):
+    """
+    Sends the command to the actor of the game, wherever it lives
+    """
+    command = dict(command, game_id=str(game_id))
+    channel = actor_channel(game_id)
+    if channel is None:
+        registry.submit(channel_layer, command)
+    else:
+        await channel_layer.send(channel, dict(command, type="actor.command"))
+
+
+class GameActorConsumer(AsyncConsumer):
+    """
+    Runs the actors of the games hashed to one of GAME_ACTOR_CHANNELS
+    """
+
+    async def actor_command(self, event):
+        command = dict(event)
+        del command["type"]
+        registry.submit(self.channel_layer, command)
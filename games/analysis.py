@@ -0,0 +1,84 @@
+"""
+Runs bot and hint searches in a pool of worker processes, so a long search
+never blocks the event loop (or a thread) that serves other sockets.
+Positions travel to the workers in the compact stored board format.
+"""
+
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from django.conf import settings
+from .board_utils import decode_board, encode_board
+from .bot import best_move
+from .opening_book import book_lookup
+
+
+def analyse(board, player, win_length, time_budget):
+    """
+    Runs inside a worker process
+    board: board in the stored (encoded) format
+    Returns the best move as a list, or None, and its score
+    """
+    move, score = best_move(decode_board(board), player, win_length, time_budget)
+    return (list(move) if move else None), score
+
+
+class AnalysisService:
+    """
+    Sends searches to the process pool. Identical positions that are already
+    being searched share the same job. A job is cancelled when every caller
+    waiting for it gave up, if the worker didn't pick it up yet. Workers are
+    never stuck for long, because each search stops at its own time budget.
+    """
+
+    def __init__(self, executor=None):
+        self._executor = executor
+        self._jobs = {}
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=getattr(settings, "ANALYSIS_WORKERS", None)
+            )
+        return self._executor
+
+    async def evaluate(self, board, player, win_length, time_budget, timeout=None):
+        """
+        Returns (move, score) for player on the given board
+        Positions in the opening book are answered without searching
+        Raises asyncio.TimeoutError if the result is not ready after timeout seconds
+        """
+        known = book_lookup(board, win_length)
+        if known is not None:
+            return known
+        if timeout is not None:
+            # Don't search for longer than anyone is willing to wait, leaving
+            # some room to hand the result back
+            time_budget = min(time_budget, timeout * 0.8)
+        key = (encode_board(board), player, win_length, time_budget)
+        job = self._jobs.get(key)
+        if job is None:
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(self.executor, analyse, *key)
+            job = self._jobs[key] = {"future": future, "waiters": 0}
+            future.add_done_callback(lambda _: self._forget(key, job))
+        job["waiters"] += 1
+        try:
+            return await asyncio.wait_for(asyncio.shield(job["future"]), timeout)
+        finally:
+            job["waiters"] -= 1
+            if job["waiters"] == 0 and not job["future"].done():
+                job["future"].cancel()
+                self._forget(key, job)
+
+    def _forget(self, key, job):
+        if self._jobs.get(key) is job:
+            del self._jobs[key]
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+analysis_service = AnalysisService()
@@ -0,0 +1,225 @@
+"""
+Archive of finished games, used by the export_games and import_games commands.
+The archive is a gzipped JSON lines file: a header line, then one record per
+game with its players, result and moves packed one byte each (see
+move_utils.encode_moves), base64 encoded. Per move data is rebuilt on import:
+players alternate, boards are replayed, and every move gets the time of the
+last one.
+
+Both directions work in chunks of games, so memory use doesn't depend on the
+size of the archive. Records keep the id the game had, for reference only:
+imported games get new ids from the database.
+"""
+
+import base64
+import gzip
+import io
+import json
+import os
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.utils.dateparse import parse_datetime
+from .bitboard import Bitboard
+from .board_utils import encode_board
+from .models import MAX_BOARD_SIZE, Game, Move
+from .move_utils import decode_moves
+from .state_cache import state_key
+
+ARCHIVE_FORMAT = "connect_four-games"
+ARCHIVE_VERSION = 1
+RECORD_FIELDS = (
+    "player_1",
+    "player_2",
+    "board_size",
+    "win_length",
+    "status",
+    "winner",
+    "against_bot",
+)
+
+
+def game_record(game, packed, played_at):
+    record = {"id": game.id}
+    record.update((field, getattr(game, field)) for field in RECORD_FIELDS)
+    record["moves"] = base64.b64encode(packed).decode("ascii")
+    record["played_at"] = played_at.isoformat() if played_at else None
+    return record
+
+
+def finished_chunks(chunk_size):
+    """
+    Yields lists of (game, packed moves, time of the last move), by increasing id
+    Every chunk takes one query for the games and one for their moves. Chunks
+    are fresh queries after the last id seen, so the games of a chunk can be
+    deleted before the next one is read.
+    """
+    last_id = 0
+    while True:
+        games = list(
+            Game.objects.filter(status="FINISHED", id__gt=last_id).order_by("id")[
+                :chunk_size
+            ]
+        )
+        if not games:
+            return
+        last_id = games[-1].id
+        codes = {game.id: bytearray() for game in games}
+        played_at = {}
+        moves = (
+            Move.objects.filter(game_id__in=codes)
+            .order_by("game_id", "seq")
+            .values_list("game_id", "code", "timestamp")
+        )
+        for game_id, code, timestamp in moves.iterator(chunk_size=chunk_size):
+            codes[game_id].append(code)
+            played_at[game_id] = timestamp
+        yield [(game, bytes(codes[game.id]), played_at.get(game.id)) for game in games]
+
+
+def export_games(path, chunk_size=1000, delete=False):
+    """
+    Writes every finished game to the archive at path
+    With delete, the exported games are deleted once the archive is complete and
+    on disk (see delete_archived)
+    Returns the number of games exported
+    """
+    count = 0
+    with open(path, "wb") as raw:
+        with gzip.GzipFile(fileobj=raw, mode="wb") as compressed:
+            archive = io.TextIOWrapper(compressed, encoding="utf-8")
+            header = {"format": ARCHIVE_FORMAT, "version": ARCHIVE_VERSION}
+            archive.write(json.dumps(header) + "\n")
+            for chunk in finished_chunks(chunk_size):
+                for game, packed, played_at in chunk:
+                    record = game_record(game, packed, played_at)
+                    archive.write(json.dumps(record) + "\n")
+                count += len(chunk)
+            archive.flush()
+            archive.detach()
+        # Closing the gzip stream wrote its trailer, the archive is complete
+        raw.flush()
+        os.fsync(raw.fileno())
+    if delete:
+        delete_archived(path, chunk_size)
+    return count
+
+
+def delete_archived(path, chunk_size=1000):
+    """
+    Deletes the games of the archive at path, reading it again for their ids,
+    and drops what the caches keep for them
+    """
+    ids = []
+    for _number, record in read_records(path):
+        ids.append(record["id"])
+        if len(ids) >= chunk_size:
+            delete_games(ids)
+            ids = []
+    if ids:
+        delete_games(ids)
+
+
+def delete_games(ids):
+    with transaction.atomic():
+        Move.objects.filter(game_id__in=ids).delete()
+        # Only finished games were archived, and they never change
+        Game.objects.filter(id__in=ids, status="FINISHED").delete()
+    keys = ["replay_timeline:{}".format(game_id) for game_id in ids]
+    cache.delete_many(keys + [state_key(game_id) for game_id in ids])
+
+
+def read_records(path):
+    """
+    Yields (line number, record) from the archive at path
+    Raises ValueError if it isn't an archive in a known format, or if it was cut short
+    """
+    with gzip.open(path, "rt", encoding="utf-8") as archive:
+        try:
+            header = json.loads(archive.readline() or "{}")
+            if header.get("format") != ARCHIVE_FORMAT:
+                raise ValueError("Not a game archive")
+            if header.get("version") != ARCHIVE_VERSION:
+                raise ValueError(
+                    "Unknown archive version {}".format(header.get("version"))
+                )
+            for number, line in enumerate(archive, 2):
+                if line.strip():
+                    yield number, json.loads(line)
+        except EOFError:
+            raise ValueError("The archive is truncated")
+
+
+def build_game(record):
+    """
+    Returns the game of the record, without id, and its moves
+    Raises ValueError if a move can't be played
+    """
+    game = Game(**{field: record[field] for field in RECORD_FIELDS})
+    if not 1 <= game.board_size <= MAX_BOARD_SIZE:
+        raise ValueError("Invalid board size")
+    played_at = record["played_at"] and parse_datetime(record["played_at"])
+    board = Bitboard(game.board_size)
+    moves = []
+    packed = base64.b64decode(record["moves"])
+    for seq, move in enumerate(decode_moves(packed), 1):
+        player = seq % 2 == 1
+        position = board.translate(player, move)
+        if position is None:
+            raise ValueError("Move {} can't be played".format(seq))
+        board[position] = player
+        move = Move(
+            code=packed[seq - 1],
+            player_name=game.player_1 if player else game.player_2,
+            board=encode_board(board),
+            seq=seq,
+        )
+        if played_at:
+            move.timestamp = played_at
+        moves.append(move)
+    game.set_python_board(board)
+    return game, moves
+
+
+def save_batch(batch):
+    """
+    Saves the games and their moves, with a bulk_create for the moves
+    The games are only bulk created where the database returns their ids,
+    elsewhere (SQLite) they are saved one by one, so ids are never reused.
+    """
+    games = [game for game, _ in batch]
+    with transaction.atomic():
+        if connection.features.can_return_rows_from_bulk_insert:
+            Game.objects.bulk_create(games)
+        else:
+            for game in games:
+                game.save(force_insert=True)
+        moves = []
+        for game, game_moves in batch:
+            for move in game_moves:
+                move.game = game
+                moves.append(move)
+        Move.objects.bulk_create(moves, batch_size=1000)
+
+
+def import_games(path, batch_size=1000):
+    """
+    Adds the games of the archive at path, with new ids
+    Raises ValueError, naming the line, for records that can't be imported.
+    The batches before it are kept.
+    Returns the number of games imported
+    """
+    count = 0
+    batch = []
+    for number, record in read_records(path):
+        try:
+            batch.append(build_game(record))
+        except (KeyError, TypeError, ValueError) as e:
+            raise ValueError("Line {}: {}".format(number, e))
+        if len(batch) >= batch_size:
+            save_batch(batch)
+            count += len(batch)
+            batch = []
+    if batch:
+        save_batch(batch)
+        count += len(batch)
+    return count
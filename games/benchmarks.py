@@ -0,0 +1,271 @@
+"""
+Micro-benchmarks of the board, move and Game hot paths, used by the benchmark
+command. Timings are saved as JSON and compared against a baseline, so engine
+and storage changes can be checked with numbers.
+
+Every case runs over a set of positions:
+ - mid_game: random games 10 to 30 moves in
+ - long_game: random games played until the board is (almost) full
+ - worst_case: the largest variant, full of pieces and with no winner yet
+"""
+
+import random
+import statistics
+import timeit
+from django.db import transaction
+from .bitboard import Bitboard, WIN_LENGTH
+from .board_utils import decode_board, encode_board, find_winner
+from .models import BOARD_SIZE, MAX_BOARD_SIZE, Game, Move
+from .move_utils import (
+    decode_moves,
+    encode_moves,
+    parse_move_from_string,
+    translate_move,
+)
+
+WORST_CASE_WIN_LENGTH = 5
+
+
+class Rollback(Exception):
+    pass
+
+
+def random_game(rng, size, win_length, plays):
+    """
+    Plays up to plays random legal moves, stopping before a move that would win
+    Returns the board and the list of (player, move, position)
+    """
+    board = Bitboard(size)
+    history = []
+    for _ in range(plays):
+        player = board.next_turn()
+        moves = board.legal_moves()
+        rng.shuffle(moves)
+        for move in moves:
+            position = board.translate(player, move)
+            board[position] = player
+            if board.winner(position, win_length) is None:
+                history.append((player, list(move), position))
+                break
+            board[position] = None
+        else:
+            break  # Every move wins, the game can't go on
+    return board, history
+
+
+def positions(rng, count=50):
+    """
+    Returns {kind: (win_length, [(board, history), ...])}
+    """
+    mid = [
+        random_game(rng, BOARD_SIZE, WIN_LENGTH, rng.randint(10, 30))
+        for _ in range(count)
+    ]
+    long = [
+        random_game(rng, BOARD_SIZE, WIN_LENGTH, BOARD_SIZE * BOARD_SIZE)
+        for _ in range(count)
+    ]
+    worst = [
+        random_game(
+            rng, MAX_BOARD_SIZE, WORST_CASE_WIN_LENGTH, MAX_BOARD_SIZE * MAX_BOARD_SIZE
+        )
+        for _ in range(max(count // 5, 1))
+    ]
+    return {
+        "mid_game": (WIN_LENGTH, mid),
+        "long_game": (WIN_LENGTH, long),
+        "worst_case": (WORST_CASE_WIN_LENGTH, worst),
+    }
+
+
+def board_cases(kind, win_length, games):
+    """
+    Returns [(name, function, calls)] for the functions that don't use the database
+    """
+    boards = [board for board, history in games if history]
+    last_plays = [history[-1][2] for _, history in games if history]
+    lists = [board.to_list() for board in boards]
+    encoded = [encode_board(board) for board in boards]
+    move_strings = [str(move) for _, history in games for _, move, _ in history]
+    move_lists = [[move for _, move, _ in history] for _, history in games]
+    packed = [encode_moves(moves) for moves in move_lists]
+    size = boards[0].size
+    center = [size // 2, "L"]
+    return [
+        (
+            "find_winner/" + kind,
+            lambda: [
+                find_winner(board, play, win_length)
+                for board, play in zip(boards, last_plays)
+            ],
+            len(boards),
+        ),
+        (
+            "find_winner_list/" + kind,
+            lambda: [
+                find_winner(board, play, win_length)
+                for board, play in zip(lists, last_plays)
+            ],
+            len(lists),
+        ),
+        (
+            "translate_move/" + kind,
+            lambda: [
+                translate_move(board, board.next_turn(), center) for board in boards
+            ],
+            len(boards),
+        ),
+        (
+            "parse_move_from_string/" + kind,
+            lambda: [parse_move_from_string(move, size) for move in move_strings],
+            len(move_strings),
+        ),
+        # Whole games at once, timed per move like the strings
+        (
+            "encode_moves/" + kind,
+            lambda: [encode_moves(moves) for moves in move_lists],
+            len(move_strings),
+        ),
+        (
+            "decode_moves/" + kind,
+            lambda: [decode_moves(data) for data in packed],
+            len(move_strings),
+        ),
+        (
+            "encode_board/" + kind,
+            lambda: [encode_board(board) for board in boards],
+            len(boards),
+        ),
+        (
+            "decode_board/" + kind,
+            lambda: [decode_board(board) for board in encoded],
+            len(encoded),
+        ),
+    ]
+
+
+def store_game(board, history, win_length):
+    """
+    Saves the game and its moves, the way they are saved when playing
+    The last move is stored without its board, like moves from before boards were stored
+    """
+    game = Game.objects.create_game(
+        player_1="bench1",
+        player_2="bench2",
+        status="STARTED",
+        board_size=board.size,
+        win_length=win_length,
+    )
+    replayed = Bitboard(board.size)
+    moves = []
+    for seq, (player, move, position) in enumerate(history, 1):
+        replayed[position] = player
+        moves.append(
+            Move(
+                game=game,
+                move=move,
+                player_name=game.player_1 if player else game.player_2,
+                board=encode_board(replayed),
+                seq=seq,
+            )
+        )
+    if moves:
+        moves[-1].board = ""
+    Move.objects.bulk_create(moves)
+    game.set_python_board(board)
+    game.save()
+    return game
+
+
+def database_cases(kind, win_length, games):
+    """
+    Returns [(name, function, calls)] for the Game and Move paths
+    Must be called inside a transaction, the rows are meant to be rolled back
+    """
+    games = [store_game(board, history, win_length) for board, history in games]
+    ids = [game.id for game in games]
+    moves = list(Move.objects.filter(game_id__in=ids).select_related("game"))
+    # Moves with a stored board, and the legacy ones that are replayed
+    stored = [move for move in moves if move.board][::5]
+    replayed = [move for move in moves if not move.board]
+    return [
+        (
+            "Game.to_json/" + kind,
+            lambda: [Game.objects.get(id=game_id).to_json() for game_id in ids],
+            len(ids),
+        ),
+        (
+            "Move.reconstruct_up_to/" + kind,
+            lambda: [move.reconstruct_up_to() for move in stored],
+            len(stored),
+        ),
+        (
+            "Move.reconstruct_up_to_replayed/" + kind,
+            lambda: [move.reconstruct_up_to() for move in replayed],
+            len(replayed),
+        ),
+    ]
+
+
+def measure(function, calls, min_time=0.05, repeat=7):
+    """
+    Microseconds per call over repeat runs: {"min": best run, "median": typical run}
+    Each run loops for at least min_time seconds, so fast cases aren't lost in noise
+    """
+    timer = timeit.Timer(function)
+    number = 1
+    while timer.timeit(number) < min_time:
+        number *= 2
+    runs = [
+        run / (number * calls) * 1e6
+        for run in timer.repeat(number=number, repeat=repeat)
+    ]
+    return {"min": min(runs), "median": statistics.median(runs)}
+
+
+def run_benchmarks(
+    seed=0, count=50, min_time=0.05, select=None, database=True, repeat=7
+):
+    """
+    Runs every case whose name contains select
+    Returns {name: {"min": microseconds per call, "median": ...}} (see measure)
+    """
+    rng = random.Random(seed)
+    results = {}
+
+    def run(cases):
+        for name, function, calls in cases:
+            if select and select not in name or not calls:
+                continue
+            results[name] = measure(function, calls, min_time, repeat)
+
+    generated = positions(rng, count)
+    for kind, (win_length, games) in generated.items():
+        run(board_cases(kind, win_length, games))
+    if database:
+        try:
+            with transaction.atomic():
+                for kind, (win_length, games) in generated.items():
+                    run(database_cases(kind, win_length, games))
+                raise Rollback()
+        except Rollback:
+            pass
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    Returns [(name, baseline median, best run)] for the cases whose best run is
+    slower than the median of the baseline by more than threshold (0.2 means
+    20% slower). A noisy run makes the median slower, not the best one, so
+    noise alone doesn't fail the comparison.
+    Cases missing from either side are ignored
+    """
+    regressions = []
+    for name, result in sorted(results.items()):
+        if name not in baseline:
+            continue
+        before, after = baseline[name]["median"], result["min"]
+        if after > before * (1 + threshold):
+            regressions.append((name, before, after))
+    return regressions
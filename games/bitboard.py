@@ -0,0 +1,239 @@
+"""
+Bitboard representation of the game board.
+
+Every player owns one integer mask. The cell at (row, col) lives in the bit
+row * (size + 1) + col. The extra column at the end of every row is never set,
+so shifting a mask to find neighbours cannot wrap from one row into the next.
+"""
+
+from functools import lru_cache
+
+WIN_LENGTH = 4
+DIRECTIONS = ((0, 1), (1, 0), (1, 1), (1, -1))
+
+
+def popcount(mask):
+    """
+    Counts the bits set in the mask (int.bit_count is only available on 3.10+)
+    """
+    return bin(mask).count("1")
+
+
+@lru_cache(maxsize=None)
+def win_lines(size, win_length):
+    """
+    Precomputes every line of win_length cells on a board of the given size as
+    bitboard masks, and maps each position to the lines that go through it.
+    Built once per (size, win_length), so checking a play costs the same no
+    matter how long the lines are.
+    """
+    stride = size + 1
+    lines = [[] for _ in range(size * size)]
+    for row in range(size):
+        for col in range(size):
+            for row_step, col_step in DIRECTIONS:
+                last_row = row + row_step * (win_length - 1)
+                last_col = col + col_step * (win_length - 1)
+                if not (0 <= last_row < size and 0 <= last_col < size):
+                    continue
+                cells = [
+                    (row + row_step * i, col + col_step * i) for i in range(win_length)
+                ]
+                mask = 0
+                for cell_row, cell_col in cells:
+                    mask |= 1 << (cell_row * stride + cell_col)
+                for cell_row, cell_col in cells:
+                    lines[cell_row * size + cell_col].append(mask)
+    return tuple(tuple(position_lines) for position_lines in lines)
+
+
+class Bitboard:
+    """
+    Holds the board as two masks, one for each player.
+    It still behaves like the old list of booleans (indexing, count, in, len,
+    equality with lists), so the rest of the code can keep treating it as one.
+    None means that the position is empty
+    True means player_1 picked that position
+    False means player_2 picked that position
+    """
+
+    __slots__ = ("size", "stride", "player_1", "player_2")
+
+    def __init__(self, size, player_1=0, player_2=0):
+        self.size = size
+        self.stride = size + 1
+        self.player_1 = player_1
+        self.player_2 = player_2
+
+    @classmethod
+    def from_list(cls, board):
+        """
+        Builds a bitboard from the python list representation.
+        The board is always squared, so the sqrt of the length gives the size.
+        """
+        size = int(len(board) ** 0.5)
+        bitboard = cls(size)
+        for position in range(size * size):
+            if board[position] is not None:
+                bitboard[position] = board[position]
+        return bitboard
+
+    def to_list(self):
+        return list(self)
+
+    def copy(self):
+        return Bitboard(self.size, self.player_1, self.player_2)
+
+    __copy__ = copy
+
+    def bit(self, position):
+        """
+        Translates a position of the flat list into its bit
+        """
+        return 1 << (position // self.size * self.stride + position % self.size)
+
+    def mask(self, player):
+        return self.player_1 if player else self.player_2
+
+    @property
+    def occupied(self):
+        return self.player_1 | self.player_2
+
+    @property
+    def full_row(self):
+        return (1 << self.size) - 1
+
+    def row_occupancy(self, row):
+        """
+        Returns a mask with the occupied cells of the given row, column 0 being the lowest bit
+        """
+        return (self.occupied >> (row * self.stride)) & self.full_row
+
+    def __len__(self):
+        return self.size * self.size
+
+    def __getitem__(self, position):
+        if position < 0:
+            position += len(self)
+        if not 0 <= position < len(self):
+            raise IndexError("board index out of range")
+        bit = self.bit(position)
+        if self.player_1 & bit:
+            return True
+        if self.player_2 & bit:
+            return False
+        return None
+
+    def __setitem__(self, position, player):
+        bit = self.bit(position)
+        self.player_1 &= ~bit
+        self.player_2 &= ~bit
+        if player is True:
+            self.player_1 |= bit
+        elif player is False:
+            self.player_2 |= bit
+
+    def __iter__(self):
+        for position in range(len(self)):
+            yield self[position]
+
+    def __contains__(self, value):
+        if value is None:
+            return not self.is_full()
+        return self.count(value) > 0
+
+    def __eq__(self, other):
+        if isinstance(other, Bitboard):
+            return (self.size, self.player_1, self.player_2) == (
+                other.size,
+                other.player_1,
+                other.player_2,
+            )
+        if isinstance(other, list):
+            return self.to_list() == other
+        return NotImplemented
+
+    def __repr__(self):
+        return "Bitboard({}, {}, {})".format(self.size, self.player_1, self.player_2)
+
+    def count(self, value):
+        if value is True:
+            return popcount(self.player_1)
+        if value is False:
+            return popcount(self.player_2)
+        if value is None:
+            return len(self) - popcount(self.occupied)
+        return 0
+
+    def is_full(self):
+        return popcount(self.occupied) == len(self)
+
+    def next_turn(self):
+        """
+        player_1 moves whenever both players have the same number of pieces
+        """
+        return popcount(self.player_1) == popcount(self.player_2)
+
+    def translate(self, player, move):
+        """
+        Returns the position where the piece would land when stacked on the
+        given row and side, or None if it is not the player's turn, the row is full
+        or the move isn't on the board
+        """
+        if self.next_turn() != player:
+            return None
+        row, side = move
+        if not 0 <= row < self.size or side not in ("L", "R"):
+            return None
+        free = ~self.row_occupancy(row) & self.full_row
+        if not free:
+            return None
+        if side == "L":
+            col = (free & -free).bit_length() - 1
+        else:
+            col = free.bit_length() - 1
+        return row * self.size + col
+
+    def legal_moves(self):
+        """
+        Lists every (row, side) that still has room to stack a piece
+        """
+        moves = []
+        for row in range(self.size):
+            if self.row_occupancy(row) != self.full_row:
+                moves.append((row, "L"))
+                moves.append((row, "R"))
+        return moves
+
+    def has_won(self, player, position=None, win_length=WIN_LENGTH):
+        """
+        Checks for win_length in a row using the precomputed lines.
+        When a position is passed, only the lines that go through it are considered.
+        """
+        mask = self.mask(player)
+        table = win_lines(self.size, win_length)
+        if position is not None:
+            table = (table[position],)
+        for lines in table:
+            for line in lines:
+                if mask & line == line:
+                    return True
+        return False
+
+    def winner(self, last_play, win_length=WIN_LENGTH):
+        """
+        Returns the owner of the last play if that play completed a line
+        """
+        player = self[last_play]
+        if player is None:
+            return None
+        return player if self.has_won(player, last_play, win_length) else None
+
+
+def as_bitboard(board):
+    """
+    Accepts either a Bitboard or the legacy python list and returns a Bitboard
+    """
+    if isinstance(board, Bitboard):
+        return board
+    return Bitboard.from_list(board)
@@ -1,45 +1,65 @@
 from operator import add
-import pickle
 import base64
+from .bitboard import Bitboard, as_bitboard, WIN_LENGTH
+
+BOARD_FORMAT_VERSION = 1
 
 
 def generate_board(size):
     """
-    Generates a blank board if no argument is passed.
-    None means that the position is empty
-    True means player_1 picked that position
-    False means player_2 picked that position
+    Generates the stored representation of a blank board of the given size
+    """
+    return encode_board(Bitboard(size))
+
+
+def mask_length(size):
+    """
+    Number of bytes needed to hold one player mask (including the padding column)
     """
-    return pickle_board([None] * size * size)
+    return (size * (size + 1) + 7) // 8
 
 
-def pickle_board(board):
+def encode_board(board):
     """
-    Pickles the passed board
-    Returns a base64 representation to be able to store it in the db (utf-8 encoding).
+    Encodes the board to store it in the db.
+    Layout: version byte, size byte, player_1 mask and player_2 mask
+    (little endian, mask_length(size) bytes each), base64 encoded (utf-8).
+    A 7x7 board takes 24 characters.
     """
-    output = pickle.dumps(board)
+    board = as_bitboard(board)
+    length = mask_length(board.size)
+    output = (
+        bytes((BOARD_FORMAT_VERSION, board.size))
+        + board.player_1.to_bytes(length, "little")
+        + board.player_2.to_bytes(length, "little")
+    )
     return base64.b64encode(output).decode("utf-8")
 
 
-def parse_board_from_string(board):
+def decode_board(board):
     """
-    Parses the board back to python
-    pickle is a dirty way to do this, as the window it opens for
-    arbitrary code execution is troublesome. The board can be parsed
-    with more strict validation and parsing rules or it can be stored in a more
-    suitable format (like postgres arrays)
-    For now, using pickle as it is slightly better than directly using eval
-    For the sake of this exercise, I will use this method.
+    Decodes the stored board straight into the masks of a Bitboard, no
+    per-cell work is needed.
+    Raises ValueError if the version or the length do not match.
     """
-    board = base64.b64decode(board.encode())
-    return pickle.loads(board)
+    data = base64.b64decode(board.encode())
+    if len(data) < 2 or data[0] != BOARD_FORMAT_VERSION:
+        raise ValueError("Unknown board format")
+    size = data[1]
+    length = mask_length(size)
+    if len(data) != 2 + 2 * length:
+        raise ValueError("Corrupted board")
+    return Bitboard(
+        size,
+        int.from_bytes(data[2 : 2 + length], "little"),
+        int.from_bytes(data[2 + length :], "little"),
+    )
 
 
 def board_full(board):
     """
     Checks that all of the positions are filled
-    board: python_parsed board
+    board: python_parsed board or Bitboard
     """
     return not None in board
 
@@ -47,6 +67,7 @@ def board_full(board):
 def next_turn(board):
     """
     Checks the board to find who is next
+    For a Bitboard, count is a popcount of the player's mask
     """
     counts = (board.count(True), board.count(False))
     return counts[0] == counts[1]
@@ -85,27 +106,11 @@ def scan(board, direction, position, player, count=0):
     return count
 
 
-def find_winner(board, last_play):
+def find_winner(board, last_play, win_length=WIN_LENGTH):
     """
     Scans the board for winner combinations for player responsible for
-    the last play
+    the last play. Lists are converted to a Bitboard, where only the precomputed
+    lines of win_length cells that go through the last play are checked
     Returns True, False or None (player_1, player_2, no winner)
     """
-    player = board[last_play]
-    left = scan(board, (-1, 0), last_play, player)
-    right = scan(board, (1, 0), last_play, player)
-    top = scan(board, (0, -1), last_play, player)
-    bottom = scan(board, (0, 1), last_play, player)
-    top_left = scan(board, (-1, -1), last_play, player)
-    top_right = scan(board, (1, -1), last_play, player)
-    bottom_left = scan(board, (-1, 1), last_play, player)
-    bottom_right = scan(board, (1, 1), last_play, player)
-    if (
-        left + right >= 3
-        or top + bottom >= 3
-        or top_left + bottom_right >= 3
-        or top_right + bottom_left >= 3
-    ):
-        return player
-    else:
-        return None
+    return as_bitboard(board).winner(last_play, win_length)
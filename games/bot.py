@@ -0,0 +1,246 @@
+"""
+Search engine for the bot opponent.
+Negamax with alpha-beta pruning over the side-stacking rules, using move
+ordering, a Zobrist hashed transposition table and iterative deepening
+under a time budget.
+"""
+
+import random
+import time
+from functools import lru_cache
+from .bitboard import WIN_LENGTH, popcount, win_lines
+
+WIN_SCORE = 1000000
+TABLE_SIZE = 1 << 18
+# Transposition table flags
+EXACT, LOWER, UPPER = 0, 1, 2
+# Score of a line holding 0..win_length pieces of a single player
+LINE_WEIGHTS = (0, 1, 4, 32, 256, 2048, 16384)
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+@lru_cache(maxsize=None)
+def zobrist_keys(size):
+    """
+    One random 64 bit key per (player, bit) of a board of the given size
+    Seeded, so hashes are the same across processes
+    """
+    rng = random.Random(size)
+    bits = size * (size + 1)
+    return {
+        True: [rng.getrandbits(64) for _ in range(bits)],
+        False: [rng.getrandbits(64) for _ in range(bits)],
+    }
+
+
+def zobrist_hash(board):
+    keys = zobrist_keys(board.size)
+    value = 0
+    for player, mask in ((True, board.player_1), (False, board.player_2)):
+        while mask:
+            low = mask & -mask
+            value ^= keys[player][low.bit_length() - 1]
+            mask ^= low
+    return value
+
+
+@lru_cache(maxsize=None)
+def all_lines(size, win_length):
+    """
+    Every line of win_length cells, without the repetition of the per position table
+    """
+    return tuple(
+        sorted({line for lines in win_lines(size, win_length) for line in lines})
+    )
+
+
+def evaluate(board, player, win_length):
+    """
+    Heuristic score from the point of view of player: lines that only one of
+    the players can still complete, weighted by how many pieces they hold
+    """
+    own, other = board.mask(player), board.mask(not player)
+    score = 0
+    for line in all_lines(board.size, win_length):
+        if own & line:
+            if not other & line:
+                score += LINE_WEIGHTS[min(popcount(own & line), 6)]
+        elif other & line:
+            score -= LINE_WEIGHTS[min(popcount(other & line), 6)]
+    return score
+
+
+class TranspositionTable:
+    """
+    Fixed size table indexed by the low bits of the hash. An entry is replaced
+    when the slot holds another position searched to a lower or equal depth,
+    or a position from an older search.
+    """
+
+    def __init__(self, size=TABLE_SIZE):
+        self.size = size
+        self.entries = [None] * size
+        self.generation = 0
+
+    def get(self, key):
+        entry = self.entries[key % self.size]
+        if entry is not None and entry[0] == key:
+            return entry
+        return None
+
+    def put(self, key, depth, score, flag, move):
+        index = key % self.size
+        entry = self.entries[index]
+        if (
+            entry is None
+            or entry[0] == key
+            or entry[5] != self.generation
+            or entry[1] <= depth
+        ):
+            self.entries[index] = (key, depth, score, flag, move, self.generation)
+
+
+class Search:
+    """
+    Runs the search for a single bot move
+    """
+
+    def __init__(self, board, win_length=WIN_LENGTH, table=None, deadline=None):
+        self.board = board.copy()
+        self.win_length = win_length
+        self.table = table or TranspositionTable()
+        self.deadline = deadline
+        self.keys = zobrist_keys(board.size)
+        self.lines = win_lines(board.size, win_length)
+        self.nodes = 0
+        # Center rows and columns first, they take part in more lines
+        center = (board.size - 1) / 2
+        self.row_order = sorted(range(board.size), key=lambda row: abs(row - center))
+
+    def moves(self):
+        """
+        Lists (position, (row, side)) for every legal move, taken from the row
+        occupancy masks. When both sides of a row land on the same cell, it is
+        listed once.
+        """
+        board = self.board
+        full_row = board.full_row
+        moves = []
+        for row in self.row_order:
+            free = ~board.row_occupancy(row) & full_row
+            if not free:
+                continue
+            offset = row * board.size
+            left = (free & -free).bit_length() - 1
+            right = free.bit_length() - 1
+            moves.append((offset + left, (row, "L")))
+            if right != left:
+                moves.append((offset + right, (row, "R")))
+        return moves
+
+    def play(self, player, position):
+        bit = self.board.bit(position)
+        if player:
+            self.board.player_1 ^= bit
+        else:
+            self.board.player_2 ^= bit
+        return self.keys[player][bit.bit_length() - 1]
+
+    def is_win(self, player, position):
+        mask = self.board.mask(player)
+        for line in self.lines[position]:
+            if mask & line == line:
+                return True
+        return False
+
+    def negamax(self, player, depth, alpha, beta, key, ply):
+        self.nodes += 1
+        if self.deadline is not None and self.nodes % 1024 == 0:
+            if time.monotonic() > self.deadline:
+                raise SearchTimeout()
+
+        original_alpha = alpha
+        entry = self.table.get(key)
+        best_move = None
+        if entry is not None:
+            best_move = entry[4]
+            if entry[1] >= depth:
+                if entry[3] == EXACT:
+                    return entry[2]
+                if entry[3] == LOWER:
+                    alpha = max(alpha, entry[2])
+                elif entry[3] == UPPER:
+                    beta = min(beta, entry[2])
+                if alpha >= beta:
+                    return entry[2]
+
+        if self.board.is_full():
+            return 0  # Draw
+        if depth == 0:
+            return evaluate(self.board, player, self.win_length)
+
+        moves = self.moves()
+        if best_move is not None:
+            moves.sort(key=lambda move: move[1] != best_move)
+
+        best = -WIN_SCORE * 2
+        for position, move in moves:
+            move_key = self.play(player, position)
+            if self.is_win(player, position):
+                score = WIN_SCORE - ply
+            else:
+                score = -self.negamax(
+                    not player, depth - 1, -beta, -alpha, key ^ move_key, ply + 1
+                )
+            self.play(player, position)
+            if score > best:
+                best, best_move = score, move
+            alpha = max(alpha, score)
+            if alpha >= beta:
+                break
+
+        flag = EXACT
+        if best <= original_alpha:
+            flag = UPPER
+        elif best >= beta:
+            flag = LOWER
+        self.table.put(key, depth, best, flag, best_move)
+        return best
+
+    def root(self, player, depth):
+        key = zobrist_hash(self.board)
+        score = self.negamax(player, depth, -WIN_SCORE * 2, WIN_SCORE * 2, key, 0)
+        entry = self.table.get(key)
+        return (entry[4] if entry else self.moves()[0][1]), score
+
+
+def best_move(
+    board, player, win_length=WIN_LENGTH, time_budget=1.0, max_depth=None, table=None
+):
+    """
+    Searches deeper and deeper until the time budget runs out
+    A table can be passed to reuse it between moves of the same game
+    Returns the best (row, side) of the last completed depth and its score,
+    or (None, 0) when there are no moves left
+    """
+    deadline = time.monotonic() + time_budget
+    table = table or TranspositionTable()
+    table.generation = popcount(board.occupied)
+    search = Search(board, win_length, table, deadline)
+    moves = search.moves()
+    if not moves:
+        return None, 0
+    result = (moves[0][1], 0)
+    empty = len(board) - popcount(board.occupied)
+    max_depth = empty if max_depth is None else min(max_depth, empty)
+    for depth in range(1, max_depth + 1):
+        try:
+            result = search.root(player, depth)
+        except SearchTimeout:
+            break
+        if abs(result[1]) >= WIN_SCORE - len(board):
+            break  # Forced result found, deeper searches won't change it
+    return result
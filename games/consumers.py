@@ -1,44 +1,152 @@
+import asyncio
 import json
-from channels.generic.websocket import WebsocketConsumer
-from asgiref.sync import async_to_sync
-from django.db import transaction
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncWebsocketConsumer
+from django.conf import settings
+from . import actors, metrics
+from .analysis import analysis_service
 from .models import Game, Move
+from .move_log import move_log
 
 
-class GameConsumer(WebsocketConsumer):
-    def connect(self):
-        self.game_id = self.scope["url_route"]["kwargs"]["game_id"]
-        self.game = Game.objects.get(id=self.game_id)
+@database_sync_to_async
+def get_game(game_id):
+    return move_log.get_game(game_id) or Game.objects.get(id=game_id)
 
-        async_to_sync(self.channel_layer.group_add)(self.game_id, self.channel_name)
 
-        self.accept()
-        async_to_sync(self.channel_layer.group_send)(
-            self.game_id, {"type": "game_message", "message": self.game.to_json()}
-        )
+@database_sync_to_async
+def get_game_with_snapshot(game_id):
+    game = move_log.get_game(game_id)
+    if game is None:
+        return Game.objects.get_with_snapshot(game_id)
+    return game, move_log.to_json(game)
 
-    def disconnect(self, close_code):
-        async_to_sync(self.channel_layer.group_discard)(self.game_id, self.channel_name)
 
-    def receive(self, text_data):
+@database_sync_to_async
+def game_to_json(game):
+    return move_log.to_json(game)
+
+
+@database_sync_to_async
+def replay_until(move_id):
+    return Move.objects.get(id=move_id).reconstruct_up_to()
+
+
+@database_sync_to_async
+def replay_all(game_id):
+    return Game.objects.get(id=game_id).replay_timeline()
+
+
+def message_kind(message):
+    """
+    Name of the kind of message, used to split the receive metrics
+    """
+    if "replay_until" in message or "replay_all" in message:
+        return "replay"
+    for kind in ("hint", "snapshot", "move"):
+        if kind in message:
+            return kind
+    return "other"
+
+
+class GameConsumer(AsyncWebsocketConsumer):
+    """
+    Runs on the event loop, only the database work is sent to the thread pool
+    Protocol:
+     - The full snapshot (type "snapshot") is broadcast on connect, and sent again
+       to a single socket when it asks for it with {"snapshot": true}. Connects
+       read it from the game state cache, requested snapshots from the database.
+     - Moves are played by the actor of the game (see games.actors), which
+       broadcasts every accepted move as a delta (type "move"). seq increases by
+       one with every move, so a client that sees a gap should ask for a snapshot
+     - A rejected move is answered with type "rejected" to the sender only, with
+       "reason": "conflict" if the game was changed by someone else meanwhile, or
+       "busy" if the move log (write-behind mode) had no room for it
+     - The actor plays the bot's replies in games against the bot
+     - {"replay_until": move_id} answers with the board after that move, and
+       {"replay_all": true} with the timeline of the whole game
+     - {"hint": true} answers with the best move and score for the player to move
+       (null if the search didn't finish in time)
+    Searches run in the analysis process pool, never in this worker.
+    """
+
+    async def connect(self):
+        with metrics.CONNECT_SECONDS.time("game"):
+            self.game_id = self.scope["url_route"]["kwargs"]["game_id"]
+            self.game, snapshot = await get_game_with_snapshot(self.game_id)
+
+            await self.channel_layer.group_add(self.game_id, self.channel_name)
+
+            await self.accept()
+            metrics.socket_opened("game", self.game_id)
+            await self.broadcast(snapshot)
+
+    async def disconnect(self, close_code):
+        metrics.socket_closed("game", self.game_id)
+        await self.channel_layer.group_discard(self.game_id, self.channel_name)
+
+    async def send(self, text_data=None, bytes_data=None, close=False):
+        metrics.payload_sent("game", text_data, bytes_data)
+        await super().send(text_data, bytes_data, close)
+
+    async def broadcast(self, message):
+        with metrics.GROUP_SEND_SECONDS.time("game"):
+            await self.channel_layer.group_send(
+                self.game_id, {"type": "game_message", "message": message}
+            )
+
+    async def receive(self, text_data):
         text_data_json = json.loads(text_data)
+        with metrics.RECEIVE_SECONDS.time("game", message_kind(text_data_json)):
+            await self.handle_message(text_data_json)
+
+    async def handle_message(self, text_data_json):
         if "replay_until" in text_data_json.keys():
-            last_move_id = text_data_json["replay_until"]
-            last_move = Move.objects.get(id=last_move_id)
-            board = last_move.reconstruct_up_to()
-            self.send(json.dumps({"replay_board": board}))
+            board = await replay_until(text_data_json["replay_until"])
+            await self.send(json.dumps({"replay_board": board}))
+
+        elif "replay_all" in text_data_json.keys():
+            timeline = await replay_all(self.game_id)
+            await self.send(json.dumps({"replay_all": timeline}))
+
+        elif "hint" in text_data_json.keys():
+            await self.send(json.dumps({"hint": await self.hint()}))
+
+        elif "snapshot" in text_data_json.keys():
+            self.game = await get_game(self.game_id)
+            await self.send(await game_to_json(self.game))
 
         else:
             move = text_data_json["move"]
             move[0] = int(move[0])
             player = text_data_json["player"] == self.game.player_1
-            game = Game.objects.select_for_update().get(id=self.game.id)
-            with transaction.atomic():
-                self.game = game.change_state_forward(player, move)
+            await actors.submit(
+                self.channel_layer,
+                self.game_id,
+                {
+                    "kind": "move",
+                    "player": player,
+                    "move": move,
+                    "reply_channel": self.channel_name,
+                },
+            )
 
-            async_to_sync(self.channel_layer.group_send)(
-                self.game_id, {"type": "game_message", "message": self.game.to_json()}
+    async def hint(self):
+        game = await get_game(self.game_id)
+        if game.finished:
+            return None
+        budget = getattr(settings, "HINT_TIME_BUDGET", 0.5)
+        try:
+            move, score = await analysis_service.evaluate(
+                game.python_board,
+                game.get_next_player_turn(),
+                game.win_length,
+                budget,
+                timeout=budget * 2,
             )
+        except asyncio.TimeoutError:
+            return None
+        return {"move": move, "score": score}
 
-    def game_message(self, event):
-        self.send(event["message"])
+    async def game_message(self, event):
+        await self.send(event["message"])
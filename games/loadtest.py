@@ -0,0 +1,300 @@
+"""
+End-to-end load generator, used by the loadtest command.
+Simulated players connect to the lobby and to their game through
+WebsocketCommunicator, the same way browsers do, and play random legal moves.
+Everything runs in this process on the in-memory channel layer, so no Redis or
+browser is needed. Measures:
+ - moves per second over the whole run
+ - latency from a move being sent to its delta reaching both players
+ - database queries per move, counted on every thread's connection
+"""
+
+import asyncio
+import json
+import math
+import random
+import threading
+import time
+from channels.db import database_sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.db import connections
+from django.db.backends.signals import connection_created
+from connect_four.routing import url_patterns
+from .bitboard import Bitboard
+from .models import Game
+
+RECEIVE_TIMEOUT = 30
+
+
+class QueryCounter:
+    """
+    Counts the queries of every connection, including the ones opened by the
+    threads that run database_sync_to_async
+    """
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self._lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+    def attach(self, connection, **kwargs):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+    def __enter__(self):
+        connection_created.connect(self.attach)
+        for connection in connections.all():
+            self.attach(connection)
+        return self
+
+    def __exit__(self, *exc_info):
+        connection_created.disconnect(self.attach)
+        for connection in connections.all():
+            if self in connection.execute_wrappers:
+                connection.execute_wrappers.remove(self)
+
+
+def percentile(values, percent):
+    """
+    Nearest rank percentile of a sorted list
+    """
+    if not values:
+        return None
+    return values[max(math.ceil(percent / 100 * len(values)) - 1, 0)]
+
+
+def latency_report(latencies):
+    """
+    p50, p95 and p99 in milliseconds of a sorted list of seconds
+    """
+    if not latencies:
+        return None
+    return {
+        "p{}".format(percent): percentile(latencies, percent) * 1000
+        for percent in (50, 95, 99)
+    }
+
+
+async def receive(communicator, accept):
+    """
+    Returns the next message accepted by accept(message), skipping the others
+    """
+    while True:
+        message = json.loads(await receive_text(communicator))
+        if accept(message):
+            return message
+
+
+async def receive_text(communicator):
+    """
+    Like communicator.receive_from, but raises the consumer's error as soon as it
+    fails, instead of waiting for the timeout
+    """
+    output = asyncio.ensure_future(communicator.output_queue.get())
+    await asyncio.wait(
+        [output, communicator.future],
+        timeout=RECEIVE_TIMEOUT,
+        return_when=asyncio.FIRST_COMPLETED,
+    )
+    if not output.done():
+        output.cancel()
+        if communicator.future.done():
+            communicator.future.result()
+        raise asyncio.TimeoutError("No message from the consumer")
+    message = output.result()
+    if message["type"] != "websocket.send":
+        raise ConnectionError("The consumer closed the socket")
+    return message["text"]
+
+
+async def close(communicator):
+    try:
+        await communicator.disconnect()
+    except Exception:
+        pass  # The consumer already failed, the error was recorded
+
+
+async def connect(path, stats):
+    """
+    Returns a connected communicator. A failed connection is counted in
+    stats["connect_errors"] and its communicator closed before raising
+    """
+    communicator = WebsocketCommunicator(URLRouter(url_patterns), path)
+    try:
+        connected, _ = await communicator.connect(RECEIVE_TIMEOUT)
+        if not connected:
+            raise ConnectionError("Could not connect to {}".format(path))
+    except Exception:
+        stats["connect_errors"] += 1
+        await close(communicator)
+        raise
+    return communicator
+
+
+async def join_lobby(stats):
+    """
+    Returns the lobby socket once it got the list of users, None if it failed
+    """
+    started = time.monotonic()
+    try:
+        communicator = await connect("/ws/lobby/", stats)
+    except Exception as error:
+        stats["errors"].append("{}: {}".format(type(error).__name__, error))
+        return None
+    try:
+        await receive(communicator, lambda message: "users" in message)
+    except Exception as error:
+        stats["errors"].append("{}: {}".format(type(error).__name__, error))
+        await close(communicator)
+        return None
+    stats["lobby_latencies"].append(time.monotonic() - started)
+    return communicator
+
+
+async def play_game(game, max_moves, rng, stats, ready, start):
+    """
+    Connects both players to the game and plays random legal moves until the
+    game is over or max_moves were played
+    A failure (connection refused, consumer error, timeout, rejected move) ends
+    the game and is counted in stats["errors"]. The sockets are always closed.
+    """
+    sockets = {}
+    try:
+        try:
+            for player in (True, False):
+                sockets[player] = await connect("/ws/game/{}/".format(game.id), stats)
+                snapshot = await receive(
+                    sockets[player], lambda message: message.get("type") == "snapshot"
+                )
+        finally:
+            ready.release()
+        board = Bitboard.from_list(snapshot["board"])
+        await start.wait()
+
+        for seq in range(snapshot["seq"] + 1, snapshot["seq"] + max_moves + 1):
+            player = board.next_turn()
+            move = rng.choice(board.legal_moves())
+            sent = time.monotonic()
+            await sockets[player].send_to(
+                json.dumps(
+                    {
+                        "move": list(move),
+                        "player": game.player_1 if player else game.player_2,
+                    }
+                )
+            )
+            # The sender first: a failing consumer raises on its own socket
+            for socket in (sockets[player], sockets[not player]):
+                delta = await receive(
+                    socket,
+                    lambda message: message.get("type") == "rejected"
+                    or message.get("type") == "move"
+                    and message["seq"] >= seq,
+                )
+                if delta["type"] == "rejected":
+                    raise ValueError("Legal move {} was rejected".format(move))
+            stats["latencies"].append(time.monotonic() - sent)
+            board[delta["position"]] = delta["player"]
+            if delta["status"] == "FINISHED":
+                break
+    except Exception as error:
+        stats["errors"].append("{}: {}".format(type(error).__name__, error))
+    finally:
+        for socket in sockets.values():
+            await close(socket)
+
+
+@database_sync_to_async
+def create_games(count, board_size, win_length):
+    return [
+        Game.objects.create_game(
+            player_1="load{}a".format(i),
+            player_2="load{}b".format(i),
+            status="STARTED",
+            board_size=board_size,
+            win_length=win_length,
+        )
+        for i in range(count)
+    ]
+
+
+@database_sync_to_async
+def delete_games(games):
+    Game.objects.filter(id__in=[game.id for game in games]).delete()
+
+
+async def run_load(
+    games=10, max_moves=20, board_size=7, win_length=4, lobby=True, seed=None
+):
+    """
+    Plays games concurrent games and returns the report
+    Every game is connected before the first move is sent, so the move phase
+    measures moves only. The games are deleted afterwards.
+    Must run with the in-memory channel layer (see the loadtest command).
+    """
+    rng = random.Random(seed)
+    stats = {"latencies": [], "lobby_latencies": [], "errors": [], "connect_errors": 0}
+    created = await create_games(games, board_size, win_length)
+    lobby_sockets = []
+    players = []
+    ready = asyncio.Semaphore(0)
+    start = asyncio.Event()
+    elapsed = connect_queries = move_queries = None
+    try:
+        with QueryCounter() as counter:
+            if lobby:
+                for _ in range(games * 2):
+                    lobby_sockets.append(await join_lobby(stats))
+            players = [
+                asyncio.ensure_future(
+                    play_game(
+                        game,
+                        max_moves,
+                        random.Random(rng.random()),
+                        stats,
+                        ready,
+                        start,
+                    )
+                )
+                for game in created
+            ]
+            for _ in created:
+                await ready.acquire()
+            connect_queries = counter.count
+            started = time.monotonic()
+            start.set()
+            await asyncio.gather(*players)
+            elapsed = time.monotonic() - started
+            move_queries = counter.count - connect_queries
+    finally:
+        for player in players:
+            player.cancel()
+        await asyncio.gather(*players, return_exceptions=True)
+        for socket in lobby_sockets:
+            if socket is not None:
+                await close(socket)
+        await delete_games(created)
+
+    latencies = sorted(stats["latencies"])
+    moves = len(latencies)
+    return {
+        "games": games,
+        "moves": moves,
+        "seconds": elapsed,
+        "moves_per_second": moves / elapsed if elapsed else None,
+        "latency_ms": latency_report(latencies),
+        "lobby_connect_ms": latency_report(sorted(stats["lobby_latencies"])),
+        "queries_per_move": move_queries / moves if moves else None,
+        # Games and lobby sockets that stopped early, and why
+        "errors": len(stats["errors"]),
+        "error_types": sorted(set(stats["errors"])),
+        # Sockets that could not connect, also counted in errors
+        "connect_errors": stats["connect_errors"],
+        # Lobby and game connections, before the first move
+        "connect_queries": connect_queries,
+    }
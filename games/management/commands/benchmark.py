@@ -0,0 +1,81 @@
+import json
+import platform
+from django.core.management.base import BaseCommand, CommandError
+from games.benchmarks import compare, run_benchmarks
+
+
+class Command(BaseCommand):
+    help = (
+        "Times the board, move and Game hot paths, saves the results as JSON and "
+        "compares them against a baseline"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--positions", type=int, default=50, help="Positions of each kind"
+        )
+        parser.add_argument(
+            "--min-time", type=float, default=0.05, help="Seconds of each timing"
+        )
+        parser.add_argument(
+            "--repeat", type=int, default=7, help="Timings of each case"
+        )
+        parser.add_argument("--select", default=None, help="Only run matching cases")
+        parser.add_argument("--skip-database", action="store_true")
+        parser.add_argument("--output", default=None, help="Where to save the results")
+        parser.add_argument("--baseline", default=None, help="Results to compare with")
+        parser.add_argument(
+            "--threshold",
+            type=float,
+            default=0.25,
+            help=(
+                "Fail when the best timing of a case is this much slower than the "
+                "median of the baseline (0.25 = 25%%)"
+            ),
+        )
+
+    def handle(self, *args, **options):
+        results = run_benchmarks(
+            seed=options["seed"],
+            count=options["positions"],
+            min_time=options["min_time"],
+            select=options["select"],
+            database=not options["skip_database"],
+            repeat=options["repeat"],
+        )
+        baseline = {}
+        if options["baseline"]:
+            with open(options["baseline"]) as f:
+                baseline = json.load(f)["results"]
+
+        for name, result in sorted(results.items()):
+            line = f"{name}: {result['min']:.2f}us (median {result['median']:.2f}us"
+            if name in baseline:
+                before = baseline[name]["median"]
+                line += f", baseline median {before:.2f}us, "
+                line += f"{(result['min'] / before - 1) * 100:+.0f}%"
+            self.stdout.write(line + ")")
+
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump(
+                    {
+                        "python": platform.python_version(),
+                        "seed": options["seed"],
+                        "results": results,
+                    },
+                    f,
+                    indent=2,
+                    sort_keys=True,
+                )
+
+        regressions = compare(results, baseline, options["threshold"])
+        if regressions:
+            raise CommandError(
+                "Slower than the baseline: "
+                + ", ".join(
+                    f"{name} ({before:.2f}us -> {after:.2f}us)"
+                    for name, before, after in regressions
+                )
+            )
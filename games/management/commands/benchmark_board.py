@@ -0,0 +1,109 @@
+import random
+import timeit
+from django.core.management.base import BaseCommand
+from games.bitboard import Bitboard
+from games.board_utils import scan, find_winner
+from games.move_utils import translate_move
+
+BOARD_SIZE = 7
+DIRECTIONS = [
+    ((-1, 0), (1, 0)),
+    ((0, -1), (0, 1)),
+    ((-1, -1), (1, 1)),
+    ((1, -1), (-1, 1)),
+]
+
+
+def list_find_winner(board, last_play):
+    """
+    The scan based implementation that used to back find_winner
+    """
+    player = board[last_play]
+    for first, second in DIRECTIONS:
+        if (
+            scan(board, first, last_play, player)
+            + scan(board, second, last_play, player)
+            >= 3
+        ):
+            return player
+    return None
+
+
+def list_translate_move(board, player, move):
+    """
+    The list walk that used to back translate_move
+    """
+    board_size = int(len(board) ** 0.5)
+    if (board.count(True) == board.count(False)) == player:
+        offset = move[0] * board_size
+        direction = (
+            range(offset, offset + board_size)
+            if move[1] == "L"
+            else range(offset + board_size - 1, offset - 1, -1)
+        )
+        for i in direction:
+            if board[i] is None:
+                return i
+
+
+def random_position(plays):
+    """
+    Plays random legal moves on a blank board and returns it with its last play
+    """
+    board = Bitboard(BOARD_SIZE)
+    last_play = 0
+    for _ in range(plays):
+        player = board.next_turn()
+        moves = board.legal_moves()
+        if not moves:
+            break
+        last_play = board.translate(player, random.choice(moves))
+        board[last_play] = player
+    return board, last_play
+
+
+class Command(BaseCommand):
+    help = "Compares the list based board logic against the bitboard engine"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--positions", type=int, default=200)
+        parser.add_argument("--repeat", type=int, default=50)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        random.seed(options["seed"])
+        positions = [
+            random_position(random.randint(1, BOARD_SIZE * BOARD_SIZE))
+            for _ in range(options["positions"])
+        ]
+        lists = [(board.to_list(), last_play) for board, last_play in positions]
+        move = (BOARD_SIZE // 2, "L")
+
+        cases = [
+            (
+                "find_winner",
+                lambda: [list_find_winner(b, p) for b, p in lists],
+                lambda: [find_winner(b, p) for b, p in positions],
+            ),
+            (
+                "translate_move",
+                lambda: [
+                    list_translate_move(b, b.count(True) == b.count(False), move)
+                    for b, _ in lists
+                ],
+                lambda: [translate_move(b, b.next_turn(), move) for b, _ in positions],
+            ),
+        ]
+        for name, legacy, bitboard in cases:
+            if legacy() != bitboard():
+                self.stderr.write(f"{name}: results differ between implementations")
+            legacy_time = min(timeit.repeat(legacy, number=options["repeat"], repeat=3))
+            bitboard_time = min(
+                timeit.repeat(bitboard, number=options["repeat"], repeat=3)
+            )
+            calls = options["repeat"] * len(positions)
+            self.stdout.write(
+                f"{name}: list {legacy_time / calls * 1e6:.2f}us, "
+                f"bitboard {bitboard_time / calls * 1e6:.2f}us "
+                f"({legacy_time / bitboard_time:.1f}x)"
+            )
@@ -0,0 +1,73 @@
+from concurrent.futures import ProcessPoolExecutor
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from games.analysis import analyse
+from games.bitboard import Bitboard, WIN_LENGTH
+from games.board_utils import encode_board
+from games.bot import Search, zobrist_hash
+from games.models import BOARD_SIZE
+from games.opening_book import write_book
+
+
+def positions_up_to(board_size, depth, win_length=WIN_LENGTH):
+    """
+    Every position reachable from the empty board in up to depth moves
+    Returns a dict of hash: board. Games that are already won (lines of
+    win_length) are left out.
+    """
+    positions = {}
+    frontier = [Bitboard(board_size)]
+    for _ in range(depth + 1):
+        next_frontier = []
+        for board in frontier:
+            key = zobrist_hash(board)
+            if key in positions:
+                continue
+            positions[key] = board
+            player = board.next_turn()
+            for position, move in Search(board).moves():
+                child = board.copy()
+                child[position] = player
+                if child.winner(position, win_length) is None:
+                    next_frontier.append(child)
+        frontier = next_frontier
+    return positions
+
+
+class Command(BaseCommand):
+    help = "Solves the early positions and writes them to the opening book"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--depth", type=int, default=2)
+        parser.add_argument("--board-size", type=int, default=BOARD_SIZE)
+        parser.add_argument("--win-length", type=int, default=WIN_LENGTH)
+        parser.add_argument("--time-budget", type=float, default=1.0)
+        parser.add_argument("--workers", type=int, default=None)
+        parser.add_argument(
+            "--output", default=getattr(settings, "OPENING_BOOK_PATH", None)
+        )
+
+    def handle(self, *args, **options):
+        positions = positions_up_to(
+            options["board_size"], options["depth"], options["win_length"]
+        )
+        self.stdout.write(f"Solving {len(positions)} positions")
+        keys = list(positions.keys())
+        with ProcessPoolExecutor(max_workers=options["workers"]) as executor:
+            results = executor.map(
+                analyse,
+                [encode_board(positions[key]) for key in keys],
+                [positions[key].next_turn() for key in keys],
+                [options["win_length"]] * len(keys),
+                [options["time_budget"]] * len(keys),
+                chunksize=8,
+            )
+            entries = [
+                (key, move, score)
+                for key, (move, score) in zip(keys, results)
+                if move is not None
+            ]
+        write_book(
+            options["output"], options["board_size"], options["win_length"], entries
+        )
+        self.stdout.write(f"Wrote {len(entries)} positions to {options['output']}")
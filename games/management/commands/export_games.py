@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from games.archive import export_games
+
+
+class Command(BaseCommand):
+    help = (
+        "Streams every finished game to a gzipped JSON lines archive, "
+        "optionally deleting the exported games"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("output", help="Path of the archive (.jsonl.gz)")
+        parser.add_argument("--chunk-size", type=int, default=1000)
+        parser.add_argument(
+            "--delete",
+            action="store_true",
+            help="Delete the exported games once the archive is complete",
+        )
+
+    def handle(self, *args, **options):
+        count = export_games(
+            options["output"],
+            chunk_size=options["chunk_size"],
+            delete=options["delete"],
+        )
+        self.stdout.write("Exported {} games to {}".format(count, options["output"]))
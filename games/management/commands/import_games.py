@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand, CommandError
+from games.archive import import_games
+
+
+class Command(BaseCommand):
+    help = "Adds the games of an archive written by export_games, in batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument("input", help="Path of the archive (.jsonl.gz)")
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        try:
+            count = import_games(options["input"], batch_size=options["batch_size"])
+        except (OSError, ValueError) as e:
+            raise CommandError(e)
+        self.stdout.write("Imported {} games from {}".format(count, options["input"]))
@@ -0,0 +1,36 @@
+import json
+from asgiref.sync import async_to_sync
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from games.bitboard import WIN_LENGTH
+from games.loadtest import run_load
+from games.models import BOARD_SIZE
+
+IN_MEMORY_LAYER = {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
+
+
+class Command(BaseCommand):
+    help = (
+        "Plays many concurrent games through the websocket consumers on the "
+        "in-memory channel layer and reports throughput, latency and queries per move"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--games", type=int, default=20)
+        parser.add_argument("--max-moves", type=int, default=30)
+        parser.add_argument("--board-size", type=int, default=BOARD_SIZE)
+        parser.add_argument("--win-length", type=int, default=WIN_LENGTH)
+        parser.add_argument("--skip-lobby", action="store_true")
+        parser.add_argument("--seed", type=int, default=None)
+
+    def handle(self, *args, **options):
+        with override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYER):
+            report = async_to_sync(run_load)(
+                games=options["games"],
+                max_moves=options["max_moves"],
+                board_size=options["board_size"],
+                win_length=options["win_length"],
+                lobby=not options["skip_lobby"],
+                seed=options["seed"],
+            )
+        self.stdout.write(json.dumps(report, indent=2))
@@ -0,0 +1,79 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from games.bitboard import WIN_LENGTH
+from games.models import BOARD_SIZE
+from games.simulator import POLICIES, BatchSimulator
+
+
+class Command(BaseCommand):
+    help = (
+        "Plays simulated games in NumPy batches and reports win rates by first "
+        "move and game lengths"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--games", type=int, default=10000)
+        parser.add_argument("--batch", type=int, default=10000)
+        parser.add_argument("--policy", choices=POLICIES, default="random")
+        parser.add_argument("--board-size", type=int, default=BOARD_SIZE)
+        parser.add_argument("--win-length", type=int, default=WIN_LENGTH)
+        parser.add_argument("--seed", type=int, default=None)
+        parser.add_argument(
+            "--cross-check",
+            type=int,
+            default=100,
+            help="Games of every batch replayed with find_winner",
+        )
+        parser.add_argument("--output", default=None)
+
+    def handle(self, *args, **options):
+        simulator = BatchSimulator(
+            options["board_size"],
+            options["win_length"],
+            options["policy"],
+            options["seed"],
+        )
+        reports = []
+        remaining = options["games"]
+        while remaining > 0:
+            result = simulator.run(min(options["batch"], remaining))
+            mismatches = simulator.cross_check(result, options["cross_check"])
+            if mismatches:
+                raise CommandError(
+                    "Simulated games {} disagree with find_winner".format(mismatches)
+                )
+            reports.append(result.report())
+            remaining -= len(result.winners)
+
+        report = merge_reports(reports)
+        output = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output)
+        else:
+            self.stdout.write(output)
+
+
+def merge_reports(reports):
+    """
+    Adds up the reports of every batch
+    """
+    games = sum(report["games"] for report in reports)
+    histogram = [sum(x) for x in zip(*(r["length_histogram"] for r in reports))]
+    by_first_move = {}
+    for report in reports:
+        for move, stats in report["by_first_move"].items():
+            total = by_first_move.setdefault(
+                move, {"games": 0, "player_1": 0, "player_2": 0, "draws": 0}
+            )
+            total["games"] += stats["games"]
+            for key in ("player_1", "player_2", "draws"):
+                total[key] += stats[key] * stats["games"]
+    for total in by_first_move.values():
+        for key in ("player_1", "player_2", "draws"):
+            total[key] /= total["games"]
+    return {
+        "games": games,
+        "by_first_move": by_first_move,
+        "length_histogram": histogram,
+    }
@@ -0,0 +1,162 @@
+"""
+Queues of games waiting for a second player, one queue per variant.
+pop_or_enqueue is atomic, so two players arriving at the same time can't
+take the same seat, and pairing doesn't need to scan the games table.
+"""
+
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from functools import lru_cache
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+
+# Cache alias of the queues, the lobby presence and their locks, which must not
+# be culled to make room (see settings.CACHES)
+COORDINATION_CACHE = "coordination"
+
+
+def coordination_cache():
+    return caches[COORDINATION_CACHE]
+
+
+@contextmanager
+def cache_lock(lock_key, timeout=5):
+    """
+    Holds a lock shared by every process using the coordination cache, taken
+    with cache.add, which is atomic on every backend
+    Raises TimeoutError if it can't be taken in timeout seconds
+    """
+    cache = coordination_cache()
+    token = uuid.uuid4().hex
+    deadline = time.monotonic() + timeout
+    while not cache.add(lock_key, token, timeout):
+        if time.monotonic() > deadline:
+            raise TimeoutError("Could not take the lock {}".format(lock_key))
+        time.sleep(0.001)
+    try:
+        yield
+    finally:
+        if cache.get(lock_key) == token:
+            cache.delete(lock_key)
+
+
+def matchmaking_key(board_size, win_length):
+    return "{}x{}-{}".format(board_size, board_size, win_length)
+
+
+class InMemoryQueue:
+    """
+    Process local queue. Used in tests and single process deployments.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._queues = defaultdict(deque)
+
+    def push(self, key, item):
+        with self._lock:
+            self._queues[key].append(item)
+
+    def pop_or_enqueue(self, key, factory):
+        """
+        Pops the oldest item of the queue. If the queue is empty, the result of
+        factory() is enqueued instead and None is returned.
+        """
+        with self._lock:
+            if self._queues[key]:
+                return self._queues[key].popleft()
+            self._queues[key].append(factory())
+            return None
+
+    def clear(self):
+        with self._lock:
+            self._queues.clear()
+
+
+class CacheQueue:
+    """
+    Queue stored in the coordination cache, shared by every process using it.
+    Items live in their own keys between a head and a tail counter, so push and pop
+    are O(1). Both are done holding a cache_lock.
+
+    The counters are stored without expiry and deleted once the queue is empty.
+    Should they be lost anyway (the cache was flushed), a lost head only makes
+    pop skip missing items, and a lost tail is found again after the last
+    waiting item.
+    """
+
+    prefix = "matchmaking"
+    lock_timeout = 5
+    # Waiting games are forgotten after a day
+    timeout = 24 * 60 * 60
+
+    def _key(self, key, name):
+        return "{}:{}:{}".format(self.prefix, key, name)
+
+    def _locked(self, key):
+        return cache_lock(self._key(key, "lock"), self.lock_timeout)
+
+    def _counters(self, key):
+        """
+        Returns the head and tail of the queue
+        """
+        cache = coordination_cache()
+        head_key, tail_key = self._key(key, "head"), self._key(key, "tail")
+        counters = cache.get_many([head_key, tail_key])
+        head = counters.get(head_key, 0)
+        tail = counters.get(tail_key)
+        if tail is None:
+            # Empty, or culled: the tail is after the last waiting item
+            tail = head
+            while cache.get(self._key(key, tail)) is not None:
+                tail += 1
+        return head, max(tail, head)
+
+    def _push(self, key, item):
+        cache = coordination_cache()
+        _head, tail = self._counters(key)
+        cache.set(self._key(key, tail), item, self.timeout)
+        cache.set(self._key(key, "tail"), tail + 1, None)
+
+    def push(self, key, item):
+        with self._locked(key):
+            self._push(key, item)
+
+    def pop_or_enqueue(self, key, factory):
+        """
+        Pops the oldest item of the queue. If the queue is empty, the result of
+        factory() is enqueued instead and None is returned.
+        """
+        cache = coordination_cache()
+        with self._locked(key):
+            head, tail = self._counters(key)
+            while head < tail:
+                item = cache.get(self._key(key, head))
+                cache.delete(self._key(key, head))
+                head += 1
+                if head == tail:
+                    cache.delete_many([self._key(key, "head"), self._key(key, "tail")])
+                else:
+                    cache.set(self._key(key, "head"), head, None)
+                if item is not None:  # Expired items are skipped
+                    return item
+            self._push(key, factory())
+            return None
+
+
+@lru_cache(maxsize=None)
+def _load_queue(path):
+    return import_string(path)()
+
+
+def get_queue():
+    """
+    Returns the queue configured in settings.MATCHMAKING_QUEUE
+    """
+    return _load_queue(
+        getattr(settings, "MATCHMAKING_QUEUE", "games.matchmaking.CacheQueue")
+    )
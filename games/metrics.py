@@ -0,0 +1,260 @@
+"""
+Counters, gauges and latency histograms for the consumers, rendered in the
+Prometheus text format by MetricsView.
+
+Metrics are kept per process: each worker serves its own endpoint, and
+Prometheus adds them up. When settings.METRICS_ENABLED is off, recording a
+value is a single settings lookup.
+"""
+
+import threading
+import time
+from django.conf import settings
+
+# Seconds
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+
+def enabled():
+    return getattr(settings, "METRICS_ENABLED", False)
+
+
+def format_labels(names, values, extra=""):
+    pairs = ['{}="{}"'.format(name, value) for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def samples(self):
+        """
+        Lists (suffix, label values, extra label, value)
+        """
+        with self._lock:
+            return [("", labels, "", value) for labels, value in self._values.items()]
+
+    def render(self):
+        lines = [
+            "# HELP {} {}".format(self.name, self.description),
+            "# TYPE {} {}".format(self.name, self.kind),
+        ]
+        # Sorted by labels only, the buckets of a histogram must stay in order
+        for suffix, labels, extra, value in sorted(self.samples(), key=lambda x: x[1]):
+            lines.append(
+                "{}{}{} {}".format(
+                    self.name, suffix, format_labels(self.labels, labels, extra), value
+                )
+            )
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        if not enabled():
+            return
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def inc(self, *labels, amount=1):
+        if not enabled():
+            return
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, value, *labels):
+        if not enabled():
+            return
+        with self._lock:
+            self._values[labels] = value
+
+
+class Timer:
+    """
+    Context manager observing the seconds spent inside it
+    """
+
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+        self.started = None
+
+    def __enter__(self):
+        if enabled():
+            self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.started is not None:
+            self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, description, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = buckets
+
+    def observe(self, value, *labels):
+        if not enabled():
+            return
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                # One count per bucket, then +Inf, then the sum
+                counts = self._values[labels] = [0] * (len(self.buckets) + 1) + [0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-2] += 1
+            counts[-1] += value
+
+    def time(self, *labels):
+        return Timer(self, labels)
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            items = [(labels, list(counts)) for labels, counts in self._values.items()]
+        for labels, counts in items:
+            total = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                total += count
+                samples.append(("_bucket", labels, 'le="{}"'.format(bound), total))
+            samples.append(("_count", labels, "", total))
+            samples.append(("_sum", labels, "", counts[-1]))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def clear(self):
+        for metric in self.metrics:
+            metric.clear()
+        open_games.clear()
+
+    def render(self):
+        return "\n".join(metric.render() for metric in self.metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+CONNECT_SECONDS = REGISTRY.register(
+    Histogram(
+        "connect_four_connect_seconds",
+        "Time to accept a websocket and send its first message",
+        ("consumer",),
+    )
+)
+RECEIVE_SECONDS = REGISTRY.register(
+    Histogram(
+        "connect_four_receive_seconds",
+        "Time to handle a websocket message, by kind of message",
+        ("consumer", "kind"),
+    )
+)
+GROUP_SEND_SECONDS = REGISTRY.register(
+    Histogram(
+        "connect_four_group_send_seconds",
+        "Time to hand a broadcast to the channel layer",
+        ("consumer",),
+    )
+)
+STATE_CHANGE_DB_SECONDS = REGISTRY.register(
+    Histogram(
+        "connect_four_state_change_db_seconds",
+        "Database time of change_state_forward (saving the move and the game)",
+    )
+)
+OPEN_SOCKETS = REGISTRY.register(
+    Gauge("connect_four_open_sockets", "Websockets currently open", ("consumer",))
+)
+ACTIVE_GAMES = REGISTRY.register(
+    Gauge(
+        "connect_four_active_games",
+        "Games with at least one websocket open in this process",
+    )
+)
+SENT_BYTES = REGISTRY.register(
+    Counter(
+        "connect_four_sent_bytes_total",
+        "Payload bytes sent to websockets",
+        ("consumer",),
+    )
+)
+SUPPRESSED_BROADCASTS = REGISTRY.register(
+    Counter(
+        "connect_four_suppressed_broadcasts_total",
+        "Events merged into another broadcast, or cancelled, instead of sent",
+        ("consumer",),
+    )
+)
+
+# Open sockets of every active game
+open_games = {}
+_open_games_lock = threading.Lock()
+
+
+def socket_opened(consumer, game_id=None):
+    if not enabled():
+        return
+    OPEN_SOCKETS.inc(consumer)
+    if game_id is not None:
+        with _open_games_lock:
+            open_games[game_id] = open_games.get(game_id, 0) + 1
+            ACTIVE_GAMES.set(len(open_games))
+
+
+def socket_closed(consumer, game_id=None):
+    if not enabled():
+        return
+    OPEN_SOCKETS.dec(consumer)
+    if game_id is not None:
+        with _open_games_lock:
+            if open_games.get(game_id, 0) <= 1:
+                open_games.pop(game_id, None)
+            else:
+                open_games[game_id] -= 1
+            ACTIVE_GAMES.set(len(open_games))
+
+
+def payload_sent(consumer, text_data=None, bytes_data=None):
+    if not enabled():
+        return
+    if text_data is not None:
+        SENT_BYTES.inc(consumer, amount=len(text_data.encode()))
+    if bytes_data is not None:
+        SENT_BYTES.inc(consumer, amount=len(bytes_data))
@@ -0,0 +1,72 @@
+import base64
+import pickle
+
+from django.db import migrations
+
+# Frozen copy of the codec in games.board_utils (format version 1), so later
+# changes to the app code do not alter what this migration writes.
+BOARD_FORMAT_VERSION = 1
+
+
+def mask_length(size):
+    return (size * (size + 1) + 7) // 8
+
+
+def encode_cells(cells):
+    size = int(len(cells) ** 0.5)
+    player_1 = player_2 = 0
+    for position in range(size * size):
+        bit = 1 << (position // size * (size + 1) + position % size)
+        if cells[position] is True:
+            player_1 |= bit
+        elif cells[position] is False:
+            player_2 |= bit
+    length = mask_length(size)
+    output = (
+        bytes((BOARD_FORMAT_VERSION, size))
+        + player_1.to_bytes(length, "little")
+        + player_2.to_bytes(length, "little")
+    )
+    return base64.b64encode(output).decode("utf-8")
+
+
+def decode_cells(board):
+    data = base64.b64decode(board.encode())
+    size = data[1]
+    length = mask_length(size)
+    player_1 = int.from_bytes(data[2 : 2 + length], "little")
+    player_2 = int.from_bytes(data[2 + length :], "little")
+    cells = []
+    for position in range(size * size):
+        bit = 1 << (position // size * (size + 1) + position % size)
+        cells.append(True if player_1 & bit else False if player_2 & bit else None)
+    return cells
+
+
+def pickled_to_compact(apps, schema_editor):
+    """
+    Rewrites every board stored as a base64 pickle with the compact format
+    """
+    Game = apps.get_model("games", "Game")
+    for game in Game.objects.exclude(board="").iterator():
+        cells = pickle.loads(base64.b64decode(game.board.encode()))
+        Game.objects.filter(id=game.id).update(board=encode_cells(cells))
+
+
+def compact_to_pickled(apps, schema_editor):
+    Game = apps.get_model("games", "Game")
+    for game in Game.objects.exclude(board="").iterator():
+        cells = decode_cells(game.board)
+        board = base64.b64encode(pickle.dumps(cells)).decode("utf-8")
+        Game.objects.filter(id=game.id).update(board=board)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("games", "0007_auto_20200507_1931"),
+    ]
+
+    operations = [
+        migrations.RunPython(pickled_to_compact, compact_to_pickled),
+    ]
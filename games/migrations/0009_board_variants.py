@@ -0,0 +1,28 @@
+# Generated by Django 3.0.5 on 2026-10-18 18:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('games', '0008_compact_board_format'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='board_size',
+            field=models.PositiveSmallIntegerField(default=7),
+        ),
+        migrations.AddField(
+            model_name='game',
+            name='win_length',
+            field=models.PositiveSmallIntegerField(default=4),
+        ),
+        migrations.AlterField(
+            model_name='move',
+            name='move',
+            field=models.CharField(max_length=9),
+        ),
+    ]
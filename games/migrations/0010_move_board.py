@@ -0,0 +1,66 @@
+# Generated by Django 3.0.5 on 2026-10-18 18:03
+
+import base64
+import re
+
+from django.db import migrations, models
+
+# Frozen copy of the board format (version 1) and the side-stacking rules
+BOARD_FORMAT_VERSION = 1
+MOVE_EXP = re.compile(r"\[([0-9]{1,2}), '([RL])'\]")
+
+
+def encode_masks(size, player_1, player_2):
+    length = (size * (size + 1) + 7) // 8
+    output = (
+        bytes((BOARD_FORMAT_VERSION, size))
+        + player_1.to_bytes(length, "little")
+        + player_2.to_bytes(length, "little")
+    )
+    return base64.b64encode(output).decode("utf-8")
+
+
+def backfill_move_boards(apps, schema_editor):
+    """
+    Replays every game once, from its oldest move, storing the board after each move
+    """
+    Game = apps.get_model("games", "Game")
+    Move = apps.get_model("games", "Move")
+    for game in Game.objects.iterator():
+        size = game.board_size
+        stride = size + 1
+        full_row = (1 << size) - 1
+        masks = {True: 0, False: 0}
+        moves = Move.objects.filter(game=game).order_by("timestamp", "id")
+        for move in moves.iterator():
+            m = MOVE_EXP.match(move.move)
+            if m is None or int(m.group(1)) >= size:
+                break
+            row = int(m.group(1))
+            occupancy = ((masks[True] | masks[False]) >> (row * stride)) & full_row
+            free = ~occupancy & full_row
+            if not free:
+                break
+            col = (free & -free).bit_length() - 1
+            if m.group(2) == "R":
+                col = free.bit_length() - 1
+            player = move.player_name == game.player_1
+            masks[player] |= 1 << (row * stride + col)
+            board = encode_masks(size, masks[True], masks[False])
+            Move.objects.filter(id=move.id).update(board=board)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('games', '0009_board_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='move',
+            name='board',
+            field=models.TextField(default=''),
+        ),
+        migrations.RunPython(backfill_move_boards, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 3.0.5 on 2026-10-18 18:08
+
+from django.db import migrations, models
+
+
+def number_moves(apps, schema_editor):
+    """
+    Numbers the moves of every game from 1, oldest first
+    """
+    Game = apps.get_model("games", "Game")
+    Move = apps.get_model("games", "Move")
+    for game_id in Game.objects.values_list("id", flat=True).iterator():
+        moves = Move.objects.filter(game_id=game_id).order_by("timestamp", "id")
+        for seq, move_id in enumerate(moves.values_list("id", flat=True), 1):
+            Move.objects.filter(id=move_id).update(seq=seq)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('games', '0010_move_board'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='move',
+            options={'ordering': ['-seq']},
+        ),
+        migrations.AddField(
+            model_name='move',
+            name='seq',
+            field=models.PositiveIntegerField(null=True),
+        ),
+        migrations.RunPython(number_moves, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='move',
+            name='seq',
+            field=models.PositiveIntegerField(),
+        ),
+        migrations.AddIndex(
+            model_name='game',
+            index=models.Index(fields=['player_1', 'status'], name='games_game_player__ac9a9b_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='game',
+            index=models.Index(fields=['player_2', 'status'], name='games_game_player__900114_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='move',
+            constraint=models.UniqueConstraint(fields=('game', 'seq'), name='unique_move_seq'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.0.5 on 2026-10-18 18:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('games', '0011_move_seq_and_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='against_bot',
+            field=models.BooleanField(default=False),
+        ),
+    ]
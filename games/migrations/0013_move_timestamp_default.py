@@ -0,0 +1,19 @@
+# Generated by Django 3.0.5 on 2026-10-18 18:29
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('games', '0012_game_against_bot'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='move',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,55 @@
+import re
+
+from django.db import migrations, models
+
+# Frozen copy of the move codec in games.move_utils, so later changes to the
+# app code do not alter what this migration writes.
+MOVE_EXP = re.compile(r"\[([0-9]{1,2}), '([RL])'\]")
+SIDES = ("L", "R")
+
+
+def strings_to_codes(apps, schema_editor):
+    """
+    Encodes every move stored as a string ("[3, 'L']")
+    """
+    Move = apps.get_model("games", "Move")
+    for move_id, move in Move.objects.values_list("id", "move").iterator():
+        m = MOVE_EXP.match(move)
+        if m is None:
+            raise ValueError("Move {} can't be parsed: {!r}".format(move_id, move))
+        code = int(m.group(1)) * 2 + SIDES.index(m.group(2))
+        Move.objects.filter(id=move_id).update(code=code)
+
+
+def codes_to_strings(apps, schema_editor):
+    Move = apps.get_model("games", "Move")
+    for move_id, code in Move.objects.values_list("id", "code").iterator():
+        move = str([code >> 1, SIDES[code & 1]])
+        Move.objects.filter(id=move_id).update(move=move)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("games", "0014_game_version"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="move",
+            name="code",
+            field=models.PositiveSmallIntegerField(null=True),
+        ),
+        migrations.AlterField(
+            model_name="move",
+            name="move",
+            field=models.CharField(max_length=9, default=""),
+        ),
+        migrations.RunPython(strings_to_codes, codes_to_strings),
+        migrations.RemoveField(model_name="move", name="move"),
+        migrations.AlterField(
+            model_name="move",
+            name="code",
+            field=models.PositiveSmallIntegerField(),
+        ),
+    ]
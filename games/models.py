@@ -1,16 +1,41 @@
-from django.db import models
-from django.db.models import Q
+from collections import Counter
+from django.conf import settings
+from django.core.cache import cache
+from django.db import models, transaction
+from django.db.models import F, Q
+from django.utils import timezone
 import json
 from .board_utils import (
-    pickle_board,
+    encode_board,
+    decode_board,
     generate_board,
-    parse_board_from_string,
     board_full,
     find_winner,
 )
-from .move_utils import translate_move, next_turn, apply_move, parse_move_from_string
+from .bitboard import Bitboard, WIN_LENGTH
+from .bot import best_move
+from .opening_book import book_lookup
+from .matchmaking import get_queue, matchmaking_key
+from .metrics import STATE_CHANGE_DB_SECONDS
+from .move_utils import (
+    translate_move,
+    next_turn,
+    apply_move,
+    decode_move,
+    decode_moves,
+    encode_move,
+    parse_move_from_string,
+)
+from .state_cache import get_state, invalidate_state, put_state
 
 BOARD_SIZE = 7
+MAX_BOARD_SIZE = 15
+# Name shown for the server side player in games against the bot
+BOT_NAME = "Bot"
+# Hits and misses of the decoded board cache kept by every Game instance
+BOARD_CACHE_STATS = Counter()
+# Replay timelines of finished games are cached for a day after they are built
+TIMELINE_TIMEOUT = 24 * 60 * 60
 GAME_STATUS = [
     ("PENDING", "Pending"),
     ("STARTED", "Started"),
@@ -18,35 +43,102 @@ GAME_STATUS = [
 ]
 
 
+class GameConflict(Exception):
+    """
+    The game was changed by someone else since it was loaded
+    """
+
+
 class GameManager(models.Manager):
-    def create(self, **kwargs):
+    def create_game(self, **kwargs):
         """
-        Override the method to generate a board with the BOARD_SIZE
+        Creates the game with a board of the game's board_size (BOARD_SIZE by default)
         Lambdas and closures don't play well with django migrations
+        Raises ValueError for sizes or win lengths that can't be played
         """
-        kwargs["board"] = generate_board(BOARD_SIZE)
+        board_size = kwargs.setdefault("board_size", BOARD_SIZE)
+        win_length = kwargs.setdefault("win_length", WIN_LENGTH)
+        if not 1 <= board_size <= MAX_BOARD_SIZE or not 1 < win_length <= board_size:
+            raise ValueError("Invalid board size or win length")
+        kwargs["board"] = generate_board(board_size)
         return super().create(**kwargs)
 
-    def make_seat(self, player_name):
+    def create(self, **kwargs):
         """
-        Looks for empty seats to occupy. Create a new game if
-        no suitable game is found.
+        Override the method to generate the board (see create_game)
+        A game that is waiting for a second player is added to the matchmaking queue
         """
-        empty_games = self.filter(~Q(status="FINISHED")).filter(player_2="")
-        game = None
-        if empty_games.exists():
-            game = empty_games.first()
-            game.player_2 = player_name
-            game.status = "STARTED"
-            game.save()
-        else:
-            game = self.create(player_1=player_name)
-
+        game = self.create_game(**kwargs)
+        if game.player_1 and not game.player_2 and not game.finished:
+            get_queue().push(matchmaking_key(game.board_size, game.win_length), game.id)
         return game
 
-    def find_game(self, player_name):
+    def take_seat(self, game_id, player_name):
+        """
+        Joins the game as player_2 with a conditional update, so the seat can't be
+        taken twice. Returns False if the game is gone, finished or already full.
+        """
+        taken = bool(
+            self.filter(id=game_id, player_2="")
+            .exclude(status="FINISHED")
+            .exclude(player_1=player_name)
+            .update(player_2=player_name, status="STARTED", version=F("version") + 1)
+        )
+        if taken:
+            invalidate_state(game_id)
+        return taken
+
+    def make_seat(self, player_name, board_size=BOARD_SIZE, win_length=WIN_LENGTH):
+        """
+        Pops the oldest game of the same variant waiting for a second player from the
+        matchmaking queue. Create a new game, and queue it, if no suitable game is found.
+        Games that can't be joined anymore are dropped from the queue.
+        """
+        queue = get_queue()
+        key = matchmaking_key(board_size, win_length)
+        created = []
+
+        def new_game():
+            created.append(
+                self.create_game(
+                    player_1=player_name, board_size=board_size, win_length=win_length
+                )
+            )
+            return created[0].id
+
+        while True:
+            game_id = queue.pop_or_enqueue(key, new_game)
+            if created:
+                return created[0]
+            if self.take_seat(game_id, player_name):
+                return self.get(id=game_id)
+
+    def get_with_snapshot(self, game_id):
+        """
+        Returns the game and its serialized snapshot
+        Both come from the game state cache when it has them, without any query.
+        Otherwise they are loaded and cached.
+        """
+        state = get_state(game_id)
+        if state is None:
+            game = self.get(id=game_id)
+            return game, game.cache_state()
+        fields = state["fields"]
+        game = self.model.from_db(self.db, list(fields), list(fields.values()))
+        game._board_cache = state["board"]
+        return game, state["payload"]
+
+    def find_game(
+        self,
+        player_name,
+        board_size=BOARD_SIZE,
+        win_length=WIN_LENGTH,
+        against_bot=False,
+    ):
         """
         Finds a game for the player and joins it
+        The variant and the opponent are only used when a new seat is needed.
+        Games against the bot start right away, with the bot as player_2.
         """
         unfinished_games = self.filter(~Q(status="FINISHED"))
         current_games = unfinished_games.filter(
@@ -54,8 +146,17 @@ class GameManager(models.Manager):
         )
         if current_games.exists():
             current_game = current_games.first()
+        elif against_bot:
+            current_game = self.create(
+                player_1=player_name,
+                player_2=BOT_NAME,
+                status="STARTED",
+                against_bot=True,
+                board_size=board_size,
+                win_length=win_length,
+            )
         else:
-            current_game = self.make_seat(player_name)
+            current_game = self.make_seat(player_name, board_size, win_length)
         return current_game
 
 
@@ -65,33 +166,186 @@ class Game(models.Model):
     Stores the game state.
     Avoid using save() after modifying the board in another layer to keep integrity.
     Use the change_state_forward method instead to add new player movements.
+    The decoded board is cached per instance. Assigning board (which also happens
+    on refresh_from_db) drops the cache.
     """
 
     player_1 = models.CharField(max_length=30, default="")
     player_2 = models.CharField(max_length=30, default="")
     board = models.TextField(default="")
+    board_size = models.PositiveSmallIntegerField(default=BOARD_SIZE)
+    win_length = models.PositiveSmallIntegerField(default=WIN_LENGTH)
     status = models.CharField(
         default=GAME_STATUS[0][0], max_length=8, choices=GAME_STATUS
     )
     winner = models.BooleanField(null=True, default=None)
+    against_bot = models.BooleanField(default=False)
+    # Increased by every write of a move or a seat, moves are only written
+    # if the version didn't change since the game was loaded
+    version = models.PositiveIntegerField(default=0)
     objects = GameManager()
 
+    class Meta:
+        indexes = [
+            # find_game: unfinished games of a player
+            models.Index(fields=["player_1", "status"]),
+            models.Index(fields=["player_2", "status"]),
+        ]
+
+    # Move and landing position of the last play accepted by change_state_forward
+    last_move = None
+    last_position = None
+
     def __str__(self):
         return "{} vs {}".format(self.player_1, self.player_2)
 
-    def to_json(self):
+    def __setattr__(self, name, value):
+        if name == "board":
+            self.__dict__.pop("_board_cache", None)
+        super().__setattr__(name, value)
+
+    @property
+    def seq(self):
+        """
+        Number of moves played so far, used by clients to detect missed updates
+        """
+        board = self.python_board
+        return len(board) - board.count(None)
+
+    def to_json(self, moves=None):
+        """
+        Full snapshot of the game, including every move (newest first)
+        The moves, as dicts, can be passed in to skip the query
+        """
+        if moves is None:
+            moves = [x.to_dict() for x in Move.objects.filter(game=self)]
         return json.dumps(
             {
-                "board": self.python_board,
+                "type": "snapshot",
+                "seq": self.seq,
+                "board": self.python_board.to_list(),
+                "board_size": self.board_size,
+                "win_length": self.win_length,
                 "player_1": self.player_1,
                 "player_2": self.player_2,
                 "status": self.status,
                 "winner": self.winner,
                 "next_player": self.get_next_player_turn(),
-                "moves": [x.to_dict() for x in Move.objects.filter(game=self)],
+                "moves": moves,
+            }
+        )
+
+    def to_delta_json(self):
+        """
+        Small update with only the last accepted move and the resulting state
+        """
+        return json.dumps(
+            {
+                "type": "move",
+                "seq": self.seq,
+                "move": self.last_move.to_dict(),
+                "position": self.last_position,
+                "player": self.last_move.player_name == self.player_1,
+                "status": self.status,
+                "winner": self.winner,
+                "next_player": self.get_next_player_turn(),
             }
         )
 
+    def cached_state(self, payload):
+        """
+        What the game state cache keeps: the fields, the decoded board and the snapshot
+        """
+        fields = {
+            f.attname: getattr(self, f.attname) for f in self._meta.concrete_fields
+        }
+        return {"fields": fields, "board": self.python_board, "payload": payload}
+
+    def cache_state(self, replace=False):
+        """
+        Stores the current state in the game state cache
+        Returns the serialized snapshot
+        """
+        payload = self.to_json()
+        put_state(self.id, self.seq, self.cached_state(payload), replace)
+        return payload
+
+    def update_cached_state(self):
+        """
+        Builds the state after the last accepted move from the cached state
+        before it, so it takes no queries, and stores it once the move is committed.
+        When the previous state isn't cached, the cached state is dropped instead.
+        """
+        seq = self.seq
+        previous = get_state(self.id, seq - 1)
+        if previous is None:
+            invalidate_state(self.id)
+            return
+        moves = json.loads(previous["payload"])["moves"]
+        payload = self.to_json([self.last_move.to_dict()] + moves)
+        state = self.cached_state(payload)
+        transaction.on_commit(lambda: put_state(self.id, seq, state))
+
+    def replay_timeline(self):
+        """
+        Every move of the game, oldest first, with the position where the piece landed.
+        The board after any move can be rebuilt by the client from the moves before it.
+        Computed in one forward pass. Finished games never change, so theirs is cached.
+        """
+        key = "replay_timeline:{}".format(self.id)
+        if self.finished:
+            timeline = cache.get(key)
+            if timeline is not None:
+                return timeline
+        board = Bitboard(self.board_size)
+        moves = []
+        ids, packed = self.packed_moves()
+        for index, (move_id, move) in enumerate(zip(ids, decode_moves(packed))):
+            # Players alternate, player_1 first
+            player = index % 2 == 0
+            position = board.translate(player, move)
+            if position is None:
+                break
+            board[position] = player
+            moves.append({"id": move_id, "position": position, "player": player})
+        timeline = {"board_size": self.board_size, "moves": moves}
+        if self.finished:
+            cache.set(key, timeline, TIMELINE_TIMEOUT)
+        return timeline
+
+    def packed_moves(self, until=None):
+        """
+        Ids of the moves, oldest first, and the moves packed one byte each
+        (see move_utils.encode_moves), up to the seq given
+        """
+        moves = Move.objects.filter(game=self)
+        if until is not None:
+            moves = moves.filter(seq__lte=until)
+        rows = list(moves.order_by("seq").values_list("id", "code"))
+        return [move_id for move_id, _ in rows], bytes(code for _, code in rows)
+
+    def bot_to_move(self):
+        return (
+            self.against_bot and not self.finished and not self.get_next_player_turn()
+        )
+
+    def play_bot_move(self, move=None, persist=True):
+        """
+        Plays the bot's reply through change_state_forward
+        The move can be searched beforehand (see games.analysis), otherwise it is
+        taken from the opening book or searched here.
+        Returns False if it was not the bot's turn
+        """
+        if not self.bot_to_move():
+            return False
+        if move is None:
+            board = self.python_board
+            known = book_lookup(board, self.win_length)
+            budget = getattr(settings, "BOT_TIME_BUDGET", 1.0)
+            move, _score = known or best_move(board, False, self.win_length, budget)
+        self.change_state_forward(False, list(move), persist)
+        return True
+
     def get_next_player_turn(self):
         """
         Checks the board to find who is next
@@ -100,7 +354,24 @@ class Game(models.Model):
 
     @property
     def python_board(self):
-        return parse_board_from_string(self.board)
+        """
+        Returns a copy of the decoded board, so callers can modify it freely.
+        The stored string is only decoded the first time after it changes.
+        """
+        board = self.__dict__.get("_board_cache")
+        if board is None:
+            BOARD_CACHE_STATS["misses"] += 1
+            board = self._board_cache = decode_board(self.board)
+        else:
+            BOARD_CACHE_STATS["hits"] += 1
+        return board.copy()
+
+    def set_python_board(self, board):
+        """
+        Encodes the board into the board field and keeps it as the cached decoded board
+        """
+        self.board = encode_board(board)
+        self._board_cache = board.copy()
 
     @property
     def finished(self):
@@ -113,17 +384,24 @@ class Game(models.Model):
     def check_finished(self):
         return board_full(self.python_board)
 
-    def change_state_forward(self, player, new_move):
+    def change_state_forward(self, player, new_move, persist=True):
         """
         Check that the move is valid, and if it is, persist it to the database
         All the side-effects are contained in this method, so additional changes are performed too
+        last_move and last_position are set when the move is accepted, None otherwise
+        With persist=False nothing is written, last_move is left unsaved for the
+        move log to write it later (see games.move_log)
+        The game is written with a single conditional update on its version. Raises
+        GameConflict if it changed since it was loaded, the instance must be
+        reloaded then.
         """
+        self.last_move = self.last_position = None
         trans_move = translate_move(self.python_board, player, new_move)
         if trans_move is not None and not self.finished:
             board = self.python_board
             board[trans_move] = player
-            winner = find_winner(board, trans_move)
-            self.board = pickle_board(board)
+            winner = find_winner(board, trans_move, self.win_length)
+            self.set_python_board(board)
             if winner is None:
                 self.status = "FINISHED" if self.check_finished() else self.status
             else:
@@ -132,8 +410,33 @@ class Game(models.Model):
 
             # Save move and board
             player_name = self.player_1 if player else self.player_2
-            Move.objects.create(game=self, move=new_move, player_name=player_name)
-            self.save()
+            self.last_move = Move(
+                game=self,
+                code=encode_move(new_move),
+                player_name=player_name,
+                board=self.board,
+                seq=self.seq,
+            )
+            self.last_position = trans_move
+            if persist:
+                with STATE_CHANGE_DB_SECONDS.time():
+                    updated = Game.objects.filter(
+                        id=self.id, version=self.version
+                    ).update(
+                        board=self.board,
+                        status=self.status,
+                        winner=self.winner,
+                        version=self.version + 1,
+                    )
+                    if not updated:
+                        raise GameConflict(self.id)
+                    self.last_move.save(force_insert=True)
+            self.version += 1
+            if persist:
+                self.update_cached_state()
+            else:
+                # Only published once written, the move log serves it meanwhile
+                invalidate_state(self.id)
         return self
 
 
@@ -141,26 +444,63 @@ class Move(models.Model):
     """
     This class stores the moves for the game.
     This will be useful to display a list of moves to the users.
+    Every move keeps the encoded board right after it was played, so replays
+    don't have to go through the previous moves.
     """
 
     game = models.ForeignKey(Game, null=False, on_delete=models.CASCADE)
-    move = models.CharField(max_length=8)
+    # Row and side, see move_utils.encode_move. Also settable through move.
+    code = models.PositiveSmallIntegerField()
     player_name = models.CharField(max_length=30)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Set when the move is played, which can be before it is saved (see games.move_log)
+    timestamp = models.DateTimeField(default=timezone.now)
+    board = models.TextField(default="")
+    # Position of the move in its game, starting at 1. Timestamps can tie.
+    seq = models.PositiveIntegerField()
 
     class Meta:
-        ordering = ["-timestamp"]
+        ordering = ["-seq"]
+        constraints = [
+            models.UniqueConstraint(fields=["game", "seq"], name="unique_move_seq")
+        ]
+
+    @property
+    def move(self):
+        """
+        The move as [row, side]
+        """
+        return decode_move(self.code)
+
+    @move.setter
+    def move(self, move):
+        """
+        Takes [row, side], or a string in the old format ("[3, 'L']")
+        """
+        if isinstance(move, str):
+            move = parse_move_from_string(move, MAX_BOARD_SIZE)
+        self.code = encode_move(move)
+
+    def save(self, *args, **kwargs):
+        """
+        Numbers the move after the last one of its game when seq is not given
+        """
+        if self.seq is None:
+            last = Move.objects.filter(game=self.game).aggregate(models.Max("seq"))
+            self.seq = (last["seq__max"] or 0) + 1
+        super().save(*args, **kwargs)
 
     def reconstruct_up_to(self):
         """
-        Applies all the moves up to the current move, including it
+        Returns the board right after this move
+        Uses the stored board, moves without one are replayed from the start of the game
         """
-        moves = Move.objects.filter(game=self.game, timestamp__lt=self.timestamp)
-        board = parse_board_from_string(generate_board(BOARD_SIZE))
-        for i in reversed([self] + list(moves)):  # From oldest move
-            player = i.player_name == self.game.player_1
-            board = apply_move(board, player, parse_move_from_string(i.move))
-        return board
+        if self.board:
+            return decode_board(self.board).to_list()
+        _ids, packed = self.game.packed_moves(until=self.seq)
+        board = Bitboard(self.game.board_size)
+        for index, move in enumerate(decode_moves(packed)):
+            board = apply_move(board, index % 2 == 0, move)
+        return board.to_list()
 
     def to_dict(self):
         return {
@@ -0,0 +1,271 @@
+"""
+Write-behind mode for moves (settings.MOVE_WRITE_BEHIND).
+Accepted moves are applied to the game in memory, appended to this log and
+broadcast right away. A background thread writes them, game by game: one
+update of the changed columns, conditional on the version the database
+should still have, and one bulk_create of the moves.
+
+Durability bound: a crash loses at most the moves of the last
+MOVE_LOG_FLUSH_INTERVAL seconds, and never more than MOVE_LOG_MAX_PENDING
+moves: a move only gets into the log if there is room for it (see slot),
+otherwise it waits for the flusher and is rejected if it doesn't make room in
+time. The log is flushed when the process exits (stop, registered with atexit).
+
+The moves of a game that can't be written (the game was changed by someone
+else, or a row is refused) are dropped and logged, without holding up the
+other games. The next move of that game raises GameConflict, so its actor
+reloads it from the database.
+
+The log lives in the process, so every move of a game must go through the
+same process: a single worker, or games routed to workers by id. Move ids are
+only known once the moves are written, and only on backends that return them
+from bulk_create.
+"""
+
+import atexit
+import copy
+import logging
+import threading
+from contextlib import contextmanager
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from .models import Game, GameConflict, Move
+from .state_cache import invalidate_state
+
+logger = logging.getLogger(__name__)
+
+
+def write_behind():
+    return getattr(settings, "MOVE_WRITE_BEHIND", False)
+
+
+def copy_game(game):
+    """
+    Copy of the game that moves played on the original don't change
+    The decoded board is shared, it is replaced on every move, never changed.
+    """
+    copied = copy.copy(game)
+    copied._state = copy.copy(game._state)
+    return copied
+
+
+class MoveLogFull(Exception):
+    """
+    The log stayed full for longer than the move was willing to wait
+    """
+
+
+class MoveLog:
+    # Seconds a move waits for room in a full log before it is rejected
+    full_timeout = 5
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Notified whenever moves leave the log
+        self._room = threading.Condition(self._lock)
+        self._flush_lock = threading.Lock()
+        # Latest state of every game with moves in the log
+        self._games = {}
+        # (move, changed game columns right after it), oldest first
+        self._pending = []
+        # Moves that got a slot and aren't appended yet
+        self._reserved = 0
+        # Games whose moves were dropped, until their next move
+        self._dropped = set()
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread = None
+
+    def get_game(self, game_id):
+        """
+        Returns the latest state of the game if it has moves in the log, None otherwise
+        It is a copy, the actor of the game keeps playing on its own instance.
+        """
+        with self._lock:
+            game = self._games.get(int(game_id))
+        return game and copy_game(game)
+
+    def pending_moves(self, game_id):
+        with self._lock:
+            return [move for move, _ in self._pending if move.game_id == int(game_id)]
+
+    @contextmanager
+    def slot(self, game):
+        """
+        Room for one move of the game, to be taken before playing it
+        Raises MoveLogFull if the log doesn't make room within full_timeout, and
+        GameConflict if moves of the game were dropped (the game must be reloaded)
+        """
+        limit = getattr(settings, "MOVE_LOG_MAX_PENDING", 500)
+        with self._lock:
+            if game.id in self._dropped:
+                self._dropped.discard(game.id)
+                raise GameConflict(game.id)
+            if len(self._pending) + self._reserved >= limit:
+                self._wakeup.set()
+                has_room = self._room.wait_for(
+                    lambda: len(self._pending) + self._reserved < limit,
+                    self.full_timeout,
+                )
+                if not has_room:
+                    raise MoveLogFull()
+            self._reserved += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._reserved -= 1
+
+    def append(self, game):
+        """
+        Logs the move the game just accepted (game.last_move), inside a slot
+        Moves of a game must be appended one at a time, its actor does that
+        """
+        fields = {
+            "board": game.board,
+            "status": game.status,
+            "winner": game.winner,
+            "version": game.version,
+        }
+        # Taken while no move is half applied, readers get it from other threads
+        snapshot = copy_game(game)
+        with self._lock:
+            self._games[game.id] = snapshot
+            self._pending.append((game.last_move, fields))
+            full = len(self._pending) >= getattr(settings, "MOVE_LOG_MAX_PENDING", 500)
+        self.start()
+        if full:
+            self._wakeup.set()
+
+    def to_json(self, game):
+        """
+        Snapshot of the game including the moves that are not written yet
+        """
+        pending = self.pending_moves(game.id)
+        if not pending:
+            return game.to_json()
+        # A flush can finish between both reads, so moves can show up twice
+        moves = {move.seq: move for move in Move.objects.filter(game=game)}
+        moves.update((move.seq, move) for move in pending)
+        return game.to_json([moves[seq].to_dict() for seq in sorted(moves)[::-1]])
+
+    def flush(self):
+        """
+        Writes the pending moves, game by game. Returns how many were written.
+        Games that can't be written have their moves dropped. On any other error
+        the moves of the games not written yet stay in the log, to be written by
+        the next flush.
+        """
+        with self._flush_lock:
+            with self._lock:
+                batch = list(self._pending)
+            games = {}
+            for move, fields in batch:
+                # Every move increases the version by one
+                game = games.setdefault(
+                    move.game_id, {"moves": [], "version": fields["version"] - 1}
+                )
+                game["moves"].append(move)
+                game["fields"] = fields
+            written, dropped = 0, set()
+            try:
+                for game_id, game in games.items():
+                    try:
+                        self.write_game(game_id, game)
+                    except (GameConflict, IntegrityError):
+                        logger.exception(
+                            "Dropping %s moves of game %s", len(game["moves"]), game_id
+                        )
+                        dropped.add(game_id)
+                    else:
+                        written += len(game["moves"])
+                    # Done with it either way
+                    game["done"] = True
+            finally:
+                self.forget(batch, games, dropped)
+            return written
+
+    def write_game(self, game_id, game):
+        with transaction.atomic():
+            updated = Game.objects.filter(id=game_id, version=game["version"]).update(
+                **game["fields"]
+            )
+            if not updated:
+                raise GameConflict(game_id)
+            Move.objects.bulk_create(game["moves"])
+
+    def forget(self, batch, games, dropped):
+        """
+        Removes the moves of the games done by a flush, and every later move of
+        the dropped games, which were played on top of them
+        """
+        done = {id(move) for move, _ in batch if games[move.game_id].get("done")}
+        with self._lock:
+            self._pending = [
+                (move, fields)
+                for move, fields in self._pending
+                if id(move) not in done and move.game_id not in dropped
+            ]
+            waiting = {move.game_id for move, _ in self._pending}
+            for game_id in games:
+                if games[game_id].get("done") and game_id not in waiting:
+                    # The database is up to date, the next move loads it again
+                    self._games.pop(game_id, None)
+            self._dropped |= dropped
+            self._room.notify_all()
+        for game_id in dropped:
+            # Its cached state may have been built from the moves that were dropped
+            invalidate_state(game_id)
+
+    def clear(self):
+        """
+        Drops everything in the log without writing it
+        """
+        with self._lock:
+            self._pending = []
+            self._games = {}
+            self._dropped = set()
+            self._room.notify_all()
+        self._wakeup.clear()
+
+    def start(self):
+        """
+        Starts the flusher thread, the first time only
+        """
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stopping = False
+            self._thread = threading.Thread(
+                target=self._run, name="move-log-flusher", daemon=True
+            )
+            self._thread.start()
+        atexit.register(self.stop)
+
+    def _run(self):
+        while not self._stopping:
+            self._wakeup.wait(getattr(settings, "MOVE_LOG_FLUSH_INTERVAL", 0.5))
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Could not write the move log, retrying later")
+            finally:
+                close_old_connections()
+
+    def stop(self):
+        """
+        Stops the flusher and writes whatever is left
+        """
+        with self._lock:
+            thread, self._thread = self._thread, None
+            self._stopping = True
+        if thread is not None:
+            self._wakeup.set()
+            thread.join()
+            self._wakeup.clear()
+            atexit.unregister(self.stop)
+        self.flush()
+
+
+move_log = MoveLog()
@@ -1,6 +1,7 @@
 import copy
 import re
 from .board_utils import next_turn
+from .bitboard import as_bitboard
 
 
 def translate_move(board, player, move):
@@ -13,18 +14,9 @@ def translate_move(board, player, move):
      move: tuple containing the next move. It contains the row and the side to which stack (L or R)
     """
     # If the number of plays on both sides is the same,
-    # it is player_1 turn, otherwise it is player_2's turn
-    board_size = int(len(board) ** 0.5)
-    if next_turn(board) == player:
-        offset = move[0] * board_size
-        direction = (
-            range(offset, offset + board_size)
-            if move[1] == "L"
-            else range(offset + board_size - 1, offset - 1, -1)
-        )
-        for i in direction:
-            if board[i] == None:
-                return i
+    # it is player_1 turn, otherwise it is player_2's turn.
+    # The landing cell comes from the row occupancy mask of the bitboard
+    return as_bitboard(board).translate(player, move)
 
 
 def apply_move(board, player, move):
@@ -33,17 +25,52 @@ def apply_move(board, player, move):
     It simply applies the moves to the given board for the given player, if the movement is possible.
     If the movement is not possible, the TypeError that is raised is intentionally left there.
     """
-    board = copy.copy(board)
+    board = copy.copy(as_bitboard(board))
     trans_move = translate_move(board, player, move)
     board[trans_move] = player
     return board
 
 
-def parse_move_from_string(move):
+MOVE_EXP = re.compile(r"\[([0-9]{1,2}), '([RL])'\]")
+SIDES = ("L", "R")
+# Every code that fits in a byte, decoded
+DECODED_MOVES = [[code >> 1, SIDES[code & 1]] for code in range(256)]
+
+
+def parse_move_from_string(move, board_size=7):
     """
     Parses a string into a tuple of the form (int, str)
+    Returns None if it does not match or the row is outside the board
+    Only used for moves in the old string format, see encode_move
     """
-    exp = re.compile("\[([0-6]),\ '([R, L])'\]")
-    m = exp.match(move)
-    if m:
+    m = MOVE_EXP.match(move)
+    if m and int(m.group(1)) < board_size:
         return [int(m.group(1)), m.group(2)]
+
+
+def encode_move(move):
+    """
+    Stored form of a move: row * 2, plus 1 for the right side
+    The size of the board is kept by the game, and every row of the biggest board
+    fits in a byte
+    """
+    row, side = move
+    return int(row) * 2 + SIDES.index(side)
+
+
+def decode_move(code):
+    return [code >> 1, SIDES[code & 1]]
+
+
+def encode_moves(moves):
+    """
+    Packs the moves of a game, oldest first, one byte per move
+    """
+    return bytes(encode_move(move) for move in moves)
+
+
+def decode_moves(data):
+    """
+    Unpacks encode_moves, or any iterable of codes, with a table lookup per move
+    """
+    return [list(DECODED_MOVES[code]) for code in data]
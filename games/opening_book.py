@@ -0,0 +1,90 @@
+"""
+Opening book: best move and score of the early positions, computed ahead of
+time by the build_opening_book command.
+
+File layout: an 8 byte header (magic, version, board size, win length) followed
+by fixed size records (zobrist hash, move, score) sorted by hash. The file is
+memory-mapped and searched with a binary search, so it takes no heap and
+loading it is instant.
+"""
+
+import mmap
+import os
+import struct
+from functools import lru_cache
+from django.conf import settings
+from .bot import zobrist_hash
+from .move_utils import decode_move, encode_move
+
+MAGIC = b"C4BK"
+BOOK_VERSION = 1
+HEADER = struct.Struct("<4sBBBx")
+# hash, move (see move_utils.encode_move), score
+RECORD = struct.Struct("<QBxxxi")
+
+
+def write_book(path, board_size, win_length, entries):
+    """
+    Writes the book. entries: iterable of (hash, move, score)
+    """
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, BOOK_VERSION, board_size, win_length))
+        for key, move, score in sorted(entries):
+            f.write(RECORD.pack(key, encode_move(move), score))
+
+
+class OpeningBook:
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.board_size, self.win_length = HEADER.unpack_from(self.data)
+        if magic != MAGIC or version != BOOK_VERSION:
+            raise ValueError("Unknown opening book format")
+        self.count = (len(self.data) - HEADER.size) // RECORD.size
+
+    def __len__(self):
+        return self.count
+
+    def find(self, key):
+        """
+        Binary search over the records. Returns (move, score) or None
+        """
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            record_key, move, score = RECORD.unpack_from(
+                self.data, HEADER.size + middle * RECORD.size
+            )
+            if record_key < key:
+                low = middle + 1
+            elif record_key > key:
+                high = middle
+            else:
+                return decode_move(move), score
+        return None
+
+    def lookup(self, board, win_length):
+        """
+        Returns (move, score) for the board, or None if the position is not in
+        the book or the book is for another variant
+        """
+        if (board.size, win_length) != (self.board_size, self.win_length):
+            return None
+        return self.find(zobrist_hash(board))
+
+
+@lru_cache(maxsize=None)
+def _load_book(path):
+    if not path or not os.path.exists(path):
+        return None
+    return OpeningBook(path)
+
+
+def book_lookup(board, win_length):
+    """
+    Looks the board up in the book configured in settings.OPENING_BOOK_PATH
+    """
+    book = _load_book(getattr(settings, "OPENING_BOOK_PATH", None))
+    if book is None:
+        return None
+    return book.lookup(board, win_length)
@@ -0,0 +1,184 @@
+"""
+Vectorized self-play for balance tuning.
+A batch of boards lives in a single NumPy array (games, rows, columns), and
+legal moves, landing cells and wins are computed for the whole batch at once.
+Moves are numbered row * 2 + side (0 for L, 1 for R).
+"""
+
+import numpy as np
+from .bitboard import Bitboard, WIN_LENGTH
+from .board_utils import find_winner
+from .models import BOARD_SIZE
+
+EMPTY, PLAYER_1, PLAYER_2 = 0, 1, 2
+POLICIES = ("random", "greedy")
+
+
+def has_line(pieces, win_length):
+    """
+    pieces: boolean array (games, size, size) with the pieces of one player
+    Returns a boolean array telling which games have win_length in a row
+    """
+    size = pieces.shape[1]
+    span = size - win_length + 1
+    found = np.zeros(pieces.shape[0], dtype=bool)
+    if span <= 0:
+        return found
+    horizontal = pieces[:, :, :span].copy()
+    vertical = pieces[:, :span, :].copy()
+    diagonal = pieces[:, :span, :span].copy()
+    anti_diagonal = pieces[:, :span, win_length - 1 :].copy()
+    for i in range(1, win_length):
+        horizontal &= pieces[:, :, i : span + i]
+        vertical &= pieces[:, i : span + i, :]
+        diagonal &= pieces[:, i : span + i, i : span + i]
+        anti_diagonal &= pieces[:, i : span + i, win_length - 1 - i : size - i]
+    for lines in (horizontal, vertical, diagonal, anti_diagonal):
+        found |= lines.any(axis=(1, 2))
+    return found
+
+
+class SimulationResult:
+    def __init__(self, size, moves, winners, lengths):
+        self.size = size
+        # Move played at every ply, -1 once the game is over
+        self.moves = moves
+        # 1 for player_1, 2 for player_2, 0 for draws
+        self.winners = winners
+        self.lengths = lengths
+
+    def report(self):
+        """
+        Win rates by first move and a histogram of game lengths
+        """
+        by_first_move = {}
+        first_moves = self.moves[:, 0]
+        for move in range(self.size * 2):
+            games = first_moves == move
+            count = int(games.sum())
+            if not count:
+                continue
+            winners = self.winners[games]
+            by_first_move["{},{}".format(move // 2, "LR"[move % 2])] = {
+                "games": count,
+                "player_1": float((winners == PLAYER_1).mean()),
+                "player_2": float((winners == PLAYER_2).mean()),
+                "draws": float((winners == EMPTY).mean()),
+            }
+        return {
+            "games": int(len(self.winners)),
+            "by_first_move": by_first_move,
+            "length_histogram": np.bincount(
+                self.lengths, minlength=self.size * self.size + 1
+            ).tolist(),
+        }
+
+
+class BatchSimulator:
+    """
+    Plays a batch of games at once.
+    Policies:
+     - random: uniform among the legal moves
+     - greedy: completes a line if it can, blocks the opponent's line if it
+       must, otherwise plays at random
+    """
+
+    def __init__(
+        self, size=BOARD_SIZE, win_length=WIN_LENGTH, policy="random", seed=None
+    ):
+        if policy not in POLICIES:
+            raise ValueError("Unknown policy {}".format(policy))
+        self.size = size
+        self.win_length = win_length
+        self.policy = policy
+        self.rng = np.random.default_rng(seed)
+
+    def landing_columns(self, boards):
+        """
+        Returns the landing column of every row for both sides, and which rows have room
+        """
+        empty = boards == EMPTY
+        room = empty.any(axis=2)
+        left = empty.argmax(axis=2)
+        right = self.size - 1 - empty[:, :, ::-1].argmax(axis=2)
+        return left, right, room
+
+    def landing(self, left, right, games, moves):
+        rows = moves // 2
+        columns = np.where(moves % 2 == 0, left[games, rows], right[games, rows])
+        return rows, columns
+
+    def completes_line(self, boards, value, left, right, games, moves, legal):
+        """
+        Tells, for every game, whether playing the move would give value a line
+        """
+        rows, columns = self.landing(left, right, games, moves)
+        pieces = boards == value
+        pieces[games, rows, columns] = True
+        return has_line(pieces, self.win_length) & legal[games, moves]
+
+    def choose(self, boards, value, left, right, room):
+        games = np.arange(len(boards))
+        legal = np.repeat(room, 2, axis=1)
+        # Random legal move: the highest random key among the legal moves
+        keys = self.rng.random(legal.shape) * legal
+        if self.policy == "greedy":
+            other = PLAYER_2 if value == PLAYER_1 else PLAYER_1
+            for move in range(self.size * 2):
+                column = np.full(len(boards), move)
+                block = self.completes_line(
+                    boards, other, left, right, games, column, legal
+                )
+                win = self.completes_line(
+                    boards, value, left, right, games, column, legal
+                )
+                keys[:, move] += block * 2 + win * 4
+        return keys.argmax(axis=1)
+
+    def run(self, games):
+        size = self.size
+        boards = np.zeros((games, size, size), dtype=np.int8)
+        moves = np.full((games, size * size), -1, dtype=np.int16)
+        winners = np.zeros(games, dtype=np.int8)
+        lengths = np.zeros(games, dtype=np.int16)
+        active = np.ones(games, dtype=bool)
+        for ply in range(size * size):
+            if not active.any():
+                break
+            value = PLAYER_1 if ply % 2 == 0 else PLAYER_2
+            playing = np.flatnonzero(active)
+            current = boards[playing]
+            left, right, room = self.landing_columns(current)
+            choice = self.choose(current, value, left, right, room)
+            rows, columns = self.landing(left, right, np.arange(len(playing)), choice)
+            boards[playing, rows, columns] = value
+            moves[playing, ply] = choice
+            lengths[playing] = ply + 1
+            won = has_line(boards[playing] == value, self.win_length)
+            winners[playing[won]] = value
+            active[playing[won]] = False
+        return SimulationResult(size, moves, winners, lengths)
+
+    def cross_check(self, result, samples=100):
+        """
+        Replays sample games with the bitboard engine and find_winner
+        Returns the indexes of the games where the results disagree
+        """
+        mismatches = []
+        count = len(result.winners)
+        for game in self.rng.choice(count, min(samples, count), replace=False):
+            board = Bitboard(self.size)
+            winner = None
+            for ply in range(result.lengths[game]):
+                move = int(result.moves[game, ply])
+                player = board.next_turn()
+                position = board.translate(player, (move // 2, "LR"[move % 2]))
+                board[position] = player
+                winner = find_winner(board, position, self.win_length)
+                if winner is not None:
+                    break
+            expected = {True: PLAYER_1, False: PLAYER_2, None: EMPTY}[winner]
+            finished = winner is not None or board.is_full()
+            if expected != result.winners[game] or not finished:
+                mismatches.append(int(game))
+        return mismatches
@@ -0,0 +1,55 @@
+"""
+Read-through cache of the game state, so connecting to a game (spectators,
+reconnects) doesn't touch the database.
+
+Every state is stored under its game id and version (the number of moves), and
+a pointer key holds the current version. A state is never changed once stored,
+so a reader following the pointer always gets a consistent state. Moves store
+the next version from the previous one (see Game.change_state_forward) and
+delete the previous one, a reader that followed the pointer just before falls
+back to the database. Any other change just drops the pointer. So do
+moves that aren't written yet (write-behind mode), the move log serves them.
+"""
+
+from django.core.cache import cache
+
+# Cached states are dropped after an hour without moves
+STATE_TIMEOUT = 60 * 60
+
+
+def state_key(game_id, version=None):
+    if version is None:
+        return "game_state:{}".format(game_id)
+    return "game_state:{}:{}".format(game_id, version)
+
+
+def get_state(game_id, version=None):
+    """
+    Returns the cached state of the game (the current one by default) or None
+    A state is a dict with the model fields of the game, its decoded board and
+    the serialized snapshot
+    """
+    if version is None:
+        version = cache.get(state_key(game_id))
+        if version is None:
+            return None
+    return cache.get(state_key(game_id, version))
+
+
+def put_state(game_id, version, state, replace=True):
+    """
+    Stores the state and points the game to it
+    With replace=False, a game that already points to some state is left alone,
+    the state could be older than the one stored by a move in the meantime.
+    """
+    cache.set(state_key(game_id, version), state, STATE_TIMEOUT)
+    if replace:
+        cache.set(state_key(game_id), version, STATE_TIMEOUT)
+        # Every state holds all the moves, a game must not keep one per move
+        cache.delete(state_key(game_id, version - 1))
+    else:
+        cache.add(state_key(game_id), version, STATE_TIMEOUT)
+
+
+def invalidate_state(game_id):
+    cache.delete(state_key(game_id))
@@ -4,13 +4,34 @@ class Game extends React.Component {
     this.state = { message: "Game is loading...", moves: [] };
     this.handleMove = this.handleMove.bind(this);
     this.handleReplay = this.handleReplay.bind(this);
+    this.updateStatus = this.updateStatus.bind(this);
+    this.handleHint = this.handleHint.bind(this);
+  }
+  handleHint() {
+    this.props.gameSocket.send(JSON.stringify({ hint: true }));
   }
   handleReplay(id) {
-    this.props.gameSocket.send(
-      JSON.stringify({
-        replay_until: id,
-      })
-    );
+    const board = this.replayBoard(this.state.timeline, id);
+    if (board) {
+      this.setState({ replayBoard: board });
+    } else {
+      // The timeline is missing or outdated, ask for the whole game at once
+      this.setState({ pendingReplay: id });
+      this.props.gameSocket.send(JSON.stringify({ replay_all: true }));
+    }
+  }
+  replayBoard(timeline, id) {
+    if (!timeline) {
+      return null;
+    }
+    const board = Array(timeline.board_size * timeline.board_size).fill(null);
+    for (const move of timeline.moves) {
+      board[move.position] = move.player;
+      if (move.id === id) {
+        return board;
+      }
+    }
+    return null;
   }
   handleMove(move) {
     this.props.gameSocket.send(
@@ -20,47 +41,96 @@ class Game extends React.Component {
       })
     );
   }
+  updateStatus(data) {
+    // Deltas don't carry the player names, those come from the last snapshot
+    const player_1 = data.player_1 || this.state.player_1;
+    const player_2 = data.player_2 || this.state.player_2;
+    const currentPlayer = data["next_player"] ? player_1 : player_2;
+    switch (data.status) {
+      case "PENDING":
+        this.setState({
+          message: "Awaiting for another player to start the game...",
+        });
+        break;
+      case "FINISHED":
+        const winner_message = data["winner"]
+          ? `The winner is player 1: ${player_1}`
+          : data["winner"] === false
+          ? `The winner is player 2: ${player_2}`
+          : "This game was a draw.";
+        this.setState({
+          message: `This game has finished. ${winner_message}`,
+        });
+        break;
+      default:
+        // Game in progress
+        if (currentPlayer === this.props.username) {
+          this.setState({
+            message: "It is your turn to make a move!",
+            messageColor: "green",
+          });
+        } else {
+          this.setState({
+            message: `Now it is ${currentPlayer}'s turn`,
+            messageColor: "red",
+          });
+        }
+    }
+  }
+  requestSnapshot() {
+    this.props.gameSocket.send(JSON.stringify({ snapshot: true }));
+  }
   componentDidMount() {
     const component = this;
     this.props.gameSocket.onmessage = function (e) {
       const data = JSON.parse(e.data);
-      const currentPlayer = data["next_player"]
-        ? data["player_1"]
-        : data["player_2"];
-      if (data.replay_board) {
+      if ("hint" in data) {
+        component.setState({
+          hint: data.hint
+            ? `Hint: row ${data.hint.move[0]}, side ${data.hint.move[1]}`
+            : "No hint available",
+        });
+      } else if (data.replay_board) {
         component.setState({ replayBoard: data.replay_board });
-      } else {
-        switch (data.status) {
-          case "PENDING":
-            component.setState({
-              message: "Awaiting for another player to start the game...",
-            });
-            break;
-          case "FINISHED":
-            const winner_message = data["winner"]
-              ? `The winner is player 1: ${data["player_1"]}`
-              : data["winner"] === false
-              ? `The winner is player 2: ${data["player_2"]}`
-              : "This game was a draw.";
-            component.setState({
-              message: `This game has finished. ${winner_message}`,
-            });
-            break;
-          default:
-            // Game in progress
-            if (currentPlayer === component.props.username) {
-              component.setState({
-                message: "It is your turn to make a move!",
-                messageColor: "green",
-              });
-            } else {
-              component.setState({
-                message: `Now it is ${currentPlayer}'s turn`,
-                messageColor: "red",
-              });
-            }
+      } else if (data.replay_all) {
+        component.setState({
+          timeline: data.replay_all,
+          replayBoard: component.replayBoard(
+            data.replay_all,
+            component.state.pendingReplay
+          ),
+        });
+      } else if (data.type === "move") {
+        if (data.seq !== component.state.seq + 1) {
+          // An update was missed, get the whole state again
+          component.requestSnapshot();
+          return;
         }
-        component.setState({ board: data.board, moves: data.moves });
+        const board = component.state.board.slice();
+        board[data.position] = data.player;
+        const timeline = component.state.timeline && {
+          board_size: component.state.timeline.board_size,
+          moves: component.state.timeline.moves.concat([
+            { id: data.move.id, position: data.position, player: data.player },
+          ]),
+        };
+        component.setState({
+          seq: data.seq,
+          board: board,
+          moves: [data.move].concat(component.state.moves),
+          timeline: timeline,
+        });
+        component.updateStatus(data);
+      } else if (data.type === "snapshot") {
+        component.setState({
+          seq: data.seq,
+          player_1: data.player_1,
+          player_2: data.player_2,
+          board: data.board,
+          size: data.board_size,
+          moves: data.moves,
+        });
+        component.updateStatus(data);
       }
     };
     this.props.gameSocket.onclose = function (e) {
@@ -81,6 +151,7 @@ class Game extends React.Component {
       Board,
       {
         board: this.state.board,
+        size: this.state.size,
         key: "board",
         onMove: this.handleMove,
         onReplay: this.handleReplay,
@@ -124,6 +195,18 @@ class Game extends React.Component {
         ),
       ]
     );
-    return [message, board, currentPlayer, replaySection];
+    const hint = React.createElement(
+      "div",
+      { className: "text-center", key: "hint" },
+      [
+        React.createElement(
+          "button",
+          { className: "shadow p-2", onClick: this.handleHint, key: "hint-button" },
+          "Hint"
+        ),
+        React.createElement("span", { className: "p-2", key: "hint-text" }, this.state.hint),
+      ]
+    );
+    return [message, board, currentPlayer, hint, replaySection];
   }
 }
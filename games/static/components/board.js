@@ -18,6 +18,7 @@ function parseElement(element) {
 
 function BoardState(props) {
   if (props.board) {
+    const size = Math.round(Math.sqrt(props.board.length));
     let items = [];
     for (i = 0; i < props.board.length; i++) {
       items.push(
@@ -35,7 +36,8 @@ function BoardState(props) {
       "div",
       {
         className:
-          "grid grid-flow-row grid-cols-7 grid-rows-7 gap-2 bg-green-500 p-5 rounded-lg leading-null",
+          "grid grid-flow-row gap-2 bg-green-500 p-5 rounded-lg leading-null",
+        style: { gridTemplateColumns: `repeat(${size}, minmax(0, 1fr))` },
       },
       items
     );
@@ -67,12 +69,22 @@ class Board extends React.Component {
     );
     const leftPicker = React.createElement(
       Picker,
-      { position: "L", key: "picker-l", onMove: this.handleMove },
+      {
+        position: "L",
+        key: "picker-l",
+        size: this.props.size,
+        onMove: this.handleMove,
+      },
       null
     );
     const rightPicker = React.createElement(
       Picker,
-      { position: "R", key: "picker-r", onMove: this.handleMove },
+      {
+        position: "R",
+        key: "picker-r",
+        size: this.props.size,
+        onMove: this.handleMove,
+      },
       null
     );
     return React.createElement(
@@ -6,19 +6,13 @@ class MoveItem extends React.Component {
   handleClick() {
     this.props.onReplay(this.props.value.id);
   }
-  parseValue(value) {
-    const match = /\[([0-6]),\ \'([R, L])\'\]/.exec(value);
-    if (match) {
-      return `${match[1]},${match[2]}`;
-    }
-  }
   render() {
-    const parsed = this.parseValue(this.props.value.move);
+    const [row, side] = this.props.value.move;
     const date = new Date(this.props.value.timestamp);
     return React.createElement(
       "button",
       { className: "shadow p-2", onClick: this.handleClick },
-      `${this.props.value.player_name}: ${parsed} - ${date.toLocaleString()}`
+      `${this.props.value.player_name}: ${row},${side} - ${date.toLocaleString()}`
     );
   }
 }
@@ -27,7 +27,7 @@ class Picker extends React.Component {
     this.props.onMove(move);
   }
   render() {
-    let children = [...Array(7).keys()].map((child) => {
+    let children = [...Array(this.props.size || 7).keys()].map((child) => {
       return React.createElement(
         PickerButton,
         {
@@ -43,8 +43,7 @@ class Picker extends React.Component {
     return React.createElement(
       "div",
       {
-        className:
-          "grid grid-flow-row grid-cols-1 grid-rows-7 gap-2 p-2 bg-green-400",
+        className: "grid grid-flow-row grid-cols-1 gap-2 p-2 bg-green-400",
       },
       children
     );
@@ -1,17 +1,60 @@
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.layers import InMemoryChannelLayer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+import asyncio
+import io
+import json
 import random
-import pickle
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import base64
+import gzip
+from unittest import mock
+import numpy as np
 from games.board_utils import (
-    pickle_board,
+    encode_board,
+    decode_board,
     generate_board,
-    parse_board_from_string,
     board_full,
     scan,
     find_winner,
     get_next_position,
 )
-from games.move_utils import translate_move, apply_move, parse_move_from_string
-from games.models import Game, Move, BOARD_SIZE
+from games.move_utils import (
+    translate_move,
+    apply_move,
+    parse_move_from_string,
+    encode_move,
+    decode_move,
+    encode_moves,
+    decode_moves,
+)
+from games.bitboard import Bitboard, win_lines
+from games.analysis import AnalysisService
+from games.bot import best_move, TranspositionTable, zobrist_hash
+from games.opening_book import OpeningBook, write_book
+from games.management.commands.build_opening_book import positions_up_to
+from games.state_cache import get_state, state_key
+from games.move_log import move_log
+from games.actors import HashRing, actor_channel, registry, submit
+from games.matchmaking import CacheQueue, InMemoryQueue, coordination_cache
+from games.benchmarks import compare, run_benchmarks
+from games.loadtest import percentile, run_load
+from games import metrics
+from games.simulator import BatchSimulator, has_line
+from games.routing import websocket_urlpatterns
+from games.models import Game, GameConflict, Move, BOARD_SIZE, BOARD_CACHE_STATS
 
 
 class GameLogicTest(TestCase):
@@ -20,30 +63,48 @@ class GameLogicTest(TestCase):
 
     def test_generate_board(self):
         """
-        generate_board/1 returns a binary string representation with a board filled with 7*7 None values
+        generate_board/1 returns a string representation with a board filled with 7*7 None values
         """
         board = generate_board(BOARD_SIZE)
-        self.assertEqual(parse_board_from_string(board).count(None), 49)
+        self.assertEqual(decode_board(board).count(None), 49)
 
-    def test_pickle_board_with_existing_board(self):
+    def test_encode_board_with_existing_board(self):
         """
-        pickle_board/1 parses passed_board
+        encode_board/1 encodes passed_board
         """
         board = self.game.python_board
         board[0] = True
         board[10] = False
-        board = pickle_board(board)
-        self.assertEqual(parse_board_from_string(board).count(True), 1)
-        self.assertEqual(parse_board_from_string(board).count(False), 1)
-        self.assertEqual(parse_board_from_string(board).count(None), 47)
+        board = encode_board(board)
+        self.assertEqual(decode_board(board).count(True), 1)
+        self.assertEqual(decode_board(board).count(False), 1)
+        self.assertEqual(decode_board(board).count(None), 47)
+
+    def test_encode_board_accepts_lists(self):
+        """
+        encode_board/1 stores the legacy list representation in the same compact format
+        """
+        board = ([True, False, None] * 17)[:49]
+        encoded = encode_board(board)
+        self.assertEqual(len(encoded), 24)
+        self.assertEqual(decode_board(encoded), board)
 
-    def test_parse_board_from_string(self):
+    def test_decode_board(self):
         """
-        parse_board_from_string/1 returns a python list of len 7*7 given a game board
+        decode_board/1 returns a board of len 7*7 given a game board
         """
-        parsed = parse_board_from_string(self.game.board)
+        parsed = decode_board(self.game.board)
         self.assertEqual(len(parsed), 49)
 
+    def test_decode_board_rejects_unknown_version(self):
+        """
+        decode_board/1 raises ValueError when the version byte is not supported
+        """
+        data = bytearray(base64.b64decode(self.game.board))
+        data[0] = 99
+        with self.assertRaises(ValueError):
+            decode_board(base64.b64encode(bytes(data)).decode())
+
     def test_board_full(self):
         """
         board_full/1 checks if the board is completely filled
@@ -169,6 +230,88 @@ class GameLogicTest(TestCase):
         self.assertEqual(find_winner(board, 43), None)
 
 
+class BitboardTest(TestCase):
+    def test_from_list_round_trip(self):
+        """
+        Bitboard.from_list/1 keeps every position of the list representation
+        """
+        board = ([True, False, None] * 17)[:49]
+        self.assertEqual(Bitboard.from_list(board).to_list(), board)
+        self.assertEqual(Bitboard.from_list(board), board)
+
+    def test_count_and_next_turn(self):
+        """
+        Counts and turn come from the popcount of each player mask
+        """
+        board = Bitboard(BOARD_SIZE)
+        self.assertTrue(board.next_turn())
+        board[3] = True
+        self.assertFalse(board.next_turn())
+        self.assertEqual(board.count(True), 1)
+        self.assertEqual(board.count(None), 48)
+        self.assertTrue(None in board)
+
+    def test_translate_matches_row_scan(self):
+        """
+        translate/2 lands on the first empty cell from the picked side
+        """
+        board = Bitboard(BOARD_SIZE)
+        board[7] = True
+        board[8] = False
+        board[13] = True
+        board[14] = False
+        self.assertEqual(board.translate(True, (1, "L")), 9)
+        self.assertEqual(board.translate(True, (1, "R")), 12)
+        self.assertIsNone(board.translate(False, (1, "R")))
+
+    def test_legal_moves_skips_full_rows(self):
+        """
+        legal_moves/0 does not list rows without room
+        """
+        board = Bitboard(BOARD_SIZE)
+        for i in range(BOARD_SIZE):
+            board[i] = i % 2 == 0
+        self.assertNotIn((0, "L"), board.legal_moves())
+        self.assertEqual(len(board.legal_moves()), 2 * (BOARD_SIZE - 1))
+
+    def test_has_won_does_not_wrap_rows(self):
+        """
+        Pieces at the end of a row and the start of the next one are not a line
+        """
+        board = Bitboard(BOARD_SIZE)
+        for i in (5, 6, 7, 8):
+            board[i] = True
+        self.assertFalse(board.has_won(True))
+        board[3] = True
+        board[4] = True
+        self.assertTrue(board.has_won(True, 5))
+        self.assertFalse(board.has_won(True, 8))
+
+    def test_winner_matches_scan_on_random_boards(self):
+        """
+        find_winner/2 gives the same answer as the recursive scan
+        """
+        random.seed(1)
+        directions = [
+            ((-1, 0), (1, 0)),
+            ((0, -1), (0, 1)),
+            ((-1, -1), (1, 1)),
+            ((1, -1), (-1, 1)),
+        ]
+        for _ in range(200):
+            board = [random.choice([True, False, None]) for _ in range(49)]
+            last_play = random.randrange(49)
+            player = board[last_play]
+            expected = None
+            if player is not None and any(
+                scan(board, a, last_play, player) + scan(board, b, last_play, player)
+                >= 3
+                for a, b in directions
+            ):
+                expected = player
+            self.assertEqual(find_winner(board, last_play), expected)
+
+
 class GameModelTest(TestCase):
     def setUp(self):
         self.game = Game.objects.create()
@@ -184,13 +327,37 @@ class GameModelTest(TestCase):
         game = Game.objects.get(id=self.game.pk)
         self.assertFalse(game.python_board[26])
 
+    def test_conflicting_move_is_not_written(self):
+        """
+        A move played on an outdated instance of the game raises GameConflict
+        """
+        game = Game.objects.create(player_1="test1", player_2="test2")
+        stale = Game.objects.get(id=game.id)
+        game.change_state_forward(True, [3, "R"])
+        self.assertEqual(game.version, 1)
+        with self.assertRaises(GameConflict):
+            stale.change_state_forward(True, [0, "L"])
+        fresh = Game.objects.get(id=game.id)
+        self.assertEqual((fresh.version, fresh.seq), (1, 1))
+        self.assertEqual(Move.objects.filter(game=game).count(), 1)
+
+    def test_unknown_side_is_rejected(self):
+        """
+        change_state_forward/2 rejects a side other than L and R, leaving the game as it was
+        """
+        board = self.game.board
+        self.game.change_state_forward(True, [3, "X"])
+        self.assertIsNone(self.game.last_move)
+        self.assertEqual(self.game.board, board)
+        self.assertFalse(Move.objects.filter(game=self.game).exists())
+
     def test_change_state_forward_marks_finished_and_winner(self):
         """
         change_state_forward/3 marks the game as finished if there is a winner
         """
         board = ([True, False] * 25)[:49]
         board[0] = None
-        self.game.board = pickle_board(board)
+        self.game.board = encode_board(board)
         self.game.save()
         self.game.change_state_forward(True, (0, "R"))
         game = Game.objects.get(id=self.game.pk)
@@ -218,13 +385,106 @@ class GameModelTest(TestCase):
                     False, False, True, False, True, True, True,
                     True, True, False, False, True, False, None]"""
         board = eval(board)
-        self.game.board = pickle_board(board)
+        self.game.board = encode_board(board)
         self.game.save()
         self.game.change_state_forward(False, (6, "R"))
         game = Game.objects.get(id=self.game.id)
         self.assertEqual(game.status, "FINISHED")
 
 
+class BoardVariantTest(TestCase):
+    def test_win_lines_are_built_once(self):
+        """
+        win_lines/2 returns the same cached table for the same (size, win_length)
+        """
+        self.assertIs(win_lines(9, 5), win_lines(9, 5))
+        # Horizontal, vertical and both diagonals through the center of a 7x7 board
+        self.assertEqual(len(win_lines(7, 4)[24]), 4 * 4)
+
+    def test_find_winner_connect_5(self):
+        """
+        find_winner/3 only reports a winner when the line reaches win_length
+        """
+        board = Bitboard(9)
+        for position in (10, 20, 30, 40):
+            board[position] = True
+        self.assertIsNone(find_winner(board, 40, 5))
+        self.assertTrue(find_winner(board, 40, 4))
+        board[50] = True
+        self.assertTrue(find_winner(board, 40, 5))
+
+    def test_create_game_with_variant(self):
+        """
+        A game stores its size and win length and plays on a board of that size
+        """
+        game = Game.objects.create(
+            player_1="a", player_2="b", board_size=15, win_length=5
+        )
+        self.assertEqual(len(game.python_board), 15 * 15)
+        game.change_state_forward(True, [14, "R"])
+        self.assertTrue(Game.objects.get(id=game.id).python_board[15 * 15 - 1])
+        self.assertEqual(Move.objects.get(game=game).reconstruct_up_to()[224], True)
+
+    def test_create_game_rejects_invalid_variant(self):
+        """
+        create/1 raises ValueError when the line can't fit on the board
+        """
+        with self.assertRaises(ValueError):
+            Game.objects.create(board_size=5, win_length=6)
+
+    def test_make_seat_matches_variant(self):
+        """
+        make_seat/3 only fills seats of games with the same variant
+        """
+        game = Game.objects.create(player_1="test1", board_size=9, win_length=5)
+        self.assertNotEqual(Game.objects.make_seat("test2").id, game.id)
+        self.assertEqual(Game.objects.make_seat("test3", 9, 5).id, game.id)
+
+
+class GameBoardCacheTest(TestCase):
+    def setUp(self):
+        self.game = Game.objects.create(player_1="test1", player_2="test2")
+        BOARD_CACHE_STATS.clear()
+
+    def test_change_state_forward_decodes_once(self):
+        """
+        A move followed by to_json decodes the stored board a single time
+        """
+        game = Game.objects.get(id=self.game.id)
+        game.change_state_forward(True, (3, "R"))
+        game.to_json()
+        self.assertEqual(BOARD_CACHE_STATS["misses"], 1)
+        self.assertGreater(BOARD_CACHE_STATS["hits"], 0)
+
+    def test_cached_board_is_not_shared(self):
+        """
+        Modifying the returned board does not touch the cached one
+        """
+        board = self.game.python_board
+        board[0] = True
+        self.assertIsNone(self.game.python_board[0])
+
+    def test_assigning_board_invalidates_cache(self):
+        """
+        Assigning the board field drops the decoded board
+        """
+        self.game.python_board
+        board = self.game.python_board
+        board[0] = True
+        self.game.board = encode_board(board)
+        self.assertTrue(self.game.python_board[0])
+        self.assertEqual(BOARD_CACHE_STATS["misses"], 2)
+
+    def test_refresh_from_db_invalidates_cache(self):
+        """
+        refresh_from_db/0 picks up boards written by other instances
+        """
+        self.game.python_board
+        Game.objects.get(id=self.game.id).change_state_forward(True, (0, "L"))
+        self.game.refresh_from_db()
+        self.assertTrue(self.game.python_board[0])
+
+
 class MoveModelTest(TestCase):
     def setUp(self):
         self.game = Game.objects.create(player_1="test")
@@ -251,10 +511,40 @@ class MoveModelTest(TestCase):
         """
         self.assertEqual(parse_move_from_string("[6, 'L']"), [6, "L"])
 
+    def test_move_codes(self):
+        """
+        Moves are stored as small integers, and games pack into one byte per move
+        """
+        moves = [[row, side] for row in range(15) for side in "LR"]
+        codes = [encode_move(move) for move in moves]
+        self.assertEqual(codes, list(range(30)))
+        self.assertEqual([decode_move(code) for code in codes], moves)
+        self.assertEqual(decode_moves(encode_moves(moves)), moves)
+        self.assertEqual(self.moves[0].move, [2, "R"])
+        self.assertEqual(self.moves[0].code, 5)
+
+    def test_big_board_replay(self):
+        """
+        Rows past the classic board are stored and replayed
+        """
+        game = Game.objects.create(
+            player_1="test1", player_2="test2", board_size=15, win_length=5
+        )
+        game.change_state_forward(True, [12, "R"])
+        game.change_state_forward(False, [12, "R"])
+        move = Move.objects.get(game=game, seq=2)
+        self.assertEqual(move.to_dict()["move"], [12, "R"])
+        self.assertEqual(game.packed_moves()[1], bytes([25, 25]))
+        timeline = game.replay_timeline()
+        self.assertEqual([x["position"] for x in timeline["moves"]], [194, 193])
+        move.board = ""
+        board = move.reconstruct_up_to()
+        self.assertEqual((board[194], board[193]), (True, False))
+
     def test_moves_are_retrieved_in_desc_order(self):
         """
         When querying moves, they must be ordered in descending order by default
-        by the timestamp field (newest first)
+        by the seq field (newest first)
         """
         filtered_moves = Move.objects.filter(game=self.game)
         for i in range(len(filtered_moves)):
@@ -265,14 +555,328 @@ class MoveModelTest(TestCase):
         Reconstructing the board up to a certain play works correctly
         """
         reconstructed = self.moves[0].reconstruct_up_to()
-        board = parse_board_from_string(generate_board(BOARD_SIZE))
+        board = decode_board(generate_board(BOARD_SIZE))
         board[6] = True
         board[13] = False
         board[20] = True
         self.assertEqual(board, reconstructed)
 
 
+class MoveSnapshotTest(TestCase):
+    def test_change_state_forward_stores_board(self):
+        """
+        Every move played through change_state_forward keeps the resulting board
+        """
+        game = Game.objects.create(player_1="test1", player_2="test2")
+        game.change_state_forward(True, [3, "R"])
+        game.change_state_forward(False, [3, "R"])
+        move = Move.objects.filter(game=game).first()
+        self.assertEqual(move.board, game.board)
+
+    def test_reconstruct_up_to_uses_stored_board(self):
+        """
+        reconstruct_up_to/0 does not query previous moves when the board is stored
+        """
+        game = Game.objects.create(player_1="test1", player_2="test2")
+        for i in range(4):
+            game.change_state_forward(i % 2 == 0, [i, "L"])
+        move = Move.objects.filter(game=game).last()
+        with self.assertNumQueries(0):
+            board = move.reconstruct_up_to()
+        self.assertTrue(board[0])
+        self.assertEqual(board.count(None), 48)
+
+
+class ReplayTimelineTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.game = Game.objects.create(player_1="test1", player_2="test2")
+        for i in range(3):
+            self.game.change_state_forward(i % 2 == 0, [i, "R"])
+
+    def test_replay_timeline(self):
+        """
+        replay_timeline/0 lists every move, oldest first, with its landing position
+        """
+        timeline = self.game.replay_timeline()
+        self.assertEqual(timeline["board_size"], 7)
+        self.assertEqual([x["position"] for x in timeline["moves"]], [6, 13, 20])
+        self.assertEqual([x["player"] for x in timeline["moves"]], [True, False, True])
+
+    def test_replay_timeline_cached_when_finished(self):
+        """
+        The timeline of a finished game is only computed once
+        """
+        self.game.status = "FINISHED"
+        self.game.save()
+        self.game.replay_timeline()
+        with self.assertNumQueries(0):
+            timeline = self.game.replay_timeline()
+        self.assertEqual(len(timeline["moves"]), 3)
+
+    def test_replay_view(self):
+        """
+        The replay endpoint returns the timeline as json
+        """
+        response = self.client.get(f"/play/{self.game.id}/replay/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["moves"]), 3)
+
+
+class QueryCountTest(TestCase):
+    def setUp(self):
+        self.game = Game.objects.create(player_1="test1", player_2="test2")
+
+    def test_moves_are_numbered(self):
+        """
+        Moves get consecutive seq values, whether they are created directly or played
+        """
+        self.game.change_state_forward(True, [0, "L"])
+        move = Move.objects.create(game=self.game, move="[1, 'L']", player_name="test2")
+        self.assertEqual(move.seq, 2)
+        self.assertEqual([x.seq for x in Move.objects.filter(game=self.game)], [2, 1])
+
+    def test_move_path_queries(self):
+        """
+        Playing a move inserts the move and updates the game, nothing else
+        """
+        with self.assertNumQueries(2):
+            self.game.change_state_forward(True, [3, "R"])
+            self.game.to_delta_json()
+
+    def test_connect_path_queries(self):
+        """
+        Loading a game and its snapshot takes one query for each
+        """
+        self.game.change_state_forward(True, [3, "R"])
+        with self.assertNumQueries(2):
+            Game.objects.get(id=self.game.id).to_json()
+
+
+class GameStateCacheTest(TransactionTestCase):
+    """
+    The cache is updated once moves are committed, so this needs real transactions
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.game = Game.objects.create(
+            player_1="test1", player_2="test2", status="STARTED"
+        )
+
+    def play(self, player, move):
+        with transaction.atomic():
+            game = Game.objects.select_for_update().get(id=self.game.id)
+            game.change_state_forward(player, move)
+
+    def test_hot_connects_make_no_queries(self):
+        with self.assertNumQueries(2):
+            Game.objects.get_with_snapshot(self.game.id)
+        with self.assertNumQueries(0):
+            game, payload = Game.objects.get_with_snapshot(str(self.game.id))
+        self.assertEqual(game.player_1, "test1")
+        self.assertEqual(json.loads(payload)["seq"], 0)
+
+    def test_moves_update_the_cached_state(self):
+        """
+        The cached state after some moves matches the one loaded from the database
+        """
+        Game.objects.get_with_snapshot(self.game.id)
+        for player, move in ((True, [3, "R"]), (False, [3, "R"]), (True, [0, "L"])):
+            self.play(player, move)
+        with self.assertNumQueries(0):
+            game, payload = Game.objects.get_with_snapshot(self.game.id)
+        fresh = Game.objects.get(id=self.game.id)
+        self.assertEqual(json.loads(payload), json.loads(fresh.to_json()))
+        self.assertEqual(game.python_board, fresh.python_board)
+        self.assertEqual(game.board, fresh.board)
+        self.assertEqual(game.seq, 3)
+        # Only the current state is kept
+        for seq in range(3):
+            self.assertIsNone(get_state(self.game.id, seq))
+
+    def test_state_is_dropped_without_previous_state(self):
+        """
+        A move whose previous state isn't cached drops the cached state
+        """
+        Game.objects.get_with_snapshot(self.game.id)
+        cache.delete(state_key(self.game.id, 0))
+        self.play(True, [3, "R"])
+        self.assertIsNone(get_state(self.game.id))
+        _game, payload = Game.objects.get_with_snapshot(self.game.id)
+        self.assertEqual(json.loads(payload)["seq"], 1)
+
+    def test_take_seat_drops_the_cached_state(self):
+        game = Game.objects.create(player_1="test3")
+        Game.objects.get_with_snapshot(game.id)
+        self.assertTrue(Game.objects.take_seat(game.id, "test4"))
+        game, payload = Game.objects.get_with_snapshot(game.id)
+        self.assertEqual(game.player_2, "test4")
+        self.assertEqual(json.loads(payload)["status"], "STARTED")
+
+
+@override_settings(MOVE_WRITE_BEHIND=True, MOVE_LOG_FLUSH_INTERVAL=60)
+class MoveLogTest(TransactionTestCase):
+    """
+    Moves go through the game actors, the way the consumer sends them
+    """
+
+    def setUp(self):
+        cache.clear()
+        move_log.clear()
+        self.game = Game.objects.create(
+            player_1="test1", player_2="test2", status="STARTED"
+        )
+
+    def tearDown(self):
+        move_log.stop()
+        move_log.clear()
+        registry.clear()
+
+    def play(self, *moves):
+        """
+        Returns what the socket got for every move
+        """
+
+        async def run():
+            layer = InMemoryChannelLayer()
+            await layer.group_add(str(self.game.id), "socket")
+            for player, move in moves:
+                command = {"kind": "move", "player": player, "move": move}
+                command["reply_channel"] = "socket"
+                await submit(layer, self.game.id, command)
+            messages = []
+            for _ in moves:
+                message = await asyncio.wait_for(layer.receive("socket"), 5)
+                messages.append(json.loads(message["message"]))
+            return messages
+
+        # Actors are bound to the loop of the async_to_sync that started them
+        registry.clear()
+        return async_to_sync(run)()
+
+    def test_moves_are_written_on_flush(self):
+        messages = self.play((True, [3, "R"]), (False, [3, "R"]))
+        self.assertEqual([message["seq"] for message in messages], [1, 2])
+        self.assertEqual(Move.objects.filter(game=self.game).count(), 0)
+        game = move_log.get_game(self.game.id)
+        self.assertEqual(game.seq, 2)
+        # A copy: playing on it doesn't change what the log serves
+        move_log.get_game(self.game.id).change_state_forward(True, [0, "L"], False)
+        self.assertEqual(move_log.get_game(self.game.id).seq, 2)
+
+        self.assertEqual(move_log.flush(), 2)
+        moves = Move.objects.filter(game=self.game).order_by("seq")
+        self.assertEqual([move.seq for move in moves], [1, 2])
+        fresh = Game.objects.get(id=self.game.id)
+        self.assertEqual(fresh.board, game.board)
+        self.assertEqual((fresh.seq, fresh.version), (2, 2))
+        # Nothing pending anymore, the next move loads the game again
+        self.assertIsNone(move_log.get_game(self.game.id))
+
+    def test_rejected_moves_are_not_logged(self):
+        messages = self.play((True, [3, "R"]), (True, [3, "R"]))
+        self.assertEqual(messages[1]["type"], "rejected")
+        self.assertEqual(len(move_log.pending_moves(self.game.id)), 1)
+
+    def test_snapshot_includes_pending_moves(self):
+        self.play((True, [3, "R"]))
+        move_log.flush()
+        self.play((False, [0, "L"]))
+        snapshot = json.loads(move_log.to_json(move_log.get_game(self.game.id)))
+        self.assertEqual(snapshot["seq"], 2)
+        self.assertEqual(len(snapshot["moves"]), 2)
+
+    def test_finished_game_is_written(self):
+        board = [None] * BOARD_SIZE * BOARD_SIZE
+        board[:3] = [True, True, True]
+        board[-3:] = [False, False, False]
+        self.game.board = encode_board(board)
+        self.game.save()
+        self.play((True, [0, "L"]))
+        move_log.stop()
+        fresh = Game.objects.get(id=self.game.id)
+        self.assertEqual(fresh.status, "FINISHED")
+        self.assertTrue(fresh.winner)
+        self.assertEqual(move_log.pending_moves(self.game.id), [])
+
+    def test_pending_moves_are_not_cached(self):
+        """
+        The game state cache only gets a move once it is written
+        """
+        Game.objects.get_with_snapshot(self.game.id)
+        self.play((True, [3, "R"]), (False, [3, "R"]))
+        self.assertIsNone(get_state(self.game.id))
+        move_log.flush()
+        _, payload = Game.objects.get_with_snapshot(self.game.id)
+        self.assertEqual(json.loads(payload)["seq"], 2)
+
+    def test_max_pending_wakes_the_flusher(self):
+        """
+        The flusher writes as soon as MOVE_LOG_MAX_PENDING moves wait, well
+        before the flush interval
+        """
+        flushed = threading.Event()
+        flush = move_log.flush
+
+        def flush_and_notify():
+            written = flush()
+            if written:
+                flushed.set()
+            return written
+
+        with override_settings(MOVE_LOG_MAX_PENDING=2):
+            with mock.patch.object(move_log, "flush", flush_and_notify):
+                self.play((True, [3, "R"]), (False, [3, "R"]))
+                self.assertTrue(flushed.wait(5))
+        self.assertEqual(Move.objects.filter(game=self.game).count(), 2)
+
+    def test_conflicts_only_drop_their_game(self):
+        """
+        Moves of a game changed meanwhile are dropped, the other games are written,
+        and the next move of the dropped game reloads it
+        """
+        other = Game.objects.create(player_1="test3", player_2="test4")
+        Game.objects.get_with_snapshot(self.game.id)
+        self.play((True, [3, "R"]))
+        self.game, game = other, self.game
+        self.play((True, [3, "R"]))
+        Game.objects.filter(id=game.id).update(version=F("version") + 1)
+        with self.assertLogs("games.move_log", "ERROR"):
+            self.assertEqual(move_log.flush(), 1)
+        self.assertEqual(Move.objects.filter(game=other).count(), 1)
+        self.assertEqual(Move.objects.filter(game=game).count(), 0)
+        self.assertEqual(move_log.pending_moves(game.id), [])
+        # New sockets get what the database has, not the dropped moves
+        _, payload = Game.objects.get_with_snapshot(game.id)
+        self.assertEqual(json.loads(payload)["seq"], 0)
+
+        self.game = game
+        with self.assertLogs("games.actors", "WARNING"):
+            rejected, accepted = self.play((False, [3, "R"]), (True, [3, "R"]))
+        self.assertEqual(rejected, {"type": "rejected", "seq": 0, "reason": "conflict"})
+        self.assertEqual(accepted["seq"], 1)
+
+    def test_full_log_rejects_moves(self):
+        """
+        Moves wait for room in a full log, and are rejected if none is made
+        """
+        # Without the flusher thread nothing makes room
+        no_flusher = mock.patch.object(move_log, "start")
+        with override_settings(MOVE_LOG_MAX_PENDING=1), no_flusher:
+            with mock.patch.object(move_log, "full_timeout", 0.05):
+                with self.assertLogs("games.actors", "WARNING"):
+                    accepted, busy = self.play((True, [3, "R"]), (False, [3, "R"]))
+        self.assertEqual(accepted["seq"], 1)
+        self.assertEqual(busy, {"type": "rejected", "seq": 1, "reason": "busy"})
+        self.assertEqual(len(move_log.pending_moves(self.game.id)), 1)
+
+
 class GameManagerTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        coordination_cache().clear()
+
     def test_make_seat_finds_empty_seat(self):
         """
         make_seat/2 finds an empty seat if there is one
@@ -334,3 +938,784 @@ class GameManagerTest(TestCase):
         self.assertEqual(found_game.player_2, player_name)
         self.assertEqual(found_game.player_1, "test")
         self.assertEqual(found_game.id, game.id)
+
+
+@override_settings(BOT_TIME_BUDGET=0.2)
+class BotTest(TestCase):
+    def test_best_move_takes_the_win(self):
+        """
+        best_move/5 completes a line when it can
+        """
+        board = Bitboard(BOARD_SIZE)
+        for position in (0, 1, 2):
+            board[position] = True
+        for position in (7, 8, 9):
+            board[position] = False
+        move, score = best_move(board, True, time_budget=0.5)
+        self.assertEqual(move, (0, "L"))
+        self.assertGreater(score, 0)
+
+    def test_best_move_blocks_the_opponent(self):
+        """
+        best_move/5 stops a line the opponent is about to complete
+        """
+        board = Bitboard(BOARD_SIZE)
+        for position in (0, 1, 2, 30):
+            board[position] = True
+        for position in (8, 14):
+            board[position] = False
+        move, _ = best_move(board, False, time_budget=0.5)
+        self.assertEqual(move, (0, "L"))
+
+    def test_best_move_on_full_board(self):
+        """
+        best_move/5 returns no move when the board is full
+        """
+        board = Bitboard.from_list(([True, False] * 25)[:49])
+        self.assertEqual(best_move(board, False), (None, 0))
+
+    def test_transposition_table_is_bounded(self):
+        """
+        Entries share the slots of a fixed size table, deeper searches are kept
+        """
+        table = TranspositionTable(size=4)
+        table.put(1, 5, 10, 0, (0, "L"))
+        table.put(5, 2, 20, 0, (1, "L"))
+        self.assertEqual(table.get(1)[2], 10)
+        self.assertIsNone(table.get(5))
+        table.generation += 1
+        table.put(5, 2, 20, 0, (1, "L"))
+        self.assertEqual(table.get(5)[2], 20)
+        self.assertEqual(len(table.entries), 4)
+
+    def test_zobrist_hash_depends_on_position(self):
+        board = Bitboard(BOARD_SIZE)
+        empty = zobrist_hash(board)
+        board[3] = True
+        self.assertNotEqual(zobrist_hash(board), empty)
+        board[3] = False
+        self.assertNotEqual(zobrist_hash(board), empty)
+
+    def test_find_game_against_bot(self):
+        """
+        find_game/4 starts a game against the bot, which replies to every move
+        """
+        game = Game.objects.find_game("test1", against_bot=True)
+        self.assertTrue(game.against_bot)
+        self.assertEqual(game.status, "STARTED")
+        self.assertFalse(game.play_bot_move())
+        game.change_state_forward(True, [3, "L"])
+        self.assertTrue(game.play_bot_move())
+        self.assertEqual(Move.objects.filter(game=game).count(), 2)
+        self.assertTrue(Game.objects.get(id=game.id).get_next_player_turn())
+
+
+class AnalysisServiceTest(TestCase):
+    def test_identical_positions_share_a_job(self):
+        """
+        evaluate/5 searches a position once while it is in flight
+        """
+        service = AnalysisService(ThreadPoolExecutor(max_workers=2))
+        board = Bitboard(BOARD_SIZE)
+
+        async def run():
+            tasks = [
+                asyncio.ensure_future(service.evaluate(board, True, 4, 0.1))
+                for _ in range(3)
+            ]
+            await asyncio.sleep(0)
+            jobs = len(service._jobs)
+            results = await asyncio.gather(*tasks)
+            return jobs, results
+
+        jobs, results = async_to_sync(run)()
+        self.assertEqual(jobs, 1)
+        self.assertEqual(len({str(x) for x in results}), 1)
+        self.assertEqual(service._jobs, {})
+
+    def test_timeout_cancels_the_job(self):
+        """
+        A job nobody waits for anymore is dropped
+        """
+        executor = ThreadPoolExecutor(max_workers=1)
+        service = AnalysisService(executor)
+        # Keep the only worker busy, so the search stays queued
+        executor.submit(time.sleep, 0.2)
+
+        async def run():
+            with self.assertRaises(asyncio.TimeoutError):
+                await service.evaluate(Bitboard(BOARD_SIZE), True, 4, 5, timeout=0.05)
+
+        async_to_sync(run)()
+        self.assertEqual(service._jobs, {})
+
+    def test_process_pool(self):
+        """
+        The default executor runs the search in another process
+        """
+        service = AnalysisService()
+        board = Bitboard(BOARD_SIZE)
+        for position in (0, 1, 2):
+            board[position] = True
+        for position in (7, 8, 9):
+            board[position] = False
+        try:
+            move, score = async_to_sync(service.evaluate)(board, True, 4, 0.2)
+        finally:
+            service.shutdown()
+        self.assertEqual(move, [0, "L"])
+
+
+class OpeningBookTest(TestCase):
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp()
+        os.close(handle)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_find_uses_sorted_records(self):
+        """
+        find/1 returns the move and score of every stored hash, None for the rest
+        """
+        entries = [
+            (key * 7919, (key % 7, "LR"[key % 2]), key - 50) for key in range(100)
+        ]
+        write_book(self.path, 7, 4, entries)
+        book = OpeningBook(self.path)
+        self.assertEqual(len(book), 100)
+        for key, move, score in entries:
+            self.assertEqual(book.find(key), (list(move), score))
+        self.assertIsNone(book.find(3))
+
+    def test_lookup_checks_variant(self):
+        """
+        lookup/2 only answers for the variant the book was built for
+        """
+        board = Bitboard(BOARD_SIZE)
+        write_book(self.path, 7, 4, [(zobrist_hash(board), (3, "L"), 0)])
+        book = OpeningBook(self.path)
+        self.assertEqual(book.lookup(board, 4), ([3, "L"], 0))
+        self.assertIsNone(book.lookup(board, 5))
+
+    def test_build_opening_book(self):
+        """
+        build_opening_book solves every position up to the given depth
+        """
+        call_command(
+            "build_opening_book",
+            depth=1,
+            time_budget=0.01,
+            workers=1,
+            output=self.path,
+            stdout=io.StringIO(),
+        )
+        book = OpeningBook(self.path)
+        # The empty board plus the 14 first moves
+        self.assertEqual(len(book), 15)
+        self.assertIsNotNone(book.lookup(Bitboard(BOARD_SIZE), 4))
+
+    def test_positions_stop_at_wins_of_the_variant(self):
+        """
+        positions_up_to/3 leaves out the games won with lines of win_length
+        """
+        self.assertEqual(len(positions_up_to(BOARD_SIZE, 1, 4)), 15)
+        # Every first move completes a line of one
+        self.assertEqual(len(positions_up_to(BOARD_SIZE, 1, 1)), 1)
+
+
+class MetricsTest(TestCase):
+    def setUp(self):
+        metrics.REGISTRY.clear()
+
+    @override_settings(METRICS_ENABLED=True)
+    def test_histogram_buckets(self):
+        """
+        Buckets are cumulative and end with +Inf, followed by count and sum
+        """
+        histogram = metrics.Histogram("test_seconds", "Test", ("kind",), (0.1, 1))
+        for value in (0.05, 0.5, 0.5, 5):
+            histogram.observe(value, "move")
+        self.assertEqual(
+            histogram.render().splitlines()[2:],
+            [
+                'test_seconds_bucket{kind="move",le="0.1"} 1',
+                'test_seconds_bucket{kind="move",le="1"} 3',
+                'test_seconds_bucket{kind="move",le="+Inf"} 4',
+                'test_seconds_count{kind="move"} 4',
+                'test_seconds_sum{kind="move"} 6.05',
+            ],
+        )
+
+    def test_disabled_metrics_record_nothing(self):
+        with metrics.CONNECT_SECONDS.time("game"):
+            metrics.socket_opened("game", 1)
+        metrics.payload_sent("game", "data")
+        self.assertEqual(metrics.CONNECT_SECONDS.samples(), [])
+        self.assertEqual(metrics.OPEN_SOCKETS.samples(), [])
+        self.assertEqual(self.client.get("/metrics/").status_code, 404)
+
+    @override_settings(METRICS_ENABLED=True)
+    def test_metrics_endpoint(self):
+        game = Game.objects.create(player_1="test1", player_2="test2")
+        game.change_state_forward(True, [3, "R"])
+        response = self.client.get("/metrics/")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"connect_four_state_change_db_seconds_count 1", response.content)
+        self.assertIn(b"# TYPE connect_four_open_sockets gauge", response.content)
+
+
+class BenchmarkTest(TestCase):
+    def test_compare(self):
+        """
+        compare/3 only reports cases whose best run is slower than the median of
+        the baseline past the threshold
+        """
+        baseline = {
+            "a": {"min": 1.0, "median": 1.0},
+            "b": {"min": 1.0, "median": 1.0},
+            "c": {"min": 1.0, "median": 1.0},
+            "e": {"min": 1.0, "median": 1.2},
+        }
+        results = {
+            "a": {"min": 1.1, "median": 1.1},
+            "b": {"min": 1.5, "median": 1.5},
+            "d": {"min": 9.0, "median": 9.0},
+            # Noisy: a slow median, and a best run close to the baseline
+            "e": {"min": 1.2, "median": 3.0},
+        }
+        self.assertEqual(compare(results, baseline, 0.25), [("b", 1.0, 1.5)])
+
+    def test_run_benchmarks(self):
+        """
+        Every case is timed, and the games it stores are rolled back
+        """
+        results = run_benchmarks(count=5, min_time=0.001)
+        for name in ("find_winner/worst_case", "Game.to_json/mid_game"):
+            self.assertGreater(results[name]["min"], 0)
+            self.assertGreaterEqual(results[name]["median"], results[name]["min"])
+        self.assertEqual(Game.objects.count(), 0)
+
+    def test_benchmark_command_fails_on_regressions(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, "results.json")
+            options = dict(
+                positions=5,
+                min_time=0.001,
+                select="encode_board",
+                stdout=io.StringIO(),
+            )
+            call_command("benchmark", output=output, **options)
+            with open(output) as f:
+                saved = json.load(f)
+            self.assertEqual(len(saved["results"]), 3)
+            fast = {"min": 1e-6, "median": 1e-6}
+            saved["results"] = {name: fast for name in saved["results"]}
+            with open(output, "w") as f:
+                json.dump(saved, f)
+            with self.assertRaises(CommandError):
+                call_command("benchmark", baseline=output, **options)
+
+
+class ArchiveTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "games.jsonl.gz")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def play_game(self, moves, finished=True):
+        game = Game.objects.create(player_1="test1", player_2="test2")
+        for i, move in enumerate(moves):
+            game.change_state_forward(i % 2 == 0, move)
+        if finished:
+            Game.objects.filter(id=game.id).update(status="FINISHED")
+        return Game.objects.get(id=game.id)
+
+    def test_export_and_import(self):
+        """
+        Finished games go through the archive with their moves, boards and result
+        """
+        playing = self.play_game([[3, "R"]], finished=False)
+        won = self.play_game([[0, "L"], [1, "L"]] * 3 + [[0, "L"]])
+        empty = self.play_game([])
+        timeline = won.replay_timeline()
+        self.assertIsNotNone(cache.get("replay_timeline:{}".format(won.id)))
+        options = dict(chunk_size=1, stdout=io.StringIO())
+        call_command("export_games", self.path, delete=True, **options)
+        self.assertEqual(list(Game.objects.all()), [playing])
+        self.assertEqual(Move.objects.count(), 1)
+        with gzip.open(self.path, "rt") as f:
+            lines = [json.loads(line) for line in f]
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(lines[1]["moves"], "AAIAAgACAA==")
+        self.assertEqual(lines[1]["id"], won.id)
+        self.assertIsNone(cache.get("replay_timeline:{}".format(won.id)))
+
+        call_command("import_games", self.path, batch_size=1, stdout=io.StringIO())
+        imported = Game.objects.exclude(id=playing.id).order_by("id")
+        self.assertEqual(len(imported), 2)
+        # Ids of the deleted games are never given again
+        self.assertGreater(imported[0].id, empty.id)
+        game = imported[0]
+        self.assertEqual((game.status, game.winner), ("FINISHED", True))
+        self.assertEqual(game.board, won.board)
+        self.assertEqual(
+            [x["position"] for x in game.replay_timeline()["moves"]],
+            [x["position"] for x in timeline["moves"]],
+        )
+        last = Move.objects.filter(game=game).first()
+        self.assertEqual(last.reconstruct_up_to(), won.python_board.to_list())
+        self.assertEqual(last.player_name, "test1")
+        self.assertEqual(imported[1].seq, empty.seq)
+
+    def test_import_rejects_bad_archives(self):
+        with gzip.open(self.path, "wt") as f:
+            f.write(json.dumps({"format": "connect_four-games", "version": 1}) + "\n")
+            f.write(json.dumps({"player_1": "test1"}) + "\n")
+        with self.assertRaisesMessage(CommandError, "Line 2"):
+            call_command("import_games", self.path, stdout=io.StringIO())
+        with gzip.open(self.path, "wt") as f:
+            f.write("{}\n")
+        with self.assertRaisesMessage(CommandError, "Not a game archive"):
+            call_command("import_games", self.path, stdout=io.StringIO())
+
+    def test_import_reports_truncated_archives(self):
+        self.play_game([[0, "L"]])
+        call_command("export_games", self.path, stdout=io.StringIO())
+        with open(self.path, "rb") as f:
+            data = f.read()
+        with open(self.path, "wb") as f:
+            f.write(data[:-8])
+        with self.assertRaisesMessage(CommandError, "truncated"):
+            call_command("import_games", self.path, stdout=io.StringIO())
+
+
+class SimulatorTest(TestCase):
+    def test_has_line(self):
+        """
+        has_line/2 finds every direction, and only full lines
+        """
+        pieces = np.zeros((5, 7, 7), dtype=bool)
+        pieces[0, 2, 1:5] = True
+        pieces[1, 1:5, 6] = True
+        for i in range(4):
+            pieces[2, 3 + i, 2 + i] = True
+            pieces[3, 3 + i, 6 - i] = True
+        pieces[4, 0, 0:3] = True
+        pieces[4, 0, 4] = True
+        self.assertEqual(has_line(pieces, 4).tolist(), [True] * 4 + [False])
+
+    def test_results_match_find_winner(self):
+        """
+        Sampled games give the same winner when replayed with find_winner/3
+        """
+        for size, win_length in ((7, 4), (9, 5)):
+            for policy in ("random", "greedy"):
+                simulator = BatchSimulator(size, win_length, policy, seed=1)
+                result = simulator.run(200)
+                self.assertEqual(simulator.cross_check(result, 50), [])
+
+    def test_report(self):
+        """
+        Counts in the report add up to the number of games
+        """
+        report = BatchSimulator(seed=2).run(300).report()
+        self.assertEqual(report["games"], 300)
+        self.assertEqual(sum(report["length_histogram"]), 300)
+        first_moves = report["by_first_move"].values()
+        self.assertEqual(sum(stats["games"] for stats in first_moves), 300)
+
+    def test_greedy_takes_wins(self):
+        """
+        The greedy policy completes its line, or blocks the opponent's one
+        """
+        simulator = BatchSimulator(policy="greedy", seed=3)
+        boards = np.zeros((2, 7, 7), dtype=np.int8)
+        # Player 1 can win playing 2,L in the first game
+        boards[0, 2, 1:4] = 1
+        boards[0, 2, 4] = 2
+        boards[0, 5, 0:2] = 2
+        # Player 2 threatens 5,L in the second one
+        boards[1, 5, 1:4] = 2
+        boards[1, 5, 4] = 1
+        boards[1, 0, 2:4] = 1
+        left, right, room = simulator.landing_columns(boards)
+        choice = simulator.choose(boards, 1, left, right, room)
+        self.assertEqual(choice.tolist(), [2 * 2, 5 * 2])
+
+    def test_simulate_command(self):
+        out = io.StringIO()
+        call_command("simulate", games=50, batch=20, seed=1, stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertEqual(report["games"], 50)
+        self.assertEqual(sum(report["length_histogram"]), 50)
+
+
+class MatchmakingQueueTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        coordination_cache().clear()
+
+    def pop_concurrently(self, queue):
+        """
+        Many threads pop or enqueue at the same time, every enqueued item
+        must be popped at most once
+        """
+        popped = []
+        counter = iter(range(1000))
+
+        def worker():
+            for _ in range(20):
+                item = queue.pop_or_enqueue("key", lambda: next(counter))
+                if item is not None:
+                    popped.append(item)
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(popped), len(set(popped)))
+        self.assertEqual(len(popped), 80)
+
+    def test_in_memory_queue_is_atomic(self):
+        self.pop_concurrently(InMemoryQueue())
+
+    def test_cache_queue_is_atomic(self):
+        self.pop_concurrently(CacheQueue())
+
+    def test_cache_queue_is_fifo(self):
+        """
+        pop_or_enqueue/2 returns the oldest waiting item
+        """
+        queue = CacheQueue()
+        queue.push("key", 1)
+        queue.push("key", 2)
+        self.assertEqual(queue.pop_or_enqueue("key", lambda: 3), 1)
+        self.assertEqual(queue.pop_or_enqueue("key", lambda: 3), 2)
+        self.assertIsNone(queue.pop_or_enqueue("key", lambda: 3))
+        self.assertEqual(queue.pop_or_enqueue("key", lambda: 4), 3)
+
+    def test_cache_queue_survives_lost_counters(self):
+        """
+        A culled tail doesn't overwrite waiting items, and an empty queue
+        leaves no counters behind
+        """
+        queue = CacheQueue()
+        for item in (1, 2, 3):
+            queue.push("key", item)
+        self.assertEqual(queue.pop_or_enqueue("key", lambda: 4), 1)
+        coordination_cache().delete("matchmaking:key:tail")
+        queue.push("key", 4)
+        popped = [queue.pop_or_enqueue("key", lambda: 5) for _ in range(3)]
+        self.assertEqual(popped, [2, 3, 4])
+        self.assertIsNone(coordination_cache().get("matchmaking:key:head"))
+        self.assertIsNone(coordination_cache().get("matchmaking:key:tail"))
+
+    def test_take_seat_only_once(self):
+        """
+        take_seat/2 refuses a seat that was already taken
+        """
+        game = Game.objects.create(player_1="test1")
+        self.assertTrue(Game.objects.take_seat(game.id, "test2"))
+        self.assertFalse(Game.objects.take_seat(game.id, "test3"))
+        self.assertEqual(Game.objects.get(id=game.id).player_2, "test2")
+        self.assertEqual(Game.objects.get(id=game.id).version, 1)
+
+    def test_make_seat_skips_stale_games(self):
+        """
+        Queued games that were finished meanwhile are dropped
+        """
+        stale = Game.objects.create(player_1="test1")
+        Game.objects.filter(id=stale.id).update(status="FINISHED")
+        waiting = Game.objects.create(player_1="test2")
+        self.assertEqual(Game.objects.make_seat("test3").id, waiting.id)
+
+
+@override_settings(
+    CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
+)
+class GameConsumerTest(TransactionTestCase):
+    def setUp(self):
+        # Actors are bound to the loop of the async_to_sync that started them
+        registry.clear()
+        self.game = Game.objects.create(
+            player_1="test1", player_2="test2", status="STARTED"
+        )
+
+    def tearDown(self):
+        registry.clear()
+
+    async def connect(self):
+        communicator = WebsocketCommunicator(
+            URLRouter(websocket_urlpatterns), f"/ws/game/{self.game.id}/"
+        )
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    def test_connect_sends_game_state(self):
+        """
+        Connecting to a game broadcasts its current state
+        """
+
+        async def run():
+            communicator = await self.connect()
+            message = json.loads(await communicator.receive_from())
+            await communicator.disconnect()
+            return message
+
+        message = async_to_sync(run)()
+        self.assertEqual(message["player_1"], "test1")
+        self.assertEqual(message["board"].count(None), 49)
+
+    def test_move_is_broadcast_and_replayed(self):
+        """
+        A move is persisted and broadcast as a delta, and it can be replayed afterwards
+        """
+
+        async def run():
+            communicator = await self.connect()
+            await communicator.receive_from()
+            await communicator.send_to(
+                json.dumps({"move": ["3", "R"], "player": "test1"})
+            )
+            message = json.loads(await communicator.receive_from())
+            await communicator.send_to(
+                json.dumps({"replay_until": message["move"]["id"]})
+            )
+            replay = json.loads(await communicator.receive_from())
+            await communicator.disconnect()
+            return message, replay
+
+        message, replay = async_to_sync(run)()
+        self.assertEqual(message["type"], "move")
+        self.assertEqual(message["seq"], 1)
+        self.assertEqual(message["position"], 27)
+        self.assertTrue(message["player"])
+        self.assertNotIn("board", message)
+        self.assertTrue(replay["replay_board"][27])
+        self.assertTrue(Game.objects.get(id=self.game.id).python_board[27])
+
+    def test_rejected_move_and_snapshot_request(self):
+        """
+        An invalid move is only answered to the sender, and a snapshot can be requested
+        """
+
+        async def run():
+            communicator = await self.connect()
+            await communicator.receive_from()
+            await communicator.send_to(
+                json.dumps({"move": ["3", "R"], "player": "test2"})
+            )
+            rejected = json.loads(await communicator.receive_from())
+            await communicator.send_to(json.dumps({"snapshot": True}))
+            snapshot = json.loads(await communicator.receive_from())
+            await communicator.disconnect()
+            return rejected, snapshot
+
+        rejected, snapshot = async_to_sync(run)()
+        self.assertEqual(rejected, {"type": "rejected", "seq": 0})
+        self.assertEqual(snapshot["type"], "snapshot")
+        self.assertEqual(snapshot["moves"], [])
+
+    @override_settings(METRICS_ENABLED=True)
+    def test_metrics(self):
+        """
+        Sockets, games, messages and payload bytes are recorded
+        """
+        metrics.REGISTRY.clear()
+
+        async def run():
+            communicator = await self.connect()
+            await communicator.receive_from()
+            self.assertEqual(metrics.OPEN_SOCKETS.samples()[0][3], 1)
+            self.assertEqual(metrics.ACTIVE_GAMES.samples()[0][3], 1)
+            await communicator.send_to(
+                json.dumps({"move": ["3", "R"], "player": "test1"})
+            )
+            await communicator.receive_from()
+            await communicator.disconnect()
+
+        async_to_sync(run)()
+        output = metrics.REGISTRY.render()
+        self.assertIn('connect_four_open_sockets{consumer="game"} 0', output)
+        self.assertIn("connect_four_active_games 0", output)
+        self.assertIn(
+            'connect_four_receive_seconds_count{consumer="game",kind="move"} 1', output
+        )
+        self.assertIn(
+            'connect_four_group_send_seconds_count{consumer="game"} 2', output
+        )
+        self.assertIn('connect_four_sent_bytes_total{consumer="game"}', output)
+
+    @override_settings(HINT_TIME_BUDGET=0.1)
+    def test_hint(self):
+        """
+        A hint is answered to the sender with a move and its score
+        """
+
+        async def run():
+            communicator = await self.connect()
+            await communicator.receive_from()
+            await communicator.send_to(json.dumps({"hint": True}))
+            hint = json.loads(await communicator.receive_from(timeout=5))
+            await communicator.disconnect()
+            return hint
+
+        hint = async_to_sync(run)()["hint"]
+        self.assertEqual(len(hint["move"]), 2)
+        self.assertIn("score", hint)
+
+
+@override_settings(BOT_TIME_BUDGET=0.1)
+class GameActorTest(TransactionTestCase):
+    def setUp(self):
+        registry.clear()
+        self.game = Game.objects.create(
+            player_1="test1", player_2="test2", status="STARTED"
+        )
+
+    def tearDown(self):
+        registry.clear()
+
+    async def send_moves(self, layer, commands):
+        for player, move in commands:
+            command = {"kind": "move", "player": player, "move": move}
+            command["reply_channel"] = "socket"
+            await submit(layer, self.game.id, command)
+
+    async def receive(self, layer, count):
+        """
+        Returns the next messages of the game group and of the sender
+        """
+        messages = []
+        for _ in range(count):
+            message = await asyncio.wait_for(layer.receive("socket"), 5)
+            messages.append(json.loads(message["message"]))
+        return messages
+
+    def play(self, commands, expected):
+        async def run():
+            layer = InMemoryChannelLayer()
+            await layer.group_add(str(self.game.id), "socket")
+            await self.send_moves(layer, commands)
+            return await self.receive(layer, expected)
+
+        return async_to_sync(run)()
+
+    def test_hash_ring(self):
+        """
+        Keys are spread over every node, and removing one only moves its own keys
+        """
+        ring = HashRing(["a", "b", "c"])
+        owners = {key: ring.node_for(key) for key in range(3000)}
+        for node in "abc":
+            self.assertGreater(list(owners.values()).count(node), 600)
+        smaller = HashRing(["a", "b"])
+        for key, node in owners.items():
+            if node != "c":
+                self.assertEqual(smaller.node_for(key), node)
+
+    def test_moves_are_applied_in_order(self):
+        moves = [(True, [3, "R"]), (False, [3, "R"]), (True, [0, "L"])]
+        messages = self.play(moves + [(True, [1, "L"])], 4)
+        self.assertEqual([message["seq"] for message in messages], [1, 2, 3, 3])
+        self.assertEqual(messages[-1]["type"], "rejected")
+        moves = Move.objects.filter(game=self.game).order_by("seq")
+        self.assertEqual([move.seq for move in moves], [1, 2, 3])
+        self.assertEqual(Game.objects.get(id=self.game.id).seq, 3)
+
+    def test_conflicts_are_retried(self):
+        """
+        A move written behind the actor's back makes the actor reload the game
+        and play the move again, the sender hears about it if it is rejected then
+        """
+
+        def other_writer():
+            Game.objects.get(id=self.game.id).change_state_forward(False, [3, "R"])
+
+        async def run():
+            layer = InMemoryChannelLayer()
+            await layer.group_add(str(self.game.id), "socket")
+            await self.send_moves(layer, [(True, [3, "R"])])
+            await self.receive(layer, 1)
+            await database_sync_to_async(other_writer)()
+            await self.send_moves(layer, [(False, [0, "L"])])
+            rejected = await self.receive(layer, 1)
+            await self.send_moves(layer, [(True, [0, "L"])])
+            return rejected + await self.receive(layer, 1)
+
+        with self.assertLogs("games.actors", "WARNING"):
+            rejected, accepted = async_to_sync(run)()
+        self.assertEqual(rejected, {"type": "rejected", "seq": 2, "reason": "conflict"})
+        self.assertEqual(accepted["seq"], 3)
+        self.assertEqual(Game.objects.get(id=self.game.id).version, 3)
+
+    def test_bot_reply(self):
+        self.game = Game.objects.create(
+            player_1="test1", player_2="Bot", status="STARTED", against_bot=True
+        )
+        messages = self.play([(True, [3, "R"])], 2)
+        self.assertEqual([message["seq"] for message in messages], [1, 2])
+        self.assertFalse(messages[1]["player"])
+
+    @override_settings(GAME_ACTOR_CHANNELS=["actors-1", "actors-2"])
+    def test_moves_are_sent_to_the_owner(self):
+        async def run():
+            layer = InMemoryChannelLayer()
+            await submit(layer, self.game.id, {"kind": "move"})
+            return await layer.receive(actor_channel(self.game.id))
+
+        message = async_to_sync(run)()
+        self.assertEqual(message["type"], "actor.command")
+        self.assertEqual(message["game_id"], str(self.game.id))
+
+
+@override_settings(
+    CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
+)
+class LoadGeneratorTest(TransactionTestCase):
+    def setUp(self):
+        registry.clear()
+
+    def tearDown(self):
+        registry.clear()
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([7], 95), 7)
+        self.assertIsNone(percentile([], 50))
+
+    def test_run_load(self):
+        """
+        Every move is measured, queries are counted and the games are cleaned up
+        """
+        report = async_to_sync(run_load)(games=1, max_moves=6, seed=1)
+        self.assertEqual(report["errors"], 0)
+        self.assertEqual(report["moves"], 6)
+        latency = report["latency_ms"]
+        self.assertTrue(0 < latency["p50"] <= latency["p95"] <= latency["p99"])
+        self.assertGreater(report["queries_per_move"], 0)
+        self.assertIsNotNone(report["lobby_connect_ms"])
+        self.assertEqual(report["connect_errors"], 0)
+        self.assertEqual(Game.objects.count(), 0)
+
+    def test_run_load_counts_failed_connections(self):
+        """
+        Sockets that can't connect are counted and closed, and the run still reports
+        """
+        refused = mock.AsyncMock(return_value=(False, 1000))
+        with mock.patch.object(WebsocketCommunicator, "connect", refused):
+            report = async_to_sync(run_load)(games=1, max_moves=6, seed=1)
+        # Two lobby sockets, and the first player of the game
+        self.assertEqual(report["connect_errors"], 3)
+        self.assertEqual(report["errors"], 3)
+        self.assertEqual(report["moves"], 0)
+        self.assertIsNone(report["lobby_connect_ms"])
+        self.assertEqual(Game.objects.count(), 0)
@@ -1,8 +1,17 @@
-from django.views.generic import TemplateView
-from django.shortcuts import render, redirect, reverse
+from django.http import Http404, HttpResponse, JsonResponse
+from django.views.generic import TemplateView, View
+from django.shortcuts import render, redirect, reverse, get_object_or_404
+from . import metrics
 from .helpers import set_cookie
 from .models import Game
 
+# Variants offered in the form: (board size, win length)
+GAME_VARIANTS = {
+    "7-4": (7, 4),
+    "9-5": (9, 5),
+    "15-5": (15, 5),
+}
+
 
 class PickUser(TemplateView):
     """
@@ -19,7 +28,13 @@ class PickUser(TemplateView):
 
     def post(self, request):
         player_name = request.POST["player-name"]
-        current_game = Game.objects.find_game(player_name)
+        board_size, win_length = GAME_VARIANTS.get(
+            request.POST.get("variant"), GAME_VARIANTS["7-4"]
+        )
+        against_bot = request.POST.get("opponent") == "bot"
+        current_game = Game.objects.find_game(
+            player_name, board_size, win_length, against_bot
+        )
         response = redirect(reverse("game", kwargs={"game_id": current_game.id}))
         set_cookie(response, "username", player_name)
         return response
@@ -33,3 +48,28 @@ class GameView(TemplateView):
     """
 
     template_name = "play_game.html"
+
+
+class ReplayView(View):
+    """
+    Returns the whole replay timeline of a game, so the client can
+    scrub through the moves without asking for every board.
+    """
+
+    def get(self, request, game_id):
+        game = get_object_or_404(Game, id=game_id)
+        return JsonResponse(game.replay_timeline())
+
+
+class MetricsView(View):
+    """
+    Consumer metrics of this process in the Prometheus text format.
+    Not found unless settings.METRICS_ENABLED is on.
+    """
+
+    def get(self, request):
+        if not metrics.enabled():
+            raise Http404()
+        return HttpResponse(
+            metrics.REGISTRY.render(), content_type="text/plain; version=0.0.4"
+        )
@@ -0,0 +1,90 @@
+"""
+Merges the presence events of the lobby into batches, so a reconnect storm
+(every socket of a worker coming back after a deploy) sends a few broadcasts
+instead of one per socket.
+"""
+
+import asyncio
+from collections import Counter
+from django.conf import settings
+from games import metrics
+
+
+class PresenceBatcher:
+    """
+    Collects joined and left events and broadcasts them as a single
+    {"type": "batch", "joined": [...], "left": [...]} message.
+    A batch is sent once no event arrived for LOBBY_BATCH_WINDOW seconds, and
+    never later than LOBBY_BATCH_MAX_DELAY seconds after its first event.
+    Events that cancel out inside a batch (a user leaving and coming back) are
+    not sent at all. Every event that didn't get its own broadcast is counted
+    as suppressed.
+    """
+
+    def __init__(self, group):
+        self.group = group
+        self.pending = {}
+        self.events = 0
+        self.first_event = None
+        self.handle = None
+        self.channel_layer = None
+        self.stats = Counter()
+
+    def add(self, channel_layer, kind, username):
+        """
+        Queues the event. Must be called from the event loop.
+        """
+        self.stats["events"] += 1
+        self.events += 1
+        self.channel_layer = channel_layer
+        # Joined and left alternate for every user, so a second event cancels the first
+        if self.pending.pop(username, None) is None:
+            self.pending[username] = kind
+
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        if self.first_event is None:
+            self.first_event = now
+        if self.handle is not None:
+            self.handle.cancel()
+        window = getattr(settings, "LOBBY_BATCH_WINDOW", 0.25)
+        max_delay = getattr(settings, "LOBBY_BATCH_MAX_DELAY", 1.0)
+        delay = max(min(window, self.first_event + max_delay - now), 0)
+        self.handle = loop.call_later(
+            delay, lambda: asyncio.ensure_future(self.flush())
+        )
+
+    def clear(self):
+        """
+        Drops the pending events without sending them
+        """
+        if self.handle is not None:
+            self.handle.cancel()
+        self.pending, self.events = {}, 0
+        self.first_event = self.handle = None
+
+    async def flush(self):
+        """
+        Sends the pending events now
+        """
+        if self.handle is not None:
+            self.handle.cancel()
+        pending, events = self.pending, self.events
+        self.pending, self.events = {}, 0
+        self.first_event = self.handle = None
+        if not events:
+            return
+
+        suppressed = events - 1 if pending else events
+        self.stats["suppressed"] += suppressed
+        metrics.SUPPRESSED_BROADCASTS.inc("lobby", amount=suppressed)
+        if not pending:
+            return
+        message = {"type": "batch", "joined": [], "left": []}
+        for username, kind in sorted(pending.items()):
+            message[kind].append(username)
+        self.stats["batches"] += 1
+        with metrics.GROUP_SEND_SECONDS.time("lobby"):
+            await self.channel_layer.group_send(
+                self.group, {"type": "lobby_message", "message": message}
+            )
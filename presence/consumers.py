@@ -1,44 +1,63 @@
 import json
-from channels.generic.websocket import WebsocketConsumer
-from asgiref.sync import async_to_sync
-from django.db import transaction
-from .models import Presence
+from asgiref.sync import sync_to_async
+from channels.generic.websocket import AsyncWebsocketConsumer
+from games import metrics
+from .batching import PresenceBatcher
 from .hash_helpers import get_username_from_ws
+from .store import get_presence
 
 
 LOBBY_GROUP_NAME = "lobby"
+batcher = PresenceBatcher(LOBBY_GROUP_NAME)
 
 
-class LobbyConsumer(WebsocketConsumer):
+@sync_to_async
+def join(username):
     """
-    Very naive implementation of presence for users
+    Returns whether the user just joined, and every connected user
     """
+    presence = get_presence()
+    joined = presence.add(username)
+    return joined, presence.members()
 
-    def connect(self):
-        self.accept()
-        username = get_username_from_ws(self.channel_name)
-        Presence.objects.get_or_create(username=username)
-        async_to_sync(self.channel_layer.group_add)(LOBBY_GROUP_NAME, self.channel_name)
-        connected_users = Presence.get_presence_items()
-        async_to_sync(self.channel_layer.group_send)(
-            LOBBY_GROUP_NAME,
-            {"type": "lobby_message", "message": {"users": connected_users}},
-        )
-
-    def receive(self, text_data):
+
+@sync_to_async
+def leave(username):
+    return get_presence().remove(username)
+
+
+class LobbyConsumer(AsyncWebsocketConsumer):
+    """
+    Presence of the users in the lobby
+    Protocol:
+     - A new socket gets the full list of users (type "snapshot"), only once
+     - Users joining and leaving are broadcast in batches
+       {"type": "batch", "joined": [...], "left": [...]} (see PresenceBatcher)
+    """
+
+    async def connect(self):
+        with metrics.CONNECT_SECONDS.time("lobby"):
+            await self.accept()
+            metrics.socket_opened("lobby")
+            self.username = get_username_from_ws(self.channel_name)
+            await self.channel_layer.group_add(LOBBY_GROUP_NAME, self.channel_name)
+            joined, users = await join(self.username)
+            await self.send(json.dumps({"type": "snapshot", "users": users}))
+            if joined:
+                batcher.add(self.channel_layer, "joined", self.username)
+
+    async def receive(self, text_data):
         pass
 
-    def disconnect(self, _code):
-        username = get_username_from_ws(self.channel_name)
-        Presence.objects.filter(username=username).delete()
-        connected_users = Presence.get_presence_items()
-        async_to_sync(self.channel_layer.group_discard)(
-            LOBBY_GROUP_NAME, self.channel_name
-        )
-        async_to_sync(self.channel_layer.group_send)(
-            LOBBY_GROUP_NAME,
-            {"type": "lobby_message", "message": {"users": connected_users}},
-        )
-
-    def lobby_message(self, event):
-        self.send(json.dumps(event["message"]))
+    async def disconnect(self, _code):
+        metrics.socket_closed("lobby")
+        await self.channel_layer.group_discard(LOBBY_GROUP_NAME, self.channel_name)
+        if await leave(self.username):
+            batcher.add(self.channel_layer, "left", self.username)
+
+    async def send(self, text_data=None, bytes_data=None, close=False):
+        metrics.payload_sent("lobby", text_data, bytes_data)
+        await super().send(text_data, bytes_data, close)
+
+    async def lobby_message(self, event):
+        await self.send(json.dumps(event["message"]))
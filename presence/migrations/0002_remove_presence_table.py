@@ -0,0 +1,16 @@
+# Generated by Django 3.0.5 on 2026-10-18 18:24
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('presence', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.DeleteModel(
+            name='Presence',
+        ),
+    ]
@@ -0,0 +1,138 @@
+"""
+Set of the users connected to the lobby, without a database table.
+A user can have more than one socket open, so every name keeps a count of
+sockets: add and remove tell whether the user just joined or just left.
+"""
+
+import threading
+import zlib
+from functools import lru_cache
+from django.conf import settings
+from django.utils.module_loading import import_string
+from games.matchmaking import cache_lock, coordination_cache
+
+
+class InMemoryPresence:
+    """
+    Process local set. Used in tests and single process deployments.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sockets = {}
+
+    def add(self, username):
+        """
+        Returns True if the user wasn't connected yet
+        """
+        with self._lock:
+            self._sockets[username] = self._sockets.get(username, 0) + 1
+            return self._sockets[username] == 1
+
+    def remove(self, username):
+        """
+        Returns True if it was the last socket of the user
+        """
+        with self._lock:
+            count = self._sockets.pop(username, 0) - 1
+            if count > 0:
+                self._sockets[username] = count
+            return count == 0
+
+    def members(self):
+        with self._lock:
+            return sorted(self._sockets)
+
+    def clear(self):
+        with self._lock:
+            self._sockets.clear()
+
+
+class CachePresence:
+    """
+    Set stored in the coordination cache, shared by every process using it.
+    Every user has a key with its count of sockets, changed with cache.incr and
+    cache.decr (atomic, no lock). The names are listed in a few shard keys,
+    only changed when a user joins or leaves, holding the lock of that shard.
+    """
+
+    prefix = "presence"
+    shards = 16
+    lock_timeout = 5
+    # Users are forgotten a day after the last change, if a worker died
+    # without disconnecting its sockets
+    timeout = 24 * 60 * 60
+
+    def _user_key(self, username):
+        return "{}:user:{}".format(self.prefix, username)
+
+    def _shard_key(self, shard):
+        return "{}:shard:{}".format(self.prefix, shard)
+
+    def _sync(self, username):
+        """
+        Lists the user in its shard if it has sockets, removes it otherwise
+        The count is read holding the lock, so joins and leaves of the same
+        user can't be applied out of order.
+        """
+        cache = coordination_cache()
+        shard_key = self._shard_key(zlib.crc32(username.encode()) % self.shards)
+        with cache_lock(shard_key + ":lock", self.lock_timeout):
+            names = cache.get(shard_key, set())
+            if cache.get(self._user_key(username), 0) > 0:
+                names.add(username)
+            else:
+                names.discard(username)
+            cache.set(shard_key, names, self.timeout)
+
+    def add(self, username):
+        """
+        Returns True if the user wasn't connected yet
+        """
+        cache = coordination_cache()
+        key = self._user_key(username)
+        cache.add(key, 0, self.timeout)
+        count = cache.incr(key)
+        cache.touch(key, self.timeout)
+        if count == 1:
+            self._sync(username)
+        return count == 1
+
+    def remove(self, username):
+        """
+        Returns True if it was the last socket of the user
+        """
+        try:
+            count = coordination_cache().decr(self._user_key(username))
+        except ValueError:  # Not connected, or forgotten
+            return False
+        if count == 0:
+            self._sync(username)
+        return count == 0
+
+    def members(self):
+        cache = coordination_cache()
+        shard_keys = [self._shard_key(shard) for shard in range(self.shards)]
+        names = set().union(*cache.get_many(shard_keys).values())
+        counts = cache.get_many([self._user_key(name) for name in names])
+        return sorted(name for name in names if counts.get(self._user_key(name), 0) > 0)
+
+    def clear(self):
+        cache = coordination_cache()
+        shard_keys = [self._shard_key(shard) for shard in range(self.shards)]
+        names = set().union(*cache.get_many(shard_keys).values())
+        cache.delete_many(shard_keys + [self._user_key(name) for name in names])
+
+
+@lru_cache(maxsize=None)
+def _load_store(path):
+    return import_string(path)()
+
+
+def get_presence():
+    """
+    Returns the store configured in settings.PRESENCE_STORE
+    """
+    return _load_store(
+        getattr(settings, "PRESENCE_STORE", "presence.store.CachePresence")
+    )
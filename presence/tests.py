@@ -0,0 +1,161 @@
+from django.test import TestCase, TransactionTestCase, override_settings
+from asgiref.sync import async_to_sync
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+import asyncio
+import json
+import threading
+import time
+from games.matchmaking import coordination_cache
+from presence.batching import PresenceBatcher
+from presence.routing import websocket_urlpatterns as lobby_urlpatterns
+from presence.consumers import batcher as lobby_batcher
+from presence.store import CachePresence, InMemoryPresence, get_presence
+
+
+class PresenceStoreTest(TestCase):
+    def setUp(self):
+        coordination_cache().clear()
+
+    def check_store(self, store):
+        """
+        A user joins with the first socket and leaves with the last one
+        """
+        self.assertTrue(store.add("b"))
+        self.assertTrue(store.add("a"))
+        self.assertFalse(store.add("a"))
+        self.assertEqual(store.members(), ["a", "b"])
+        self.assertFalse(store.remove("a"))
+        self.assertTrue(store.remove("a"))
+        self.assertEqual(store.members(), ["b"])
+
+    def test_in_memory_presence(self):
+        self.check_store(InMemoryPresence())
+
+    def test_cache_presence(self):
+        self.check_store(CachePresence())
+
+    def test_cache_presence_counts_concurrent_sockets(self):
+        """
+        Users with sockets in many threads leave as many times as they join
+        """
+        store = CachePresence()
+        joined, left = [], []
+
+        def worker(username):
+            for _ in range(10):
+                if store.add(username):
+                    joined.append(username)
+            for _ in range(10):
+                if store.remove(username):
+                    left.append(username)
+
+        threads = [
+            threading.Thread(target=worker, args=(name,))
+            for name in ("a", "b", "c")
+            for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for name in ("a", "b", "c"):
+            self.assertGreater(joined.count(name), 0)
+            self.assertEqual(joined.count(name), left.count(name))
+        self.assertEqual(store.members(), [])
+
+
+class FakeChannelLayer:
+    def __init__(self):
+        self.sent = []
+
+    async def group_send(self, group, message):
+        self.sent.append((time.monotonic(), message["message"]))
+
+
+@override_settings(LOBBY_BATCH_WINDOW=0.05, LOBBY_BATCH_MAX_DELAY=0.2)
+class PresenceBatcherTest(TestCase):
+    def test_events_are_batched(self):
+        """
+        Events close to each other are sent together, and a reconnect cancels out
+        """
+
+        async def run():
+            layer, batcher = FakeChannelLayer(), PresenceBatcher("lobby")
+            for username in ("a", "b", "c"):
+                batcher.add(layer, "joined", username)
+            batcher.add(layer, "left", "c")
+            batcher.add(layer, "left", "d")
+            batcher.add(layer, "joined", "d")
+            await asyncio.sleep(0.1)
+            return layer.sent, batcher.stats
+
+        sent, stats = async_to_sync(run)()
+        self.assertEqual(
+            [message for _, message in sent],
+            [{"type": "batch", "joined": ["a", "b"], "left": []}],
+        )
+        self.assertEqual(stats["suppressed"], 5)
+
+    def test_max_delay(self):
+        """
+        A steady stream of events is still sent every LOBBY_BATCH_MAX_DELAY
+        """
+
+        async def run():
+            layer, batcher = FakeChannelLayer(), PresenceBatcher("lobby")
+            started = time.monotonic()
+            for i in range(20):
+                batcher.add(layer, "joined", str(i))
+                await asyncio.sleep(0.02)
+            await batcher.flush()
+            return started, layer.sent
+
+        started, sent = async_to_sync(run)()
+        self.assertGreater(len(sent), 1)
+        self.assertLess(sent[0][0] - started, 0.3)
+        joined = [username for _, message in sent for username in message["joined"]]
+        self.assertEqual(sorted(joined, key=int), [str(i) for i in range(20)])
+
+
+@override_settings(
+    CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}},
+    LOBBY_BATCH_WINDOW=0.2,
+    LOBBY_BATCH_MAX_DELAY=1.0,
+)
+class LobbyConsumerTest(TransactionTestCase):
+    def setUp(self):
+        get_presence().clear()
+        lobby_batcher.clear()
+
+    def test_reconnect_storm_is_batched(self):
+        """
+        Only the new sockets get a snapshot, everyone gets a single batch
+        """
+
+        async def run():
+            sockets, snapshots = [], []
+            for _ in range(10):
+                socket = WebsocketCommunicator(
+                    URLRouter(lobby_urlpatterns), "/ws/lobby/"
+                )
+                await socket.connect()
+                snapshots.append(json.loads(await socket.receive_from()))
+                sockets.append(socket)
+            batches = [json.loads(await socket.receive_from()) for socket in sockets]
+            nothing_else = await sockets[0].receive_nothing(0.3)
+            await sockets[-1].disconnect()
+            left = json.loads(await sockets[0].receive_from())
+            for socket in sockets[:-1]:
+                await socket.disconnect()
+            return snapshots, batches, nothing_else, left
+
+        snapshots, batches, nothing_else, left = async_to_sync(run)()
+        users = snapshots[-1]["users"]
+        self.assertEqual(len(users), 10)
+        self.assertEqual([len(x["users"]) for x in snapshots], list(range(1, 11)))
+        for batch in batches:
+            self.assertEqual(batch, {"type": "batch", "joined": users, "left": []})
+        self.assertTrue(nothing_else)
+        self.assertEqual(len(left["left"]), 1)
+        self.assertEqual(get_presence().members(), [])